@@ -0,0 +1,99 @@
+"""
+Benchmark of the BM25 index used for hybrid search: build time, save and load time, size on disk
+and the latency of a lexical lookup, which is added to every hybrid query.
+
+Chunks are taken from the cleaned sections if there are any, otherwise made up from a vocabulary
+of random words with a few medical abbreviations mixed in, and indexed in a temporary folder.
+
+    python benchmark_bm25.py --chunks=200000
+"""
+
+# Standard imports
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+# Internal imports
+from const import PATH_TO_CLEANED_DATA
+from config import HYBRID_CANDIDATES
+from bm25 import BM25Index
+from benchmark_embedding import load_chunks
+
+# External imports
+import numpy as np
+
+QUERIES = [
+    "What is CAH?",
+    "When is a TEE preferred over a TTE?",
+    "Side effects of DMARDs",
+    "Diagnosis of Kawasaki disease",
+    "Mechanism of action of metformin",
+]
+ABBREVIATIONS = ["CAH", "TEE", "TTE", "DMARDs", "Kawasaki", "metformin"]
+
+
+def made_up_chunks(count: int, seed: int = 0) -> list:
+    """
+    Function that makes up chunks of 80 to 200 words from a vocabulary of 20000.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f"term{i}" for i in range(20000)] + ABBREVIATIONS)
+    return [
+        " ".join(rng.choice(words, rng.integers(80, 200))) + "." for _ in range(count)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the BM25 index.")
+    parser.add_argument(
+        "--chunks", type=int, default=200000, help="Chunks to index (default: 200000)"
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_CLEANED_DATA),
+        help=f"Folder holding the cleaned sections (default: {PATH_TO_CLEANED_DATA})",
+    )
+    args = parser.parse_args()
+
+    if args.path.exists():
+        chunks = load_chunks(args.path, args.chunks)
+    else:
+        chunks = made_up_chunks(args.chunks)
+
+    with tempfile.TemporaryDirectory() as folder:
+        index = BM25Index(Path(folder) / "bm25_index")
+        start = time.perf_counter()
+        index.add(
+            [str(i) for i in range(len(chunks))],
+            [f"section {i // 50}" for i in range(len(chunks))],
+            chunks,
+        )
+        index.commit()
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.save("benchmark")
+        save = time.perf_counter() - start
+        size = sum(f.stat().st_size for f in Path(folder).iterdir())
+        start = time.perf_counter()
+        index = BM25Index(Path(folder) / "bm25_index")
+        load = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(20):
+            for query in QUERIES:
+                start = time.perf_counter()
+                index.search(query, HYBRID_CANDIDATES)
+                latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+    print(f"\n{len(chunks)} chunks")
+    print(f"build  {build:7.2f} s   save {save:5.2f} s   load {load:5.2f} s")
+    print(f"size   {size / 2**20:7.1f} MiB")
+    print(
+        f"search p50 {statistics.median(latencies):6.2f} ms  "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:6.2f} ms"
+    )
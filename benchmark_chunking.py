@@ -0,0 +1,122 @@
+"""
+Benchmark comparing the chunkers on the largest cleaned sections.
+
+Three chunkers are timed on the same sections:
+- quadratic: the original word-count loop, which re-joins and re-splits the chunk after every sentence
+- words: the same word-count chunking with a running total (utils.chunk_text)
+- tokens: chunking by the embedding model's tokens with overlap (utils.chunk_text_tokens)
+
+For each one it reports how many chunks come out longer than the embedding model reads, and how many
+tokens are cut off because of it. Needs the embedding model's tokenizer (transformers).
+
+    python benchmark_chunking.py --sections=20
+"""
+
+# Standard imports
+import os
+import time
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# Internal imports
+from const import PATH_TO_CLEANED_DATA
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from utils import chunk_text, chunk_text_tokens, get_tokenizer, sentence_splitter
+
+
+def _quadratic_chunk_text(text: str, max_chunk_size: int = 256) -> List[str]:
+    """
+    The word-count chunker as it was originally written, kept as the baseline.
+    """
+    sentences = sentence_splitter(text)
+    chunks = []
+    current_chunk = []
+    for sentence in sentences:
+        current_chunk.append(sentence)
+        if len(" ".join(current_chunk).split()) > max_chunk_size:
+            current_chunk.pop()
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [sentence]
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+def largest_sections(path: Path, count: int) -> Dict[str, str]:
+    """
+    Function that reads the largest cleaned sections.
+
+    Parameters:
+    - path: Path, folder holding the cleaned sections
+    - count: int, number of sections to read
+
+    Returns:
+    - dict, section file names mapped to their text
+    """
+    files = sorted(
+        (f for f in os.listdir(path) if f.endswith(".txt")),
+        key=lambda f: os.path.getsize(path / f),
+        reverse=True,
+    )[:count]
+    sections = {}
+    for file in files:
+        with open(path / file, "r", encoding="utf-8") as f:
+            sections[file] = f.read()
+    return sections
+
+
+def run(
+    name: str, chunker: Callable[[str], List[str]], sections: Dict[str, str], tokenizer
+) -> None:
+    """
+    Function that times a chunker and reports how much of its output the model would cut off.
+    """
+    start = time.perf_counter()
+    chunks = [c for text in sections.values() for c in chunker(text)]
+    seconds = time.perf_counter() - start
+
+    # Tokenized with the special tokens, like the model does
+    lengths = [len(ids) for ids in tokenizer(chunks)["input_ids"]] if chunks else []
+    over = [n for n in lengths if n > CHUNK_MAX_TOKENS]
+    lost = sum(n - CHUNK_MAX_TOKENS for n in over)
+    print(
+        f"{name:<10} {seconds:8.3f} s  {len(chunks):7d} chunks  "
+        f"{len(over):6d} over {CHUNK_MAX_TOKENS} tokens  "
+        f"{lost:8d} tokens cut off ({lost / max(sum(lengths), 1):.1%})"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the chunkers.")
+    parser.add_argument(
+        "--sections",
+        type=int,
+        default=20,
+        help="Number of the largest cleaned sections to chunk (default: 20)",
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_CLEANED_DATA),
+        help=f"Folder holding the cleaned sections (default: {PATH_TO_CLEANED_DATA})",
+    )
+    args = parser.parse_args()
+
+    sections = largest_sections(args.path, args.sections)
+    if not sections:
+        raise SystemExit(f"No cleaned sections in {args.path}, clean the data first.")
+    words = sum(len(text.split()) for text in sections.values())
+    print(f"{len(sections)} sections, {words} words")
+
+    tokenizer = get_tokenizer()
+    run("quadratic", _quadratic_chunk_text, sections, tokenizer)
+    run("words", chunk_text, sections, tokenizer)
+    run(
+        "tokens",
+        lambda text: chunk_text_tokens(
+            text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, tokenizer
+        ),
+        sections,
+        tokenizer,
+    )
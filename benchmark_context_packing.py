@@ -0,0 +1,209 @@
+"""
+Benchmark comparing prompts built from whole retrieved chunks against prompts packed into the token
+budget (see context_packing.py).
+
+Retrievals are made of DEFAULT_RESULTS_PER_SEARCH consecutive chunks from a few sections, like a
+search often returns. The chunks are cut from the cleaned sections if there are any, otherwise from
+made-up sections, with the overlap between consecutive chunks the chunker adds. For both kinds of
+prompt it reports the prompt tokens and the share of the sources still cited. With --ollama it also
+sends every prompt to Ollama and reports the time to the first token of the answer and the prompt
+tokens Ollama counted.
+
+    python benchmark_context_packing.py --queries=20 --budget=1200
+    python benchmark_context_packing.py --queries=5 --ollama=True
+"""
+
+# Standard imports
+import os
+import time
+import argparse
+import statistics
+from pathlib import Path
+from typing import List, Tuple
+
+# Internal imports
+from const import PATH_TO_CLEANED_DATA, SOURCE_TEMPLATE, SYSTEM_PROMPT_TEMPLATE
+from config import (
+    DEFAULT_RESULTS_PER_SEARCH,
+    CONTEXT_TOKEN_BUDGET,
+    CHUNK_OVERLAP_TOKENS,
+)
+from context_packing import TokenCounter, pack_context
+from benchmark_embedding import QUERIES
+
+# External imports
+import numpy as np
+
+
+def made_up_sections(count: int, seed: int = 0) -> List[Tuple[str, List[str]]]:
+    """
+    Function that makes up chunked sections, consecutive chunks sharing their last/first two sentences.
+
+    Returns:
+    - list of (section title, chunks in order)
+    """
+    rng = np.random.default_rng(seed)
+    words = " ".join(QUERIES).replace("?", "").split()
+    sections = []
+    for i in range(count):
+        sentences = [
+            " ".join(rng.choice(words, rng.integers(8, 30))).capitalize() + "."
+            for _ in range(60)
+        ]
+        chunks = [" ".join(sentences[start : start + 12]) for start in range(0, 50, 10)]
+        sections.append((f"Made up section {i}", chunks))
+    return sections
+
+
+def cleaned_sections(path: Path, count: int) -> List[Tuple[str, List[str]]]:
+    """
+    Function that chunks the largest cleaned sections with the pipeline's chunker.
+
+    Returns:
+    - list of (section title, chunks in order)
+    """
+    from utils import chunk
+
+    files = sorted(
+        (f for f in os.listdir(path) if f.endswith(".txt")),
+        key=lambda f: os.path.getsize(path / f),
+        reverse=True,
+    )[:count]
+    sections = []
+    for file in files:
+        with open(path / file, "r", encoding="utf-8") as f:
+            sections.append((file[: -len(".txt")], chunk(f.read())))
+    return sections
+
+
+def retrievals(
+    sections: List[Tuple[str, List[str]]], queries: int, seed: int = 0
+) -> List[List[Tuple[str, str]]]:
+    """
+    Function that makes up search results: runs of consecutive chunks from two or three sections.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for _ in range(queries):
+        sources = []
+        while len(sources) < DEFAULT_RESULTS_PER_SEARCH:
+            title, chunks = sections[rng.integers(len(sections))]
+            start = rng.integers(max(1, len(chunks) - 2))
+            run = chunks[start : start + rng.integers(2, 4)]
+            sources.extend((title, text) for text in run)
+        results.append(sources[:DEFAULT_RESULTS_PER_SEARCH])
+    return results
+
+
+def prompt(query: str, sources: List[Tuple[str, str]]) -> str:
+    """
+    Function that builds a prompt from sources as they are, like build_system_prompt does after packing.
+    """
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        prompt=query,
+        formatted_sources="\n\n".join(
+            SOURCE_TEMPLATE.format(name=name, content=content)
+            for name, content in sources
+        ),
+    )
+
+
+def time_to_first_token(client, prompt, send=None) -> Tuple[float, int]:
+    """
+    Function that sends a prompt to Ollama and reads the whole answer.
+
+    Parameters:
+    - client: OllamaClient, the client
+    - prompt: the prompt, a string or chat messages
+    - send: the client's method to send it with (default: generate)
+
+    Returns:
+    - tuple in the format (seconds to the first token, prompt tokens counted by Ollama)
+    """
+    send = send or client.generate
+    counted = []
+    client.on_prompt_eval = lambda _, tokens: counted.append(tokens)
+    start = time.perf_counter()
+    first = None
+    for token in send(prompt):
+        if first is None and token:
+            first = time.perf_counter() - start
+    return first or 0.0, counted[-1] if counted else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark context packing.")
+    parser.add_argument(
+        "--queries", type=int, default=20, help="Prompts to build (default: 20)"
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=CONTEXT_TOKEN_BUDGET,
+        help=f"Tokens the sources may take (default: {CONTEXT_TOKEN_BUDGET})",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default=None,
+        help="Hugging Face name of the LLM's tokenizer (default: estimate from characters)",
+    )
+    parser.add_argument(
+        "--ollama",
+        type=lambda x: x.lower() == "true",
+        default=False,
+        help="Also time the first token of every answer with Ollama (default: False)",
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_CLEANED_DATA),
+        help=f"Folder holding the cleaned sections (default: {PATH_TO_CLEANED_DATA})",
+    )
+    args = parser.parse_args()
+
+    if args.path.exists() and any(f.endswith(".txt") for f in os.listdir(args.path)):
+        sections = cleaned_sections(args.path, 20)
+    else:
+        print(
+            f"No cleaned sections in {args.path}, making them up "
+            f"(overlap of 2 sentences instead of {CHUNK_OVERLAP_TOKENS} tokens)."
+        )
+        sections = made_up_sections(20)
+
+    counter = TokenCounter(args.tokenizer)
+    rows = {"whole": [], "packed": []}
+    prompts = {"whole": [], "packed": []}
+    for i, sources in enumerate(retrievals(sections, args.queries)):
+        query = QUERIES[i % len(QUERIES)]
+        cited = {name for name, _ in sources}
+        for kind, used in [
+            ("whole", sources),
+            ("packed", pack_context(sources, args.budget, counter)),
+        ]:
+            text = prompt(query, used)
+            prompts[kind].append(text)
+            rows[kind].append(
+                (counter.count(text), len({n for n, _ in used}) / len(cited))
+            )
+
+    print(f"\n{args.queries} prompts of {DEFAULT_RESULTS_PER_SEARCH} chunks")
+    for kind, values in rows.items():
+        print(
+            f"{kind:<7} prompt tokens {statistics.mean(t for t, _ in values):7.1f}  "
+            f"sources cited {statistics.mean(c for _, c in values):6.1%}"
+        )
+
+    if args.ollama:
+        from ollama_client import OllamaClient
+
+        client = OllamaClient()
+        time_to_first_token(client, "Hi")  # Load the model
+        for kind, texts in prompts.items():
+            timings = [time_to_first_token(client, text) for text in texts]
+            print(
+                f"{kind:<7} time to first token "
+                f"{statistics.median(t for t, _ in timings):6.2f} s  "
+                f"prompt tokens counted by Ollama "
+                f"{statistics.mean(n for _, n in timings):7.1f}"
+            )
@@ -0,0 +1,133 @@
+"""
+Benchmark comparing the embedding backends: PyTorch (sentence-transformers), ONNX and ONNX with int8 weights.
+
+For each backend it reports the latency of embedding one query at a time, the throughput of embedding
+chunks in batches like vectorizing does, and the lowest cosine similarity of its embeddings to
+PyTorch's. Chunks are taken from the cleaned sections if there are any, otherwise made up.
+Needs torch, sentence-transformers, onnx and onnxruntime.
+
+    python benchmark_embedding.py --chunks=2000 --threads=4
+"""
+
+# Standard imports
+import os
+import time
+import argparse
+import statistics
+from pathlib import Path
+from typing import List
+
+# Internal imports
+from const import PATH_TO_CLEANED_DATA
+from config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, ONNX_THREADS
+from onnx_embedding import OnnxEmbeddingModel
+from utils import chunk
+
+# External imports
+import numpy as np
+
+QUERIES = [
+    "What causes atrial fibrillation?",
+    "First-line treatment of hypertension",
+    "How is rheumatoid arthritis diagnosed?",
+    "Complications of Barrett's esophagus",
+    "Pathophysiology of congenital adrenal hyperplasia",
+]
+
+
+def load_chunks(path: Path, count: int) -> List[str]:
+    """
+    Function that chunks cleaned sections until there are enough chunks, or makes chunks up.
+
+    Parameters:
+    - path: Path, folder holding the cleaned sections
+    - count: int, number of chunks wanted
+
+    Returns:
+    - list[str], the chunks
+    """
+    chunks = []
+    if path.exists():
+        for file in sorted(os.listdir(path)):
+            if len(chunks) >= count:
+                break
+            if file.endswith(".txt"):
+                with open(path / file, "r", encoding="utf-8") as f:
+                    chunks.extend(chunk(f.read()))
+    rng = np.random.default_rng(0)
+    words = " ".join(QUERIES).split()
+    while len(chunks) < count:
+        chunks.append(" ".join(rng.choice(words, rng.integers(20, 200))) + ".")
+    return chunks[:count]
+
+
+def benchmark(name: str, model, chunks: List[str], reference: np.ndarray) -> None:
+    """
+    Function that times a backend and compares its embeddings with the reference ones.
+    """
+    model.encode(QUERIES[0])  # Warm up
+    latencies = []
+    for _ in range(20):
+        for query in QUERIES:
+            start = time.perf_counter()
+            model.encode(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    # Sorted by length like embed_chunks does, so batches waste little padding
+    ordered = sorted(chunks, key=len, reverse=True)
+    start = time.perf_counter()
+    embeddings = model.encode(
+        ordered, batch_size=EMBEDDING_BATCH_SIZE, convert_to_numpy=True
+    )
+    seconds = time.perf_counter() - start
+
+    similarity = (embeddings * reference).sum(axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+    )
+    print(
+        f"{name:<10} query p50 {statistics.median(latencies):7.2f} ms  "
+        f"bulk {len(chunks) / seconds:8.1f} chunks/s  "
+        f"min cosine to torch {similarity.min():.5f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the embedding backends.")
+    parser.add_argument(
+        "--chunks", type=int, default=2000, help="Chunks to embed (default: 2000)"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=ONNX_THREADS,
+        help=f"Threads for onnxruntime, 0 for one per core (default: {ONNX_THREADS})",
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_CLEANED_DATA),
+        help=f"Folder holding the cleaned sections (default: {PATH_TO_CLEANED_DATA})",
+    )
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    chunks = load_chunks(args.path, args.chunks)
+    torch_model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    ordered = sorted(chunks, key=len, reverse=True)
+    reference = torch_model.encode(ordered, batch_size=EMBEDDING_BATCH_SIZE)
+
+    print(f"\n{len(chunks)} chunks, batches of {EMBEDDING_BATCH_SIZE}")
+    benchmark("torch", torch_model, chunks, reference)
+    benchmark(
+        "onnx",
+        OnnxEmbeddingModel(quantize=False, threads=args.threads),
+        chunks,
+        reference,
+    )
+    benchmark(
+        "onnx int8",
+        OnnxEmbeddingModel(quantize=True, threads=args.threads),
+        chunks,
+        reference,
+    )
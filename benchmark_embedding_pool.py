@@ -0,0 +1,69 @@
+"""
+Benchmark of bulk embedding throughput with the embedding worker pool, for several numbers of workers.
+
+Every run embeds the same chunks (from the cleaned sections if there are any, otherwise made up)
+and is checked against embedding them in this process. The time of starting the workers and
+loading the model in them is reported apart from the embedding itself.
+
+    python benchmark_embedding_pool.py --chunks=8000 --workers 1 2 4 8
+"""
+
+# Standard imports
+import time
+import argparse
+from pathlib import Path
+
+# Internal imports
+from const import PATH_TO_CLEANED_DATA
+from utils import embed_chunks
+from embedding_pool import EmbeddingPool
+from benchmark_embedding import load_chunks
+
+# External imports
+import numpy as np
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the embedding pool.")
+    parser.add_argument(
+        "--chunks", type=int, default=8000, help="Chunks to embed (default: 8000)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Numbers of worker processes to try (default: 1 2 4)",
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_CLEANED_DATA),
+        help=f"Folder holding the cleaned sections (default: {PATH_TO_CLEANED_DATA})",
+    )
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.path, args.chunks)
+    embed_chunks(chunks[:64])  # Load the model before timing
+    start = time.perf_counter()
+    reference = embed_chunks(chunks)
+    seconds = time.perf_counter() - start
+    print(f"\n{len(chunks)} chunks")
+    print(f"in process  {len(chunks) / seconds:8.1f} chunks/s")
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        with EmbeddingPool(workers) as pool:
+            # A few small tasks so every worker is started and has loaded the model
+            pool.embed_chunks(
+                chunks[: workers * pool.batch_size * pool.batches_per_task]
+            )
+            startup = time.perf_counter() - start
+
+            start = time.perf_counter()
+            embeddings = pool.embed_chunks(chunks)
+            seconds = time.perf_counter() - start
+        drift = np.abs(embeddings - reference).max()
+        print(
+            f"{workers:2d} workers  {len(chunks) / seconds:8.1f} chunks/s  "
+            f"startup {startup:6.2f} s  max difference {drift:.2e}"
+        )
@@ -0,0 +1,120 @@
+"""
+Benchmark for how long it takes to import the project's modules.
+
+Tooling commands (converting shards, checking the manifest, loading vectorized data) should start
+in well under a second, which only holds as long as no module loads torch, the embedding model,
+chromadb or the document parsers when it is imported. Each module is imported in a fresh
+interpreter several times and the median time is reported.
+
+The script exits with a non-zero status if a module takes longer than the budget or imports one
+of the heavy packages, so it can be used to hold the line:
+
+    python benchmark_import_time.py --budget=0.5
+"""
+
+# Standard imports
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+MODULES = [
+    "utils",
+    "shards",
+    "manifest",
+    "data_handler",
+    "chroma",
+    "pipeline",
+    "server",
+    "ollama_client",
+    "vector_store",
+    "text_store",
+    "ivf_pq",
+    "onnx_embedding",
+    "embedding_pool",
+    "bm25",
+    "context_packing",
+    "warmup",
+    "synthetic_corpus",
+]
+
+# Packages that should only ever be imported on first use
+HEAVY_PACKAGES = [
+    "torch",
+    "sentence_transformers",
+    "transformers",
+    "chromadb",
+    "onnxruntime",
+    "fitz",
+    "pptx",
+    "lxml",
+    "docx2txt",
+]
+
+# Run in a fresh interpreter, prints the import time and any heavy packages that got imported
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [p for p in {heavy!r} if p in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def time_import(module: str, repeats: int) -> dict:
+    """
+    Function that times importing a module in fresh interpreters.
+
+    Parameters:
+    - module: str, name of the module to import
+    - repeats: int, number of interpreters to time it in
+
+    Returns:
+    - dict with the median import time in seconds and the heavy packages it imported
+    """
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_PACKAGES)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "seconds": statistics.median(run["seconds"] for run in runs),
+        "heavy": runs[0]["heavy"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark module import times.")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.0,
+        help="Maximum import time in seconds for any module (default: 1.0)",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="Number of fresh interpreters to time each import in (default: 5)",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        result = time_import(module, args.repeats)
+        status = "ok"
+        if result["seconds"] > args.budget:
+            status = "over budget"
+            failed = True
+        if result["heavy"]:
+            status = f"imports {', '.join(result['heavy'])}"
+            failed = True
+        print(f"{module:<15} {result['seconds'] * 1000:8.1f} ms  {status}")
+
+    sys.exit(1 if failed else 0)
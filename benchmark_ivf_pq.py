@@ -0,0 +1,137 @@
+"""
+Benchmark comparing the IVF-PQ index against exact search with the numpy index.
+
+Both are filled with the same synthetic clustered embeddings (see benchmark_quantization.py) in a
+temporary folder and queried with noisy copies of stored chunks. It reports the memory held by each
+index (the embeddings for the numpy index, the codes plus the chunk ids, titles and text offsets
+for IVF-PQ), how long it took to build, and for every nprobe asked for the search latency and
+recall@n_results against the exact results.
+
+    python benchmark_ivf_pq.py --chunks=200000 --nprobe 8 16 32 64
+"""
+
+# Standard imports
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import List, Set
+
+# Internal imports
+from config import IVF_PQ_SUBSPACES
+from ivf_pq import IVFPQVectorStore
+from vector_store import NumpyVectorStore
+from benchmark_vector_store import _SyntheticData
+from benchmark_quantization import clustered_embeddings
+
+# External imports
+import numpy as np
+
+
+def run(store, queries: np.ndarray, n_results: int) -> tuple[List[float], List[Set]]:
+    """
+    Function that times one search per query.
+
+    Returns:
+    - tuple in the format (latencies in milliseconds, rows found for every query)
+    """
+    store.top_k(queries[:1], n_results)  # Warm up
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        found = store.top_k(query, n_results)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({row for row, _ in found})
+    return latencies, results
+
+
+def report(
+    name: str,
+    memory_bytes: int,
+    latencies: List[float],
+    results: List[Set],
+    exact: List[Set],
+) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    recall = statistics.mean(
+        len(found & truth) / len(truth) for found, truth in zip(results, exact)
+    )
+    print(
+        f"{name:<14} memory {memory_bytes / 2**20:8.1f} MiB  "
+        f"search p50 {statistics.median(latencies):7.3f} ms  "
+        f"p95 {p95:7.3f} ms  recall {recall:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the IVF-PQ index.")
+    parser.add_argument(
+        "--chunks", type=int, default=100000, help="Number of chunks (default: 100000)"
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=384,
+        help="Embedding dimensions (default: 384, like all-MiniLM-L6-v2)",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=200, help="Number of queries (default: 200)"
+    )
+    parser.add_argument(
+        "--n_results", type=int, default=7, help="Results per search (default: 7)"
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="Inverted lists (default: 4 * sqrt(chunks))",
+    )
+    parser.add_argument(
+        "--subspaces",
+        type=int,
+        default=IVF_PQ_SUBSPACES,
+        help=f"Bytes per chunk (default: {IVF_PQ_SUBSPACES})",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=[8, 16, 32, 64],
+        help="Numbers of lists to score per query (default: 8 16 32 64)",
+    )
+    args = parser.parse_args()
+    nlist = args.nlist or int(4 * np.sqrt(args.chunks))
+
+    data = _SyntheticData(1, args.dimensions, chunks_per_section=50, seed=0)
+    data.embeddings = clustered_embeddings(
+        args.chunks, args.dimensions, clusters=max(args.chunks // 250, 1), seed=0
+    )
+    rng = np.random.default_rng(1)
+    queries = data.embeddings[rng.integers(0, args.chunks, args.queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        flat = NumpyVectorStore(Path(tmp) / "numpy_index", quantization=None)
+        flat.add_data(data)
+        flat_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = IVFPQVectorStore(
+            Path(tmp) / "ivf_pq_index", nlist=nlist, subspaces=args.subspaces
+        )
+        store.add_data(data)
+        ivf_build = time.perf_counter() - start
+
+        print(f"\n{args.chunks} chunks, {args.queries} queries, top {args.n_results}")
+        print(f"flat build {flat_build:.2f} s, ivf_pq build {ivf_build:.2f} s")
+        print(f"ivf_pq with {nlist} lists and {args.subspaces} bytes per chunk")
+        latencies, exact = run(flat, queries, args.n_results)
+        report("flat (exact)", flat.memory_bytes, latencies, exact, exact)
+        for nprobe in args.nprobe:
+            store.nprobe = nprobe
+            latencies, results = run(store, queries, args.n_results)
+            report(f"nprobe {nprobe}", store.memory_bytes, latencies, results, exact)
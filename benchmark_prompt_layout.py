@@ -0,0 +1,123 @@
+"""
+Benchmark comparing the prompt layouts: SYSTEM_PROMPT_TEMPLATE sent to /api/generate, with the question
+and sources ahead of the instructions, and the chat messages (static system message first, sources and
+question last) sent to /api/chat.
+
+Ollama keeps the tokens of the last prompt it evaluated and only evaluates a new prompt from the first
+token where the two differ. For a run of questions this reports, for each layout, the tokens of a
+prompt, how many of them are shared with the prompt before it and so can be reused, and how many
+have to be evaluated (prefill). The retrievals are made like in benchmark_context_packing.py, and
+packed the same way for both layouts. With --ollama it also sends every prompt to Ollama and reports
+the prompt tokens it evaluated and the time to the first token of the answer.
+
+    python benchmark_prompt_layout.py --queries=20
+    python benchmark_prompt_layout.py --queries=5 --ollama=True
+"""
+
+# Standard imports
+import os
+import argparse
+import statistics
+from pathlib import Path
+
+# Internal imports
+from const import PATH_TO_CLEANED_DATA
+from config import CONTEXT_TOKEN_BUDGET
+from context_packing import TokenCounter
+from pipeline import build_system_prompt, build_chat_messages
+from benchmark_embedding import QUERIES
+from benchmark_context_packing import (
+    made_up_sections,
+    cleaned_sections,
+    retrievals,
+    time_to_first_token,
+)
+
+
+def rendered(prompt) -> str:
+    """
+    Function that writes a prompt out as one text, the chat messages in order like a chat template does.
+    """
+    if isinstance(prompt, str):
+        return prompt
+    return "\n\n".join(message["content"] for message in prompt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the prompt layouts.")
+    parser.add_argument(
+        "--queries", type=int, default=20, help="Questions asked in a row (default: 20)"
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=CONTEXT_TOKEN_BUDGET,
+        help=f"Tokens the sources may take (default: {CONTEXT_TOKEN_BUDGET})",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        type=str,
+        default=None,
+        help="Hugging Face name of the LLM's tokenizer (default: estimate from characters)",
+    )
+    parser.add_argument(
+        "--ollama",
+        type=lambda x: x.lower() == "true",
+        default=False,
+        help="Also send every prompt to Ollama (default: False)",
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_CLEANED_DATA),
+        help=f"Folder holding the cleaned sections (default: {PATH_TO_CLEANED_DATA})",
+    )
+    args = parser.parse_args()
+
+    if args.path.exists() and any(f.endswith(".txt") for f in os.listdir(args.path)):
+        sections = cleaned_sections(args.path, 20)
+    else:
+        sections = made_up_sections(20)
+    questions = [
+        (QUERIES[i % len(QUERIES)], sources)
+        for i, sources in enumerate(retrievals(sections, args.queries))
+    ]
+
+    counter = TokenCounter(args.tokenizer)
+    prompts = {}
+    print(f"\n{args.queries} questions in a row")
+    for layout, build in [
+        ("generate", build_system_prompt),
+        ("chat", build_chat_messages),
+    ]:
+        prompts[layout] = [build(q, sources, args.budget) for q, sources in questions]
+        totals, reused = [], []
+        previous = ""
+        for prompt in prompts[layout]:
+            text = rendered(prompt)
+            totals.append(counter.count(text))
+            reused.append(counter.count(os.path.commonprefix([previous, text])))
+            previous = text
+        # The first prompt has nothing to reuse
+        prefill = [t - r for t, r in zip(totals[1:], reused[1:])]
+        print(
+            f"{layout:<9} prompt tokens {statistics.mean(totals):7.1f}  "
+            f"reused {statistics.mean(reused[1:]):7.1f}  "
+            f"prefill {statistics.mean(prefill):7.1f}"
+        )
+
+    if args.ollama:
+        from ollama_client import OllamaClient
+
+        client = OllamaClient()
+        for layout, layout_prompts in prompts.items():
+            send = client.chat if layout == "chat" else client.generate
+            # The first prompt fills the cache (and loads the model)
+            timings = [
+                time_to_first_token(client, prompt, send) for prompt in layout_prompts
+            ][1:]
+            print(
+                f"{layout:<9} prompt tokens evaluated by Ollama "
+                f"{statistics.mean(n for _, n in timings):7.1f}  "
+                f"time to first token {statistics.median(t for t, _ in timings):6.2f} s"
+            )
@@ -0,0 +1,131 @@
+"""
+Benchmark comparing the quantized modes of the numpy index against exact float32 search.
+
+The index is filled with synthetic normalized embeddings (sized like MiniLM's) drawn around cluster
+centres, so neighbours are close together like real text embeddings, and queried with noisy copies
+of stored chunks. For every mode it reports the embeddings held in memory, the search latency and
+recall@n_results against the exact float32 results, for each rescore factor asked for.
+
+    python benchmark_quantization.py --chunks=200000 --rescore 2 5 10
+"""
+
+# Standard imports
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import List, Set
+
+# Internal imports
+from vector_store import NumpyVectorStore
+from benchmark_vector_store import _SyntheticData
+
+# External imports
+import numpy as np
+
+
+def clustered_embeddings(
+    chunks: int, dimensions: int, clusters: int, seed: int
+) -> np.ndarray:
+    """
+    Function that draws normalized embeddings around random cluster centres.
+
+    Parameters:
+    - chunks: int, number of embeddings
+    - dimensions: int, dimensions of every embedding
+    - clusters: int, number of cluster centres
+    - seed: int, seed of the random generator
+
+    Returns:
+    - np.array, (chunks, dimensions) normalized embeddings
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimensions), dtype=np.float32)
+    embeddings = centres[rng.integers(0, clusters, chunks)]
+    embeddings += 0.7 * rng.standard_normal((chunks, dimensions), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def run(
+    store: NumpyVectorStore, queries: np.ndarray, n_results: int
+) -> tuple[List[float], List[Set[int]]]:
+    """
+    Function that times one search per query.
+
+    Returns:
+    - tuple in the format (latencies in milliseconds, rows found for every query)
+    """
+    store.top_k(queries[:1], n_results)  # Warm up
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        found = store.top_k(query, n_results)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({row for row, _ in found})
+    return latencies, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark quantized numpy indexes.")
+    parser.add_argument(
+        "--chunks", type=int, default=100000, help="Number of chunks (default: 100000)"
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=384,
+        help="Embedding dimensions (default: 384, like all-MiniLM-L6-v2)",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=200, help="Number of queries (default: 200)"
+    )
+    parser.add_argument(
+        "--n_results", type=int, default=7, help="Results per search (default: 7)"
+    )
+    parser.add_argument(
+        "--rescore",
+        type=int,
+        nargs="+",
+        default=[1, 3, 10],
+        help="Rescore factors to try for the quantized modes (default: 1 3 10)",
+    )
+    args = parser.parse_args()
+
+    data = _SyntheticData(1, args.dimensions, chunks_per_section=50, seed=0)
+    data.embeddings = clustered_embeddings(
+        args.chunks, args.dimensions, clusters=max(args.chunks // 250, 1), seed=0
+    )
+    rng = np.random.default_rng(1)
+    queries = data.embeddings[rng.integers(0, args.chunks, args.queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    print(f"\n{args.chunks} chunks, {args.queries} queries, top {args.n_results}")
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = None
+        for quantization in [None, "float16", "int8"]:
+            store = NumpyVectorStore(
+                Path(tmp) / str(quantization) / "numpy_index",
+                quantization=quantization,
+            )
+            store.add_data(data)
+            for rescore in args.rescore if quantization else [1]:
+                store.rescore = rescore
+                latencies, results = run(store, queries, args.n_results)
+                if exact is None:
+                    exact = results
+                recall = statistics.mean(
+                    len(found & truth) / len(truth)
+                    for found, truth in zip(results, exact)
+                )
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                name = f"{quantization or 'float32'}" + (
+                    f" x{rescore}" if quantization else ""
+                )
+                print(
+                    f"{name:<12} memory {store.memory_bytes / 2**20:8.1f} MiB  "
+                    f"search p50 {statistics.median(latencies):7.3f} ms  "
+                    f"p95 {p95:7.3f} ms  recall@{args.n_results} {recall:.3f}"
+                )
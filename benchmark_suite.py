@@ -0,0 +1,382 @@
+"""
+Benchmark suite timing every stage of ingest and search on synthetic corpora, offline.
+
+For every corpus size asked for (1k to 1M chunks) it times:
+- chunking: made-up sections cut into chunks by the pipeline's chunker (utils.chunk_text_tokens, or
+  utils.chunk_text without the tokenizer)
+- embedding: chunks embedded in batches (utils.embed_chunks, or RandomEmbedder without the model)
+- shards: the vectorized data saved as shards and read back in every format asked for
+- index: every vector store backend built from the shards' worth of chunks
+- query: one search per query (p50/p95/p99), query embeddings cached up front so only the store is timed
+
+Chunking and embedding run on a sample of the corpus (--sample), the later stages on all of it, with
+clustered embeddings standing in for the model's (see benchmark_quantization.py). The corpus comes
+from synthetic_corpus.py, so the same arguments give the same data on every machine. The results,
+along with the machine and settings they were measured with, are written as JSON so runs can be
+compared, e.g. before and after a change.
+
+    python benchmark_suite.py --chunks 1000 10000 100000 --output=benchmark_suite.json
+    python benchmark_suite.py --chunks 1000000 --backends numpy ivf_pq --embedder=random
+"""
+
+# Standard imports
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+# Internal imports
+from config import (
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    DEFAULT_RESULTS_PER_SEARCH,
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    IVF_PQ_NLIST,
+)
+from cache import QueryEmbeddingCache
+from shards import save_shard, load_shard
+from synthetic_corpus import (
+    RandomEmbedder,
+    SyntheticDataHandler,
+    synthetic_chunks,
+    synthetic_sections,
+)
+from benchmark_quantization import clustered_embeddings
+
+# External imports
+import numpy as np
+
+BACKENDS = ["numpy", "ivf_pq", "chroma"]
+
+
+def machine() -> dict:
+    """
+    Function that describes the machine and code a run was measured on.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "commit": commit,
+    }
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    """
+    Function that summarizes latencies in milliseconds.
+    """
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(np.mean(latencies)),
+        "queries_per_second": 1000 * len(latencies) / float(np.sum(latencies)),
+    }
+
+
+def load_embedder(kind: str):
+    """
+    Function that picks what embeds chunks: the pipeline's model ("model"), RandomEmbedder
+    ("random") or the model if it can be loaded and RandomEmbedder otherwise ("auto").
+
+    Returns:
+    - tuple in the format (name, function embedding a list of chunks, tokenizer or None)
+    """
+    if kind in ["model", "auto"]:
+        try:
+            from utils import embed_chunks, get_embedding_model, get_tokenizer
+
+            get_embedding_model()
+            return EMBEDDING_BACKEND, embed_chunks, get_tokenizer()
+        except Exception as e:
+            if kind == "model":
+                raise
+            print(f"Embedding model unavailable ({e}), using random embeddings.")
+    elif kind != "random":
+        raise ValueError(f"Unknown embedder {kind}.")
+    embedder = RandomEmbedder()
+    return "random", lambda chunks: embedder.encode(chunks), None
+
+
+def bench_chunking(sections: List[tuple], tokenizer) -> dict:
+    """
+    Function that times chunking sections with the token chunker, or the word chunker without a tokenizer.
+    """
+    from utils import chunk_text, chunk_text_tokens
+
+    if tokenizer is not None:
+        name = "tokens"
+        chunker = lambda text: chunk_text_tokens(  # noqa: E731
+            text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, tokenizer
+        )
+    else:
+        name = "words"
+        chunker = chunk_text
+    start = time.perf_counter()
+    chunks = [c for _, text in sections for c in chunker(text)]
+    seconds = time.perf_counter() - start
+    characters = sum(len(text) for _, text in sections)
+    return {
+        "chunker": name,
+        "sections": len(sections),
+        "chunks": len(chunks),
+        "seconds": seconds,
+        "chunks_per_second": len(chunks) / seconds,
+        "mb_per_second": characters / 2**20 / seconds,
+    }
+
+
+def bench_embedding(chunks: List[str], name: str, embed: Callable) -> dict:
+    """
+    Function that times embedding chunks in batches, after a warm-up batch.
+    """
+    embed(chunks[:EMBEDDING_BATCH_SIZE])
+    start = time.perf_counter()
+    embeddings = embed(chunks)
+    seconds = time.perf_counter() - start
+    return {
+        "embedder": name,
+        "chunks": len(chunks),
+        "dimensions": int(np.shape(embeddings)[1]),
+        "seconds": seconds,
+        "chunks_per_second": len(chunks) / seconds,
+    }
+
+
+def bench_shards(
+    handler: SyntheticDataHandler, formats: List[str], folder: Path
+) -> Dict[str, dict]:
+    """
+    Function that times saving the chunks as one shard and reading every section of it back.
+    """
+    vectorized_data = dict(handler.load_vectorized_data())
+    results = {}
+    for shard_format in formats:
+        name = f"vectorized_data_{shard_format}"
+        start = time.perf_counter()
+        save_shard(folder, name, vectorized_data, shard_format)
+        saved = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows = 0
+        for _, section in load_shard(folder, name, shard_format):
+            # Copied out so every page is read, npy shards are memory-mapped
+            rows += len(np.array(section["embeddings"], dtype=np.float32))
+        loaded = time.perf_counter() - start
+        results[shard_format] = {
+            "save_seconds": saved,
+            "load_seconds": loaded,
+            "bytes": sum(f.stat().st_size for f in folder.glob(f"{name}.*")),
+            "rows": rows,
+        }
+    return results
+
+
+def open_store(backend: str, folder: Path, chunks: int, query_cache):
+    """
+    Function that creates an empty vector store of a backend in a folder.
+    """
+    if backend == "numpy":
+        from vector_store import NumpyVectorStore
+
+        return NumpyVectorStore(folder / "numpy_index", query_cache)
+    if backend == "ivf_pq":
+        from ivf_pq import IVFPQVectorStore
+
+        # About 4 * sqrt(chunks) lists, fewer than the default for small corpora
+        nlist = min(IVF_PQ_NLIST, max(1, int(4 * np.sqrt(chunks))))
+        return IVFPQVectorStore(folder / "ivf_pq_index", query_cache, nlist=nlist)
+    if backend == "chroma":
+        from chroma import ChromaDB
+
+        return ChromaDB(str(folder / "chroma"), query_cache=query_cache)
+    raise ValueError(f"Unknown vector store backend {backend}.")
+
+
+def bench_store(
+    backend: str,
+    handler: SyntheticDataHandler,
+    queries: List[str],
+    query_cache: QueryEmbeddingCache,
+    folder: Path,
+) -> dict:
+    """
+    Function that times building a store from the chunks and searching it once per query.
+    """
+    start = time.perf_counter()
+    store = open_store(backend, folder, len(handler.texts), query_cache)
+    store.add_data(handler)
+    build = time.perf_counter() - start
+
+    store.search(queries[0], DEFAULT_RESULTS_PER_SEARCH)  # Warm up
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.search(query, DEFAULT_RESULTS_PER_SEARCH)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "build_seconds": build,
+        "build_chunks_per_second": len(handler.texts) / build,
+        "query": latency_summary(latencies),
+    }
+
+
+def run(chunks: int, args: argparse.Namespace, embedder: tuple) -> dict:
+    """
+    Function that runs every stage on a corpus of a number of chunks.
+    """
+    name, embed, tokenizer = embedder
+    results = {}
+    sample = min(chunks, args.sample)
+
+    # About ten chunks per section
+    sections = synthetic_sections(max(1, sample // 10), seed=args.seed)
+    results["chunking"] = bench_chunking(sections, tokenizer)
+    print(
+        f"  chunking   {results['chunking']['chunks_per_second']:10.1f} chunks/s "
+        f"({results['chunking']['chunker']})"
+    )
+
+    start = time.perf_counter()
+    texts = synthetic_chunks(chunks, seed=args.seed)
+    results["corpus_seconds"] = time.perf_counter() - start
+    results["embedding"] = bench_embedding(texts[:sample], name, embed)
+    print(
+        f"  embedding  {results['embedding']['chunks_per_second']:10.1f} chunks/s "
+        f"({name})"
+    )
+
+    embeddings = clustered_embeddings(
+        chunks, args.dimensions, max(1, chunks // 100), args.seed
+    )
+    handler = SyntheticDataHandler(embeddings, texts)
+    # Queries near stored chunks, like questions about something in the corpus
+    rng = np.random.default_rng(args.seed + 1)
+    query_cache = QueryEmbeddingCache(max_size=args.queries)
+    queries = [f"benchmark query {i}" for i in range(args.queries)]
+    rows = rng.integers(0, chunks, args.queries)
+    for query, row in zip(queries, rows):
+        noisy = embeddings[row] + 0.05 * rng.standard_normal(
+            args.dimensions, dtype=np.float32
+        )
+        query_cache.put(query, noisy / np.linalg.norm(noisy))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shard_folder = Path(tmp) / "shards"
+        shard_folder.mkdir()
+        results["shards"] = bench_shards(handler, args.shard_formats, shard_folder)
+        for shard_format, shard in results["shards"].items():
+            print(
+                f"  shards     {shard_format:<5} save {shard['save_seconds']:7.2f} s  "
+                f"load {shard['load_seconds']:7.2f} s  {shard['bytes'] / 2**20:8.1f} MiB"
+            )
+
+        results["stores"] = {}
+        for backend in args.backends:
+            store_folder = Path(tmp) / backend
+            store_folder.mkdir()
+            result = bench_store(backend, handler, queries, query_cache, store_folder)
+            results["stores"][backend] = result
+            print(
+                f"  {backend:<10} build {result['build_seconds']:7.2f} s  "
+                f"query p50 {result['query']['p50_ms']:7.3f} ms  "
+                f"p95 {result['query']['p95_ms']:7.3f} ms  "
+                f"p99 {result['query']['p99_ms']:7.3f} ms"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingest and search on synthetic corpora."
+    )
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="Corpus sizes in chunks, 1000 to 1000000 (default: 1000 10000)",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=5000,
+        help="Chunks chunked and embedded at most per corpus (default: 5000)",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=200, help="Searches per store (default: 200)"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=BACKENDS,
+        choices=BACKENDS,
+        help=f"Vector stores to build and search (default: {' '.join(BACKENDS)})",
+    )
+    parser.add_argument(
+        "--shard_formats",
+        nargs="+",
+        default=["npy"],
+        choices=["npy", "json"],
+        help="Shard formats to save and load (default: npy)",
+    )
+    parser.add_argument(
+        "--embedder",
+        default="auto",
+        choices=["auto", "model", "random"],
+        help="Embed with the model, random embeddings, or the model if it can be loaded (default: auto)",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=384,
+        help="Dimensions of the stored embeddings (default: 384, like all-MiniLM-L6-v2)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the corpus (default: 0)"
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("benchmark_suite.json"),
+        help="JSON file to write the results to (default: benchmark_suite.json)",
+    )
+    args = parser.parse_args()
+
+    embedder = load_embedder(args.embedder)
+    report = {
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine(),
+        "settings": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "results": {},
+    }
+    for chunks in args.chunks:
+        print(f"\n{chunks} chunks")
+        report["results"][str(chunks)] = run(chunks, args, embedder)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
@@ -0,0 +1,150 @@
+"""
+Benchmark comparing search latency of the vector store backends side by side.
+
+Both stores are filled with the same synthetic normalized embeddings (sized like MiniLM's) in a
+temporary folder, and the same queries are run against each. Query embeddings are put in the
+query cache up front, so the timings cover the index and not the embedding model.
+Chroma's HNSW index is approximate, so its recall against the exact numpy search is reported too.
+
+    python benchmark_vector_store.py --chunks=100000 --queries=500
+"""
+
+# Standard imports
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import Dict, List
+
+# Internal imports
+from cache import QueryEmbeddingCache
+from vector_store import NumpyVectorStore
+
+# External imports
+import numpy as np
+
+
+class _SyntheticData:
+    """
+    Class that stands in for a DataHandler, yielding sections of random embeddings.
+    """
+
+    manifest = None
+
+    def __init__(
+        self, chunks: int, dimensions: int, chunks_per_section: int, seed: int
+    ) -> None:
+        rng = np.random.default_rng(seed)
+        self.embeddings = rng.standard_normal((chunks, dimensions), dtype=np.float32)
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        self.chunks_per_section = chunks_per_section
+
+    def load_vectorized_data(self, pending_only: bool = False, num_workers: int = 1):
+        for start in range(0, len(self.embeddings), self.chunks_per_section):
+            end = start + self.chunks_per_section
+            yield f"Section {start}", {
+                "embeddings": self.embeddings[start:end],
+                "texts": [
+                    f"chunk {i}" for i in range(start, min(end, len(self.embeddings)))
+                ],
+            }
+
+
+def time_searches(store, queries: List[str], n_results: int) -> Dict[str, object]:
+    """
+    Function that times searching a store once per query.
+
+    Parameters:
+    - store: VectorStore, the store to search
+    - queries: list[str], the queries (already in the query cache)
+    - n_results: int, number of results per search
+
+    Returns:
+    - dict with the latencies in milliseconds and the texts returned for every query
+    """
+    store.search(queries[0], n_results)  # Warm up
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        found = store.search(query, n_results)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(set(found.values()))
+    return {"latencies": latencies, "results": results}
+
+
+def report(name: str, build_seconds: float, latencies: List[float]) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:<8} build {build_seconds:7.2f} s  "
+        f"search p50 {statistics.median(latencies):7.3f} ms  "
+        f"p95 {p95:7.3f} ms  mean {statistics.mean(latencies):7.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vector store backends.")
+    parser.add_argument(
+        "--chunks", type=int, default=50000, help="Number of chunks (default: 50000)"
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=384,
+        help="Embedding dimensions (default: 384, like all-MiniLM-L6-v2)",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=200, help="Number of queries (default: 200)"
+    )
+    parser.add_argument(
+        "--n_results", type=int, default=7, help="Results per search (default: 7)"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["numpy", "chroma"],
+        help="Backends to benchmark (default: numpy chroma)",
+    )
+    args = parser.parse_args()
+
+    data = _SyntheticData(args.chunks, args.dimensions, chunks_per_section=50, seed=0)
+    rng = np.random.default_rng(1)
+    query_cache = QueryEmbeddingCache(max_size=args.queries)
+    queries = [f"query {i}" for i in range(args.queries)]
+    for query in queries:
+        query_cache.put(query, rng.standard_normal(args.dimensions))
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            start = time.perf_counter()
+            if backend == "numpy":
+                store = NumpyVectorStore(Path(tmp) / "numpy_index", query_cache)
+            elif backend == "chroma":
+                from chroma import ChromaDB
+
+                store = ChromaDB(str(Path(tmp) / "chroma"), query_cache=query_cache)
+            else:
+                raise ValueError(f"Unknown vector store backend {backend}.")
+            store.add_data(data)
+            build_seconds = time.perf_counter() - start
+
+            timings[backend] = time_searches(store, queries, args.n_results)
+            timings[backend]["build"] = build_seconds
+
+    print(f"\n{args.chunks} chunks, {args.queries} queries, top {args.n_results}")
+    for backend, timing in timings.items():
+        report(backend, timing["build"], timing["latencies"])
+
+    # The numpy search is exact, so it is the ground truth for recall
+    if "numpy" in timings:
+        exact = timings["numpy"]["results"]
+        for backend, timing in timings.items():
+            if backend != "numpy":
+                recall = statistics.mean(
+                    len(found & truth) / len(truth)
+                    for found, truth in zip(timing["results"], exact)
+                )
+                print(f"{backend} recall@{args.n_results} vs exact: {recall:.3f}")
@@ -0,0 +1,343 @@
+"""
+File that contains a BM25 index over the chunks in the vector DB, for hybrid lexical and dense search.
+
+Embeddings of a small model like MiniLM blur exact terms such as drug names, eponyms and
+abbreviations ("CAH", "TEE", "DMARDs"), which BM25 matches exactly. The two ranked lists are
+merged with reciprocal rank fusion (see reciprocal_rank_fusion).
+
+The postings are kept in flat numpy arrays (compressed sparse rows, one row per term) instead of
+dicts of lists, so the index is compact, saved and loaded as a few arrays, and scoring a term is
+a vectorized operation over one slice of them.
+"""
+
+# Standard imports
+import os
+import re
+import json
+from array import array
+from pathlib import Path
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+# Internal imports
+from const import PATH_TO_BM25_INDEX
+from config import BM25_K1, BM25_B, RRF_K
+
+# External imports
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Only the most common English words, medical terms are never dropped
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was "
+    "were which with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Function that splits text into lowercase terms for BM25.
+    A plural "s" is dropped from longer terms, so "DMARDs" matches "DMARD".
+
+    Parameters:
+    - text: str, text to split
+
+    Returns:
+    - list[str], the terms in order, stopwords removed
+    """
+    terms = []
+    for term in TOKEN_PATTERN.findall(text.lower()):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    """
+    Function that merges ranked lists of ids, scoring an id 1 / (k + rank) in every list it is in.
+
+    Parameters:
+    - rankings: list of lists of ids, best first
+    - k: int, how much less the top ranks weigh compared to lower ones (higher is flatter)
+
+    Returns:
+    - list[str], every id ranked by fused score, ties kept in the order they were first seen
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda id: -scores[id])
+
+
+class BM25Index:
+    """
+    Class for a BM25 index of chunks, saved to disk.
+
+    Chunks are added and removed in memory, then commit rebuilds the posting arrays and save
+    writes them out. Chunk ids and titles are the ones the vector DB uses.
+
+    Files:
+    - <path>.npz: the posting arrays and the chunk lengths
+    - <path>.json: the terms, chunk ids, chunk titles and the data version of the vector DB it matches
+
+    Attributes:
+    - path: Path, path of the index files without extension
+    - k1: float, how quickly repeating a term stops raising a chunk's score
+    - b: float, how much a chunk's length lowers its score (0 to 1)
+    - data_version: str, data version of the vector DB when the index was saved
+    - ids: list[str], id of every chunk
+    - titles: list[str], title of the section every chunk comes from
+    """
+
+    def __init__(
+        self,
+        path: Path = Path(PATH_TO_BM25_INDEX),
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> None:
+        if not isinstance(path, Path):
+            raise ValueError("Index path must be a Path object.")
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.data_version = None
+        self.ids = []
+        self.titles = []
+
+        self.__terms = {}  # Term mapped to its row in the postings
+        self.__lengths = np.zeros(0, dtype=np.int32)  # Terms in every chunk
+        # Postings of term t are __docs[__offsets[t]:__offsets[t + 1]] with their term frequencies
+        self.__offsets = np.zeros(1, dtype=np.int64)
+        self.__docs = np.zeros(0, dtype=np.int32)
+        self.__frequencies = np.zeros(0, dtype=np.float32)
+        self.__idf = np.zeros(0, dtype=np.float32)
+
+        # Changes not committed yet: postings of new chunks as flat (term, chunk, frequency) arrays
+        self.__pending_terms = array("q")
+        self.__pending_docs = array("q")
+        self.__pending_frequencies = array("f")
+        self.__pending_lengths = array("i")
+        self.__removed = set()
+
+        if self.__json_path.exists():
+            self.__load()
+
+    @property
+    def __npz_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".npz")
+
+    @property
+    def __json_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".json")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: List[str], titles: List[str], texts: List[str]) -> None:
+        """
+        Function that adds chunks, searchable once committed.
+
+        Parameters:
+        - ids: list[str], ids of the chunks
+        - titles: list[str], titles of the sections the chunks come from
+        - texts: list[str], texts of the chunks
+        """
+        vocabulary = self.__terms
+        for id, title, text in zip(ids, titles, texts):
+            terms = tokenize(text)
+            counts = Counter(terms)
+            self.__pending_terms.extend(
+                vocabulary.setdefault(t, len(vocabulary)) for t in counts
+            )
+            self.__pending_docs.extend([len(self.ids)] * len(counts))
+            self.__pending_frequencies.extend(counts.values())
+            self.__pending_lengths.append(len(terms))
+            self.ids.append(id)
+            self.titles.append(title)
+
+    def remove_ids(self, ids: Iterable[str]) -> None:
+        """
+        Function that removes chunks by id, once committed.
+        """
+        ids = set(ids)
+        self.__removed.update(row for row, id in enumerate(self.ids) if id in ids)
+
+    def remove_titles(self, titles: Iterable[str]) -> None:
+        """
+        Function that removes every chunk of the given sections, once committed.
+        """
+        titles = set(titles)
+        self.__removed.update(
+            row for row, title in enumerate(self.titles) if title in titles
+        )
+
+    def commit(self) -> None:
+        """
+        Function that rebuilds the posting arrays with the chunks added and removed since the last commit.
+        """
+        if not self.__pending_lengths and not self.__removed:
+            return
+
+        # Every posting as (term, chunk, frequency), the committed ones expanded from the arrays
+        terms = np.concatenate(
+            [
+                np.repeat(np.arange(len(self.__offsets) - 1), np.diff(self.__offsets)),
+                np.frombuffer(self.__pending_terms, dtype=np.int64),
+            ]
+        )
+        docs = np.concatenate(
+            [
+                self.__docs.astype(np.int64),
+                np.frombuffer(self.__pending_docs, dtype=np.int64),
+            ]
+        )
+        frequencies = np.concatenate(
+            [
+                self.__frequencies,
+                np.frombuffer(self.__pending_frequencies, dtype=np.float32),
+            ]
+        )
+        lengths = np.concatenate(
+            [self.__lengths, np.frombuffer(self.__pending_lengths, dtype=np.int32)]
+        )
+
+        # Drop removed chunks and renumber the rest
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[list(self.__removed)] = False
+        new_rows = np.cumsum(keep) - 1
+        kept_postings = keep[docs]
+        terms = terms[kept_postings]
+        docs = new_rows[docs[kept_postings]]
+        frequencies = frequencies[kept_postings]
+        self.ids = [id for id, k in zip(self.ids, keep) if k]
+        self.titles = [title for title, k in zip(self.titles, keep) if k]
+        self.__lengths = lengths[keep]
+
+        # Grouped by term, chunks in order within a term
+        order = np.lexsort((docs, terms))
+        self.__docs = docs[order].astype(np.int32)
+        self.__frequencies = frequencies[order]
+        document_frequency = np.bincount(terms, minlength=len(self.__terms))
+        self.__offsets = np.concatenate([[0], np.cumsum(document_frequency)])
+        self.__update_idf()
+
+        self.__pending_terms = array("q")
+        self.__pending_docs = array("q")
+        self.__pending_frequencies = array("f")
+        self.__pending_lengths = array("i")
+        self.__removed = set()
+
+    def search(self, query: str, n_results: int) -> List[Tuple[int, float]]:
+        """
+        Function that finds the committed chunks with the highest BM25 score for a query.
+
+        Parameters:
+        - query: str, the query
+        - n_results: int, number of chunks to return
+
+        Returns:
+        - list of (chunk row, score) best match first, only chunks sharing a term with the query
+        """
+        terms = {self.__terms[t] for t in tokenize(query) if t in self.__terms}
+        if not terms or len(self.__lengths) == 0:
+            return []
+
+        scores = np.zeros(len(self.__lengths), dtype=np.float32)
+        # Length normalization of every chunk, shared by all the terms
+        norm = self.k1 * (
+            1 - self.b + self.b * self.__lengths / max(self.__lengths.mean(), 1e-9)
+        )
+        for term in terms:
+            if term + 1 >= len(self.__offsets):
+                continue  # Added after the last commit
+            start, end = self.__offsets[term], self.__offsets[term + 1]
+            docs = self.__docs[start:end]
+            frequencies = self.__frequencies[start:end]
+            # A chunk appears once per term, so the scores can be added in place
+            scores[docs] += (
+                self.__idf[term]
+                * frequencies
+                * (self.k1 + 1)
+                / (frequencies + norm[docs])
+            )
+
+        matched = np.flatnonzero(scores)
+        k = min(n_results, len(matched))
+        if k == 0:
+            return []
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(row), float(scores[row])) for row in best]
+
+    def save(self, data_version: str) -> None:
+        """
+        Function that commits and saves the index, through temporary files.
+
+        Parameters:
+        - data_version: str, data version of the vector DB the index now matches
+        """
+        self.commit()
+        self.data_version = data_version
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_npz = self.path.with_name(self.path.name + ".tmp.npz")
+        tmp_json = self.path.with_name(self.path.name + ".json.tmp")
+        np.savez(
+            tmp_npz,
+            lengths=self.__lengths,
+            offsets=self.__offsets,
+            docs=self.__docs,
+            frequencies=self.__frequencies,
+        )
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "data_version": data_version,
+                    "terms": list(self.__terms),
+                    "ids": self.ids,
+                    "titles": self.titles,
+                },
+                f,
+            )
+        os.replace(tmp_npz, self.__npz_path)
+        os.replace(tmp_json, self.__json_path)
+
+    def __load(self) -> None:
+        """
+        Helper function that loads a saved index.
+        """
+        with open(self.__json_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.data_version = meta["data_version"]
+        self.__terms = {term: i for i, term in enumerate(meta["terms"])}
+        self.ids = meta["ids"]
+        self.titles = meta["titles"]
+        with np.load(self.__npz_path) as arrays:
+            self.__lengths = arrays["lengths"]
+            self.__offsets = arrays["offsets"]
+            self.__docs = arrays["docs"]
+            self.__frequencies = arrays["frequencies"]
+        self.__update_idf()
+
+    def __update_idf(self) -> None:
+        """
+        Helper function that computes the inverse document frequency of every term from the postings.
+        """
+        document_frequency = np.diff(self.__offsets)
+        n = len(self.ids)
+        self.__idf = np.log(
+            1 + (n - document_frequency + 0.5) / (document_frequency + 0.5)
+        ).astype(np.float32)
+
+    def clear(self) -> None:
+        """
+        Function that removes every chunk, e.g. before rebuilding the index.
+        """
+        self.remove_ids(self.ids)
+        self.commit()
+        self.__terms = {}
+        self.__offsets = np.zeros(1, dtype=np.int64)
+        self.__idf = np.zeros(0, dtype=np.float32)
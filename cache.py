@@ -0,0 +1,425 @@
+"""
+File that contains caches used when answering questions.
+
+Namely:
+- QueryEmbeddingCache: LRU cache of query embeddings so repeated questions skip the embedding model
+- AnswerCache: persistent cache of LLM answers so repeated or near-identical questions skip the LLM
+"""
+
+# Standard imports
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+# Internal imports
+from const import SYSTEM_PROMPT_TEMPLATE
+from config import (
+    EMBEDDING_MODEL,
+    LLM_MODEL,
+    QUERY_CACHE_SIZE,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_CHUNK_OVERLAP,
+)
+
+# External imports
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """
+    Function that normalizes a query so trivially different copies share a cache entry.
+    Only changes the embedding model can't see are made: the model is uncased and
+    splits on whitespace.
+
+    Parameters:
+    - text: str, query to normalize
+
+    Returns:
+    - str, lowercased query with whitespace collapsed
+    """
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Class for a bounded LRU cache of query embeddings.
+
+    Entries are keyed on the embedding model name and the normalized query, so a cache
+    persisted with one model is never used with another.
+
+    Attributes:
+    - max_size: int, maximum number of embeddings kept
+    - model_name: str, name of the embedding model the embeddings come from
+    - persist_path: Path, file the cache is saved to and loaded from (None keeps it in memory)
+    - hits: int, number of lookups answered from the cache
+    - misses: int, number of lookups that had to run the model
+    """
+
+    def __init__(
+        self,
+        max_size: int = QUERY_CACHE_SIZE,
+        model_name: str = EMBEDDING_MODEL,
+        persist_path: Optional[Path] = None,
+    ) -> None:
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1.")
+        self.max_size = max_size
+        self.model_name = model_name
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+        if self.persist_path is not None and self.persist_path.exists():
+            self.__load()
+
+    def __key(self, text: str) -> str:
+        return f"{self.model_name}\n{normalize_query(text)}"
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """
+        Function that looks up the embedding of a query.
+
+        Parameters:
+        - text: str, the query
+
+        Returns:
+        - np.array, the cached embedding or None if it is not cached
+        """
+        key = self.__key(text)
+        with self.__lock:
+            embedding = self.__entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: np.ndarray) -> np.ndarray:
+        """
+        Function that caches the embedding of a query, evicting the least recently used one if full.
+
+        Parameters:
+        - text: str, the query
+        - embedding: np.array, its embedding
+
+        Returns:
+        - np.array, the read-only copy of the embedding that was cached
+        """
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)  # Shared between callers, so keep it immutable
+        key = self.__key(text)
+        with self.__lock:
+            self.__entries[key] = embedding
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+        return embedding
+
+    def get_or_embed(self, text: str, embed: Callable[[str], np.ndarray]) -> np.ndarray:
+        """
+        Function that returns the cached embedding of a query, embedding and caching it on a miss.
+
+        Parameters:
+        - text: str, the query
+        - embed: function that embeds a query
+
+        Returns:
+        - np.array, the embedding of the query
+        """
+        embedding = self.get(text)
+        if embedding is None:
+            embedding = self.put(text, embed(text))
+        return embedding
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters and the number of cached embeddings.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def save(self) -> None:
+        """
+        Function that saves the cache to its persistence file, if it has one.
+        """
+        if self.persist_path is None:
+            return
+        with self.__lock:
+            keys = list(self.__entries)
+            embeddings = list(self.__entries.values())
+        if not keys:
+            return
+
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        # np.savez adds .npz to names that don't end with it
+        tmp_path = self.persist_path.with_name(self.persist_path.stem + ".tmp.npz")
+        np.savez(tmp_path, keys=np.array(keys), embeddings=np.stack(embeddings))
+        os.replace(tmp_path, self.persist_path)
+
+    def __load(self) -> None:
+        """
+        Helper function that loads the embeddings of this model from the persistence file.
+        """
+        with np.load(self.persist_path, allow_pickle=False) as saved:
+            for key, embedding in zip(saved["keys"], saved["embeddings"]):
+                if str(key).split("\n", 1)[0] == self.model_name:
+                    embedding.setflags(write=False)
+                    self.__entries[str(key)] = embedding
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+
+def jaccard(a: set, b: List[str]) -> float:
+    """
+    Function that computes the Jaccard index of two sets of ids (0 if both are empty).
+    """
+    b = set(b)
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+class AnswerCache:
+    """
+    Class for a persistent cache of LLM answers in front of the LLM call.
+
+    It has two tiers:
+    - exact: keyed on the normalized query, the ids of the retrieved chunks, the LLM model and
+      a hash of the prompt template, so it only hits when the LLM would get the same prompt
+    - semantic: returns the answer to a previous query whose embedding is within a cosine
+      similarity threshold of the new one and whose retrieved chunks mostly are the new one's, for
+      rephrasings of the same question. Questions a few words apart that retrieve different
+      chunks (e.g. type 1 and type 2 diabetes) embed very close, so similarity alone isn't enough
+
+    Entries expire after a TTL, the least recently used ones are evicted when the cache is full and
+    everything is dropped when the contents of the vector DB change.
+
+    Attributes:
+    - max_size: int, maximum number of answers kept
+    - ttl: float, seconds an answer stays valid
+    - similarity: float, cosine similarity needed for a semantic hit (None turns the tier off)
+    - chunk_overlap: float, Jaccard index of the retrieved chunk ids needed for a semantic hit
+    - persist_path: Path, file the cache is saved to and loaded from (None keeps it in memory)
+    - model: str, LLM model the answers come from
+    - template_hash: str, hash of the prompt template the answers were generated with
+    - data_version: str, version of the vector DB contents the answers were generated from
+    """
+
+    def __init__(
+        self,
+        max_size: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        similarity: Optional[float] = ANSWER_CACHE_SIMILARITY,
+        chunk_overlap: float = ANSWER_CACHE_CHUNK_OVERLAP,
+        persist_path: Optional[Path] = None,
+        model: str = LLM_MODEL,
+        template: str = SYSTEM_PROMPT_TEMPLATE,
+    ) -> None:
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.chunk_overlap = chunk_overlap
+        self.persist_path = persist_path
+        self.model = model
+        self.template_hash = hashlib.sha256(template.encode("utf-8")).hexdigest()
+        self.data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+        if self.persist_path is not None and self.persist_path.exists():
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.data_version = saved["data_version"]
+            self.__entries = OrderedDict(saved["entries"])
+
+    def __key(self, query: str, chunk_ids: List[str]) -> str:
+        return hashlib.sha256(
+            json.dumps(
+                [
+                    normalize_query(query),
+                    list(chunk_ids),
+                    self.model,
+                    self.template_hash,
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def validate(self, data_version: str) -> None:
+        """
+        Function that drops every answer if the vector DB contents changed since they were cached.
+
+        Parameters:
+        - data_version: str, current version of the vector DB contents
+        """
+        with self.__lock:
+            if data_version != self.data_version:
+                self.__entries.clear()
+                self.data_version = data_version
+
+    def __expired(self, entry: dict) -> bool:
+        return time.time() - entry["created"] > self.ttl
+
+    def get(self, query: str, chunk_ids: List[str]) -> Optional[dict]:
+        """
+        Function that looks up the answer to the exact same prompt.
+
+        Parameters:
+        - query: str, the question
+        - chunk_ids: list[str], ids of the chunks retrieved for the question
+
+        Returns:
+        - dict with the "answer" and the "references" it cited, or None if it is not cached
+        """
+        key = self.__key(query, chunk_ids)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and self.__expired(entry):
+                del self.__entries[key]
+                entry = None
+            if entry is not None:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def get_similar(
+        self, embedding: np.ndarray, chunk_ids: List[str]
+    ) -> Optional[dict]:
+        """
+        Function that looks up the answer to the most similar previous question that was
+        answered from mostly the same chunks.
+
+        Parameters:
+        - embedding: np.array, embedding of the question
+        - chunk_ids: list[str], ids of the chunks retrieved for the question
+
+        Returns:
+        - dict with the "answer" and the "references" it cited, or None if no question is close enough
+        """
+        if self.similarity is None:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        retrieved = set(chunk_ids)
+
+        with self.__lock:
+            candidates = [
+                (key, entry)
+                for key, entry in self.__entries.items()
+                if entry["model"] == self.model
+                and entry["template_hash"] == self.template_hash
+                and not self.__expired(entry)
+                # Answers cached before chunk ids were kept never match
+                and jaccard(retrieved, entry.get("chunk_ids", [])) >= self.chunk_overlap
+            ]
+            if not candidates:
+                return None
+
+            cached = np.array([entry["embedding"] for _, entry in candidates])
+            cached /= np.linalg.norm(cached, axis=1, keepdims=True) + 1e-12
+            scores = cached @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None
+
+            key, entry = candidates[best]
+            self.__entries.move_to_end(key)
+            return entry
+
+    def lookup(
+        self, query: str, chunk_ids: List[str], embedding: np.ndarray
+    ) -> Optional[dict]:
+        """
+        Function that looks up an answer in the exact tier, then in the semantic tier.
+
+        Parameters:
+        - query: str, the question
+        - chunk_ids: list[str], ids of the chunks retrieved for the question
+        - embedding: np.array, embedding of the question
+
+        Returns:
+        - dict with the "answer" and the "references" it cited, or None on a miss
+        """
+        entry = self.get(query, chunk_ids)
+        if entry is None:
+            entry = self.get_similar(embedding, chunk_ids)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(
+        self,
+        query: str,
+        chunk_ids: List[str],
+        embedding: np.ndarray,
+        answer: str,
+        references: List[str],
+    ) -> None:
+        """
+        Function that caches an answer, evicting the least recently used one if full.
+
+        Parameters:
+        - query: str, the question
+        - chunk_ids: list[str], ids of the chunks retrieved for the question
+        - embedding: np.array, embedding of the question
+        - answer: str, the LLM's answer
+        - references: list[str], names of the sources the answer was given
+        """
+        key = self.__key(query, chunk_ids)
+        with self.__lock:
+            self.__entries[key] = {
+                "answer": answer,
+                "references": list(references),
+                "chunk_ids": list(chunk_ids),
+                "embedding": np.asarray(embedding, dtype=np.float32).tolist(),
+                "model": self.model,
+                "template_hash": self.template_hash,
+                "created": time.time(),
+            }
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters and the number of cached answers.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def save(self) -> None:
+        """
+        Function that saves the unexpired answers to the persistence file, if there is one.
+        """
+        if self.persist_path is None:
+            return
+        with self.__lock:
+            entries = [
+                (key, entry)
+                for key, entry in self.__entries.items()
+                if not self.__expired(entry)
+            ]
+            saved = {"data_version": self.data_version, "entries": entries}
+
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.persist_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.persist_path)
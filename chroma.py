@@ -7,23 +7,32 @@ File that contains a class for:
 
 # Standard library imports
 import gzip
-import uuid
 import base64
 from tqdm import tqdm
-from typing import Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Third party imports
-import chromadb
 import numpy as np
 
 # Local application imports
-from utils import embed_text_no_chunk
-from const import PATH_TO_VECTOR_DB
-from config import DEFAULT_RESULTS_PER_SEARCH
+from cache import QueryEmbeddingCache
+from const import PATH_TO_VECTOR_DB, PATH_TO_TEXT_STORE, PATH_TO_BM25_INDEX
+from config import (
+    DEFAULT_RESULTS_PER_SEARCH,
+    LOAD_WORKERS,
+    HYBRID_SEARCH,
+    HYBRID_CANDIDATES,
+)
 from data_handler import DataHandler
+from vector_store import VectorStore, chunk_id
+from text_store import TextStore
+from bm25 import BM25Index, reciprocal_rank_fusion
 
 
-class ChromaDB:
+class ChromaDB(VectorStore):
     """
     Class for setting up a local vector DB using Chroma.
     """
@@ -32,80 +41,355 @@ class ChromaDB:
         self,
         persist_directory: str = PATH_TO_VECTOR_DB,
         collection_name: str = "medical_school",
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        text_store: Optional[TextStore] = None,
+        hybrid: bool = HYBRID_SEARCH,
     ):
         """
         Initialize the ChromaDB class and set up the database if not already present.
+
+        Parameters:
+            persist_directory (str): Folder the database is stored in.
+            collection_name (str): Name of the collection to use.
+            query_cache (QueryEmbeddingCache): Cache for query embeddings, one is created if not given.
+            text_store (TextStore): Store for the chunk texts, one is opened next to the database if not given.
+            hybrid (bool): Whether to keep a BM25 index next to the database and merge its results into searches.
         """
+        super().__init__(query_cache)
         self.persist_directory = persist_directory
         self.collection_name = collection_name
+        if text_store is None:
+            text_store = TextStore(
+                Path(persist_directory) / Path(PATH_TO_TEXT_STORE).name
+            )
+        self.text_store = text_store
+
+        # Imported here since chromadb is slow to import and most tooling never opens the DB
+        import chromadb
 
         # Initialize ChromaDB client
-        chroma_client = chromadb.PersistentClient(path=self.persist_directory)
+        self.client = chromadb.PersistentClient(path=self.persist_directory)
         # Create a collection
-        self.collection = chroma_client.get_or_create_collection(
+        self.collection = self.client.get_or_create_collection(
             name=self.collection_name
         )
 
         # Check if the collection already exists
         if self.collection.count() == 0:
             print(f"Collection '{self.collection_name}' created.")
-            self.db_populated = False
         else:
             print(f"Collection '{self.collection_name}' already exists.")
-            self.db_populated = True
+        self.db_populated = self.__ingest_complete()
 
-    def __compress_text(self, text: str) -> str:
-        """Compress text using gzip and encode it with base64 for safe storage."""
-        return base64.b64encode(gzip.compress(text.encode("utf-8"))).decode("utf-8")
+        self.bm25 = None
+        if hybrid:
+            self.bm25 = BM25Index(
+                Path(persist_directory) / Path(PATH_TO_BM25_INDEX).name
+            )
+            # Out of date if it was never built or a load was interrupted
+            if self.bm25.data_version != self.data_version:
+                if self.collection.count() > 0:
+                    self.__rebuild_bm25()
+                else:
+                    self.bm25.clear()
 
     def __decompress_text(self, encoded: str) -> str:
+        """Decode text compressed with gzip and base64, how collections built before the text store kept it."""
         return gzip.decompress(base64.b64decode(encoded.encode("utf-8"))).decode(
             "utf-8"
         )
 
-    def add_data(self, handler: DataHandler) -> None:
+    def __chunk_text(self, metadata: dict) -> str:
+        """Read the text of a chunk from the text store, or from its metadata in older collections."""
+        if "text" in metadata:
+            return self.__decompress_text(metadata["text"])
+        return self.text_store.get(metadata["offset"], metadata["length"])
+
+    @property
+    def max_batch_size(self) -> int:
+        """
+        Largest number of rows the client accepts in one write.
+        """
+        try:
+            return self.client.get_max_batch_size()
+        except Exception:
+            # Older clients don't report it, this was their limit with SQLite's defaults
+            return 5461
+
+    def add_data(self, handler: DataHandler, num_workers: int = LOAD_WORKERS) -> None:
         """
         Add data to the ChromaDB collection.
 
+        Chunk ids are derived from the section title, the chunk's position and a hash of its text,
+        so adding a section only writes the chunks the collection doesn't have yet and drops the
+        ones that changed. An interrupted load is resumed by running it again.
+
+        Sections are packed into batches of up to max_batch_size rows. While one batch is written,
+        worker threads read the next shards and prepare the next batches (ids, text store entries,
+        which chunks are already in the collection).
+
+        If the handler has an ingestion manifest, only sections that were not loaded yet are
+        added and the vectors of removed sections are dropped first. Every section is loaded
+        again if the collection is empty or doesn't hold the chunks the manifest expects
+        (e.g. the vector DB folder was deleted while the manifest was kept).
+
         Parameters:
             handler (DataHandler): Instance of DataHandler class to load and process data.
+            num_workers (int): Threads reading shards and preparing batches.
         """
-        # Check if the database is already populated
-        if self.db_populated:
-            print("Database already populated. Skipping data addition.")
-            return
+        manifest = handler.manifest
+        reload = False
+        if manifest is None:
+            # Check if the database is already populated
+            if self.db_populated:
+                print("Database already populated. Skipping data addition.")
+                return
+        else:
+            stale_titles = manifest.removed_titles
+            self.__delete_titles(stale_titles)
+            if self.bm25 is not None:
+                self.bm25.remove_titles(stale_titles)
 
-        # Load vectorized data
-        # Iterate over the data and add it to the collection
-        for section_name, emb_and_text in tqdm(handler.load_vectorized_data()):
-            embeddings = np.array(emb_and_text["embeddings"])
-            texts = emb_and_text["texts"]
-
-            # Compress all texts
-            compressed_texts = [self.__compress_text(t) for t in texts]
-
-            if len(embeddings) < 5461:
-                self.collection.add(
-                    ids=[str(uuid.uuid4()) for _ in range(len(embeddings))],
-                    embeddings=embeddings,
-                    metadatas=[
-                        {"text": compressed_texts[i], "title": section_name}
-                        for i in range(len(compressed_texts))
-                    ],
+            pending = manifest.pending_index()
+            count = self.collection.count()
+            expected = manifest.indexed_chunks()
+            # With sections pending, modified ones still have their old chunks in the collection
+            reload = count == 0 or (
+                not pending and expected is not None and count != expected
+            )
+            if not stale_titles and not pending and not reload:
+                print("Database is up to date. Skipping data addition.")
+                return
+            if reload and count > 0:
+                print(
+                    f"Collection holds {count} chunks, the manifest expects {expected}. "
+                    "Loading every section again."
                 )
-            else:
-                chunk_size = 5461
-                for i in range(0, len(embeddings), chunk_size):
-                    chunk = embeddings[i : i + chunk_size]
-                    chunk_texts = compressed_texts[i : i + chunk_size]
-                    self.collection.add(
-                        ids=[str(uuid.uuid4()) for _ in range(len(chunk))],
-                        embeddings=chunk,
-                        metadatas=[
-                            {"text": chunk_texts[j], "title": section_name}
-                            for j in range(len(chunk))
-                        ],
+
+        # Marked complete again once every section is in, so an interrupted load is resumed
+        self.__update_metadata(ingest_complete=False)
+
+        # Load vectorized data
+        # Iterate over the data and add it to the collection in batches
+        max_batch_size = self.max_batch_size
+        sections = handler.load_vectorized_data(
+            pending_only=manifest is not None and not reload, num_workers=num_workers
+        )
+        added_titles = []
+        written = 0
+        with tqdm(unit=" chunks") as progress:
+            for batch in self.__prepared_batches(
+                self.__pack_sections(sections, max_batch_size), num_workers
+            ):
+                if batch["outdated"]:
+                    self.collection.delete(ids=batch["outdated"])
+                    if self.bm25 is not None:
+                        self.bm25.remove_ids(batch["outdated"])
+                # Flushed first so the collection never points at text that isn't on disk
+                self.text_store.flush()
+                for start in range(0, len(batch["ids"]), max_batch_size):
+                    end = start + max_batch_size
+                    self.collection.upsert(
+                        ids=batch["ids"][start:end],
+                        embeddings=batch["embeddings"][start:end],
+                        metadatas=batch["metadatas"][start:end],
+                    )
+                if self.bm25 is not None:
+                    self.bm25.add(
+                        batch["ids"],
+                        [metadata["title"] for metadata in batch["metadatas"]],
+                        batch["texts"],
                     )
+                written += len(batch["ids"])
+                added_titles.extend(batch["titles"])
+                progress.update(batch["rows"])
+        print(f"Wrote {written} new or changed chunks.")
+
+        if manifest is not None:
+            manifest.mark_indexed(added_titles)
+            manifest.clear_removed()
+            manifest.save()
+        self.db_populated = True
+        self.__update_metadata(
+            ingest_complete=True,
+            data_version=(self.collection.metadata or {}).get("data_version", 0) + 1,
+        )
+        if self.bm25 is not None:
+            self.bm25.save(self.data_version)
+
+    def __rebuild_bm25(self) -> None:
+        """
+        Rebuild the BM25 index from every chunk in the collection.
+        """
+        print(f"Building the BM25 index of '{self.collection_name}'...")
+        self.bm25.clear()
+        page_size = self.max_batch_size
+        for offset in range(0, self.collection.count(), page_size):
+            page = self.collection.get(
+                include=["metadatas"], limit=page_size, offset=offset
+            )
+            self.bm25.add(
+                page["ids"],
+                [metadata["title"] for metadata in page["metadatas"]],
+                [self.__chunk_text(metadata) for metadata in page["metadatas"]],
+            )
+        self.bm25.save(self.data_version)
+
+    def __pack_sections(
+        self, sections: Iterable[Tuple[str, dict]], max_rows: int
+    ) -> Iterator[List[Tuple[str, dict]]]:
+        """
+        Group consecutive sections until they hold about max_rows chunks, so small sections share a write.
+        A section is never split between groups, larger sections get a group of their own.
+        """
+        group = []
+        rows = 0
+        for section in sections:
+            group.append(section)
+            rows += len(section[1]["texts"])
+            if rows >= max_rows:
+                yield group
+                group = []
+                rows = 0
+        if group:
+            yield group
+
+    def __prepared_batches(
+        self, groups: Iterable[List[Tuple[str, dict]]], num_workers: int
+    ) -> Iterator[dict]:
+        """
+        Prepare groups of sections on worker threads, yielding them in order while later ones are prepared.
+        """
+        if num_workers <= 1:
+            yield from map(self.__prepare_batch, groups)
+            return
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            prepared = deque()
+            for group in groups:
+                prepared.append(executor.submit(self.__prepare_batch, group))
+                if len(prepared) > num_workers:
+                    yield prepared.popleft().result()
+            while prepared:
+                yield prepared.popleft().result()
+
+    def __prepare_batch(self, group: List[Tuple[str, dict]]) -> dict:
+        """
+        Work out what writing a group of sections takes: the chunks the collection doesn't have yet
+        (with their texts appended to the text store) and the chunks that changed and must be deleted.
+
+        Parameters:
+            group (List[Tuple[str, dict]]): Sections as (title, {"embeddings", "texts"}).
+
+        Returns:
+            dict: ids, embeddings, metadatas and texts to upsert, outdated ids to delete, the titles
+            and the number of rows in the group.
+        """
+        titles = [title for title, _ in group]
+        existing = set(
+            self.collection.get(where={"title": {"$in": titles}}, include=[])["ids"]
+        )
+
+        ids = []
+        embeddings = []
+        texts = []
+        new_titles = []
+        current = set()
+        for title, emb_and_text in group:
+            section_embeddings = np.asarray(
+                emb_and_text["embeddings"], dtype=np.float32
+            )
+            for i, text in enumerate(emb_and_text["texts"]):
+                id = chunk_id(title, i, text)
+                current.add(id)
+                if id not in existing:
+                    ids.append(id)
+                    embeddings.append(section_embeddings[i])
+                    texts.append(text)
+                    new_titles.append(title)
+
+        # Keep the texts in the text store, the metadata only says where they are
+        metadatas = [
+            {"title": title, "offset": offset, "length": length}
+            for title, (offset, length) in zip(
+                new_titles, self.text_store.append_many(texts)
+            )
+        ]
+        return {
+            "ids": ids,
+            "embeddings": np.array(embeddings, dtype=np.float32),
+            "metadatas": metadatas,
+            "texts": texts,
+            # Chunks that changed (or moved) have new ids, so their old copies are dropped
+            "outdated": sorted(existing - current),
+            "titles": titles,
+            "rows": len(current),
+        }
+
+    def __ingest_complete(self) -> bool:
+        """
+        Whether every section was loaded into the collection.
+
+        Collections built before chunk ids were deterministic don't record it. They were only
+        ever marked populated, and as their random ids can't be matched to the data they
+        can't be resumed, so any data in them is taken as complete.
+        """
+        metadata = self.collection.metadata or {}
+        if "ingest_complete" in metadata:
+            return metadata["ingest_complete"]
+        if self.collection.count() == 0:
+            return False
+        print(
+            f"Collection '{self.collection_name}' was built with random chunk ids and can't be resumed. "
+            f"Delete {self.persist_directory} to rebuild it if it is incomplete."
+        )
+        return True
+
+    @property
+    def data_version(self) -> str:
+        """
+        Version of the collection's contents, changes whenever data is added or removed.
+        Used to invalidate anything derived from search results, like cached answers.
+        """
+        metadata = self.collection.metadata or {}
+        return f"{metadata.get('data_version', 0)}:{self.collection.count()}"
+
+    def __update_metadata(self, **updates) -> None:
+        """
+        Update entries of the collection's metadata, keeping the rest.
+        """
+        metadata = dict(self.collection.metadata or {})
+        metadata.update(updates)
+        self.collection.modify(metadata=metadata)
+
+    def __delete_titles(self, titles: Iterable[str]) -> None:
+        """
+        Delete every chunk of the given sections from the collection.
+
+        Parameters:
+            titles (Iterable[str]): Titles of the sections to delete.
+        """
+        titles = sorted(titles)
+        for i in range(0, len(titles), 1000):
+            self.collection.delete(where={"title": {"$in": titles[i : i + 1000]}})
+
+    def warm_up(self) -> None:
+        """
+        Run a search for a stored embedding and read its text (and a BM25 search with hybrid search),
+        so the first real search doesn't pay for loading the HNSW index and the text store from disk.
+        """
+        stored = self.collection.get(limit=1, include=["embeddings"])
+        if not stored["ids"]:
+            return
+        results = self.collection.query(
+            query_embeddings=[stored["embeddings"][0]],
+            n_results=1,
+            include=["metadatas"],
+        )
+        for metadata in results["metadatas"][0]:
+            self.__chunk_text(metadata)
+        if self.bm25 is not None:
+            self.bm25.search("warm up", 1)
 
     def search(
         self, search_str: str, n_results: int = DEFAULT_RESULTS_PER_SEARCH
@@ -124,8 +408,17 @@ class ChromaDB:
         if not search_str or not isinstance(search_str, str):
             raise ValueError("Search string must be a non-empty string.")
 
+        if self.bm25 is not None:
+            fused = self.__hybrid_query(
+                [search_str], [self.embed_query(search_str)], n_results
+            )[0]
+            return {
+                f"{id}_{metadata['title']}": self.__chunk_text(metadata)
+                for id, metadata, _ in fused
+            }
+
         results = self.collection.query(
-            query_embeddings=[embed_text_no_chunk(search_str)],
+            query_embeddings=[self.embed_query(search_str)],
             n_results=n_results,
             include=["distances", "metadatas"],
         )
@@ -133,7 +426,7 @@ class ChromaDB:
         ids = results["ids"][0]
         metadatas = results["metadatas"][0]
         decompressed_results = {
-            f"{id}_{metadata["title"]}": self.__decompress_text(metadata["text"])
+            f"{id}_{metadata['title']}": self.__chunk_text(metadata)
             for id, metadata in zip(ids, metadatas)
         }
 
@@ -144,3 +437,116 @@ class ChromaDB:
                 unique_results[id] = text
 
         return unique_results
+
+    def search_many(
+        self, search_strs: List[str], n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> List[Dict[str, Tuple[str, float]]]:
+        """
+        Search for many strings at once, embedding them in one batch and querying the collection once.
+
+        Parameters:
+            search_strs (List[str]): The strings to search for.
+            n_results (int): The number of results to return per string.
+
+        Returns:
+            List[Dict[str, Tuple[str, float]]]: For every string, IDs mapped to their text and cosine distance.
+        """
+        if not search_strs or not all(s and isinstance(s, str) for s in search_strs):
+            raise ValueError("Search strings must be non-empty strings.")
+
+        if self.bm25 is not None:
+            return [
+                {
+                    f"{id}_{metadata['title']}": (self.__chunk_text(metadata), distance)
+                    for id, metadata, distance in fused
+                }
+                for fused in self.__hybrid_query(
+                    search_strs, self.embed_queries(search_strs), n_results
+                )
+            ]
+
+        results = self.collection.query(
+            query_embeddings=list(self.embed_queries(search_strs)),
+            n_results=n_results,
+            include=["distances", "metadatas"],
+        )
+
+        # The collection measures squared L2, for unit length embeddings that is twice the cosine distance
+        return [
+            {
+                f"{id}_{metadata['title']}": (
+                    self.__chunk_text(metadata),
+                    distance / 2,
+                )
+                for id, metadata, distance in zip(ids, metadatas, distances)
+            }
+            for ids, metadatas, distances in zip(
+                results["ids"], results["metadatas"], results["distances"]
+            )
+        ]
+
+    def __hybrid_query(
+        self, search_strs: List[str], query_embeddings: np.ndarray, n_results: int
+    ) -> List[List[Tuple[str, dict, float]]]:
+        """
+        Search the collection and the BM25 index, and merge their results with reciprocal rank fusion.
+
+        Parameters:
+            search_strs (List[str]): The strings to search for.
+            query_embeddings (np.ndarray): Their embeddings.
+            n_results (int): The number of results to return per string.
+
+        Returns:
+            List[List[Tuple[str, dict, float]]]: For every string, (id, metadata, cosine distance) best match first.
+        """
+        candidates = max(n_results, HYBRID_CANDIDATES)
+        dense = self.collection.query(
+            query_embeddings=list(query_embeddings),
+            n_results=candidates,
+            include=["distances", "metadatas"],
+        )
+
+        metadatas = {}
+        fused = []
+        for i, search_str in enumerate(search_strs):
+            # Squared L2 halved, the cosine distance of unit length embeddings
+            distances = {
+                id: distance / 2
+                for id, distance in zip(dense["ids"][i], dense["distances"][i])
+            }
+            metadatas.update(zip(dense["ids"][i], dense["metadatas"][i]))
+            lexical = [
+                self.bm25.ids[row]
+                for row, _ in self.bm25.search(search_str, candidates)
+            ]
+            ranked = reciprocal_rank_fusion([dense["ids"][i], lexical])[:n_results]
+            fused.append((ranked, distances))
+
+        # Chunks only BM25 found are fetched, with their embeddings to work out their distance
+        embeddings = {}
+        missing = sorted(
+            {id for ranked, distances in fused for id in ranked if id not in distances}
+        )
+        if missing:
+            found = self.collection.get(
+                ids=missing, include=["metadatas", "embeddings"]
+            )
+            for id, metadata, embedding in zip(
+                found["ids"], found["metadatas"], found["embeddings"]
+            ):
+                metadatas[id] = metadata
+                embeddings[id] = np.asarray(embedding, dtype=np.float32)
+
+        results = []
+        for (ranked, distances), query in zip(fused, query_embeddings):
+            rows = []
+            for id in ranked:
+                if id not in metadatas:
+                    continue  # Deleted from the collection since the BM25 index was saved
+                distance = distances.get(id)
+                if distance is None:
+                    # Halved squared L2 like the query results
+                    distance = float(((embeddings[id] - query) ** 2).sum()) / 2
+                rows.append((id, metadatas[id], distance))
+            results.append(rows)
+        return results
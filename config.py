@@ -1,6 +1,96 @@
 # Embedding model and LLM model
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 LLM_MODEL = "mistral:instruct"
+OLLAMA_HOST = "http://localhost:11434"
 
 # Config params for RAG search
 DEFAULT_RESULTS_PER_SEARCH = 7
+# "chroma", "numpy" (exact search in memory) or "ivf_pq" (compressed, for corpora too large for memory)
+VECTOR_STORE_BACKEND = "chroma"
+# Embeddings the numpy index keeps in memory: None (float32), "int8" (4x smaller) or "float16" (2x smaller)
+NUMPY_INDEX_QUANTIZATION = None
+NUMPY_INDEX_RESCORE = 10  # Full precision rescores per result when quantized
+LOAD_WORKERS = 4  # Threads reading shards and preparing batches for the vector DB
+
+# Config params for hybrid search, see bm25.py (Chroma only)
+HYBRID_SEARCH = False  # Merge BM25 results with the vector search results
+HYBRID_CANDIDATES = (
+    20  # Results taken from each of BM25 and vector search before merging
+)
+RRF_K = 60  # Reciprocal rank fusion constant, higher gives lower ranks more weight
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Config params for packing retrieved chunks into the prompt, see context_packing.py
+# LLM tokens the sources may take in the prompt (None keeps them whole)
+CONTEXT_TOKEN_BUDGET = 1200
+# Hugging Face name of the LLM's tokenizer to count tokens exactly (e.g. "mistralai/Mistral-7B-Instruct-v0.2"),
+# None estimates them from characters, calibrated on the prompt tokens Ollama reports
+CONTEXT_TOKENIZER = None
+CONTEXT_CHARS_PER_TOKEN = 3.5  # Starting estimate, lower overestimates tokens
+
+# Config params for the IVF-PQ index, see ivf_pq.py
+IVF_PQ_NLIST = 1024  # Inverted lists, about 4 * sqrt(chunks) works well
+IVF_PQ_SUBSPACES = 48  # Bytes stored per chunk, must divide the embedding dimensions
+IVF_PQ_NPROBE = 32  # Lists scored per query, higher finds more neighbours but is slower
+IVF_PQ_RESCORE = 10  # Full precision rescores per result, 0 to rank on the codes only
+IVF_PQ_TRAIN_SIZE = 100000  # Embeddings sampled from the shards to train the index
+IVF_PQ_KMEANS_ITERATIONS = 10
+
+# Config params for the chunk text store, see text_store.py
+TEXT_STORE_COMPRESSION = None  # None (raw UTF-8, fastest reads) or "zlib"
+TEXT_STORE_BLOCK_SIZE = 16 * 1024  # Bytes of text compressed together with "zlib"
+QUERY_CACHE_SIZE = 1024  # Number of query embeddings kept in the LRU cache
+QUERY_CACHE_PERSIST = False  # Whether the query embedding cache is saved between runs
+
+# Config params for caching LLM answers
+ANSWER_CACHE_SIZE = 256  # Number of answers kept
+ANSWER_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds an answer stays valid
+# Cosine similarity for reusing the answer to another question (None turns it off)
+ANSWER_CACHE_SIMILARITY = 0.95
+# Share of retrieved chunks two questions must have in common to share an answer (Jaccard index)
+ANSWER_CACHE_CHUNK_OVERLAP = 0.8
+
+# Config params for embedding
+# Chunker used when vectorizing: "tokens" counts the embedding model's tokens, "words" is
+# the original whitespace word count (chunks can be longer than the model reads)
+CHUNKER = "tokens"
+CHUNK_MAX_TOKENS = 256  # all-MiniLM-L6-v2 reads 256 tokens, [CLS] and [SEP] included
+CHUNK_OVERLAP_TOKENS = 32  # Tokens of whole sentences repeated in the next chunk
+EMBEDDING_BATCH_SIZE = 64  # Number of chunks sent through the model per forward pass
+VECTOR_SHARD_FORMAT = "npy"  # "npy" (memory-mappable float32) or "json", see shards.py
+EMBEDDING_CHUNKS_PER_PASS = 8192  # Chunks gathered across documents per embedding pass
+# Processes embedding chunks when vectorizing, each pinned to its own cores (1 embeds in this process)
+EMBEDDING_WORKERS = 1
+EMBEDDING_BATCHES_PER_TASK = 4  # Batches sent to an embedding worker at a time
+# "torch" runs the model with sentence-transformers, "onnx" with onnxruntime (see onnx_embedding.py)
+EMBEDDING_BACKEND = "torch"
+ONNX_QUANTIZE = False  # Quantize the ONNX model's weights to int8, faster on CPU
+ONNX_THREADS = 0  # Threads onnxruntime runs the model on, 0 for one per physical core
+# Lowest cosine similarity accepted between the ONNX and PyTorch embeddings of a text
+ONNX_DRIFT_TOLERANCE = 0.99
+
+# Config params for data cleaning
+CLEANING_WORKERS = 1  # Number of processes used to clean the data (1 cleans serially)
+
+# Config params for serving over HTTP
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8000
+SERVE_RETRIEVAL_WORKERS = 4  # Threads embedding queries and searching the vector DB
+SERVE_MAX_STREAMS = 32  # Answers that can be streamed from the LLM at the same time
+# Most chunks a request can ask for, larger n_results are lowered to it
+SERVE_MAX_RESULTS = 50
+
+# Config params for talking to Ollama
+OLLAMA_CONNECT_TIMEOUT = 5  # Seconds to wait for a connection to Ollama
+# Seconds to wait for the next streamed token, long enough to cover loading the model
+OLLAMA_READ_TIMEOUT = 300
+OLLAMA_KEEP_ALIVE = "30m"  # How long Ollama keeps the model loaded after a prompt
+OLLAMA_MAX_CONCURRENCY = 4  # Answers generated at the same time, others wait
+# Send the instructions as a system message through /api/chat, ahead of the sources and question,
+# so Ollama reuses their cached prefix (False sends SYSTEM_PROMPT_TEMPLATE to /api/generate)
+OLLAMA_CHAT = True
+
+# Load the embedding model, the vector DB's index and the LLM at startup, alongside each other and
+# alongside loading the data, so the first question is as fast as the rest (see warmup.py)
+WARMUP = True
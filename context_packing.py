@@ -0,0 +1,231 @@
+"""
+File that contains the packing of retrieved chunks into the LLM prompt under a token budget.
+
+Every token of context has to be read by the LLM before it writes the first token of the answer,
+which on CPU takes about as long as writing a sentence of it. Retrieved chunks often repeat each
+other, since consecutive chunks share their last/first sentences (CHUNK_OVERLAP_TOKENS) and the
+same passage can be found in several sections, and the less relevant ones rarely need to be read
+whole. So the chunks are:
+- split into sentences, dropping any sentence already given by a more relevant chunk
+- given an equal share of the budget each, in whole sentences, so every source can still be cited
+- then topped up with more of their sentences, most relevant first, until the budget is spent
+
+Tokens are counted with the LLM's tokenizer if CONTEXT_TOKENIZER names one, otherwise estimated from
+the number of characters. The estimate is calibrated on the number of prompt tokens Ollama reports
+after every answer (see TokenCounter.calibrate).
+"""
+
+# Standard imports
+import os
+import math
+import threading
+from typing import List, Optional, Tuple
+
+# Internal imports
+from const import SOURCE_TEMPLATE
+from config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOKENIZER,
+    CONTEXT_CHARS_PER_TOKEN,
+)
+from utils import sentence_splitter
+
+CALIBRATION_RANGE = (1.5, 8.0)  # Characters per token accepted from Ollama's counts
+CALIBRATION_WEIGHT = 0.2  # Weight of the newest count in the running estimate
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+
+class TokenCounter:
+    """
+    Class that counts the LLM's tokens in text, exactly with its tokenizer or estimated from characters.
+
+    Attributes:
+    - tokenizer_name: str, Hugging Face name of the LLM's tokenizer, None to estimate
+    - chars_per_token: float, characters per token used by the estimate
+    """
+
+    def __init__(
+        self,
+        tokenizer_name: Optional[str] = CONTEXT_TOKENIZER,
+        chars_per_token: float = CONTEXT_CHARS_PER_TOKEN,
+    ) -> None:
+        if chars_per_token <= 0:
+            raise ValueError("chars_per_token must be positive.")
+        self.tokenizer_name = tokenizer_name
+        self.chars_per_token = chars_per_token
+        self.__tokenizer = None
+        self.__last_calibrated = ""
+        if tokenizer_name is not None:
+            # Imported here so estimating never needs transformers
+            from transformers import AutoTokenizer
+
+            try:
+                self.__tokenizer = AutoTokenizer.from_pretrained(
+                    tokenizer_name, local_files_only=True
+                )
+            except (OSError, ValueError):
+                print(f"{tokenizer_name} tokenizer is not cached yet. Downloading...")
+                self.__tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+    def count(self, text: str) -> int:
+        """
+        Function that counts the tokens in a text.
+        """
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """
+        Function that counts the tokens in every text, in one call to the tokenizer if there is one.
+
+        Parameters:
+        - texts: list[str], texts to count
+
+        Returns:
+        - list[int], the number of tokens in every text
+        """
+        if not texts:
+            return []
+        if self.__tokenizer is not None:
+            ids = self.__tokenizer(texts, add_special_tokens=False)["input_ids"]
+            return [len(i) for i in ids]
+        # Rounded up, so an estimate that is off tends to stay under the budget
+        return [math.ceil(len(text) / self.chars_per_token) for text in texts]
+
+    def calibrate(self, text: str, tokens: int) -> None:
+        """
+        Function that moves the estimate towards a count of the tokens in a text by the LLM.
+        Does nothing when counting with the tokenizer.
+
+        Ollama only counts the tokens after the prefix a prompt shares with the one it evaluated
+        before, which it keeps cached (e.g. the system message). So the count is also read as
+        covering only the text after the prefix shared with the last text calibrated on, and
+        whichever reading is closer to the current estimate is taken.
+
+        Parameters:
+        - text: str, the text, e.g. a prompt
+        - tokens: int, its number of tokens, e.g. Ollama's prompt_eval_count
+        """
+        if self.__tokenizer is not None or tokens <= 0 or not text:
+            return
+        shared = len(os.path.commonprefix([self.__last_calibrated, text]))
+        self.__last_calibrated = text
+        ratio = min(
+            len(text) / tokens,
+            max(len(text) - shared, 1) / tokens,
+            key=lambda r: abs(r - self.chars_per_token),
+        )
+        low, high = CALIBRATION_RANGE
+        if low <= ratio <= high:
+            self.chars_per_token += CALIBRATION_WEIGHT * (ratio - self.chars_per_token)
+
+
+def get_token_counter() -> TokenCounter:
+    """
+    Function that returns the token counter shared by every prompt, creating it on first use.
+    """
+    global _token_counter
+    with _token_counter_lock:
+        if _token_counter is None:
+            _token_counter = TokenCounter()
+    return _token_counter
+
+
+def pack_context(
+    sources: List[Tuple[str, str]],
+    budget: Optional[int] = CONTEXT_TOKEN_BUDGET,
+    counter: Optional[TokenCounter] = None,
+) -> List[Tuple[str, str]]:
+    """
+    Function that fits retrieved chunks into a token budget, without repeated sentences.
+
+    Chunks are cut at sentence boundaries and only ever lose sentences from their end. A chunk left
+    with no sentences is dropped, except the most relevant one, whose first sentence is cut between
+    words if it is too long. Tokens are counted for every source as formatted in the prompt
+    (SOURCE_TEMPLATE), not counting the separators between sources.
+
+    Parameters:
+    - sources: list of (source name, chunk text) most relevant first
+    - budget: int, tokens the sources may take in the prompt, None to keep them whole (still deduplicated)
+    - counter: TokenCounter, counts the tokens (defaults to the shared one)
+
+    Returns:
+    - list of (source name, packed text) in the same order
+    """
+    # Split into sentences, each sentence kept only in the most relevant chunk it is in
+    seen = set()
+    candidates = []  # (source name, sentences)
+    for name, text in sources:
+        sentences = []
+        for sentence in sentence_splitter(text):
+            key = " ".join(sentence.lower().split())
+            if key and key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+        if sentences:
+            candidates.append((name, sentences))
+    if budget is None or not candidates:
+        return [(name, " ".join(sentences)) for name, sentences in candidates]
+
+    if counter is None:
+        counter = get_token_counter()
+    overheads = counter.count_many(
+        [SOURCE_TEMPLATE.format(name=name, content="") for name, _ in candidates]
+    )
+    # Sentences after the first are counted with the space joining them to the one before
+    counts = iter(
+        counter.count_many(
+            [
+                s if j == 0 else " " + s
+                for _, sentences in candidates
+                for j, s in enumerate(sentences)
+            ]
+        )
+    )
+    tokens = [[next(counts) for _ in sentences] for _, sentences in candidates]
+
+    taken = [0] * len(candidates)  # Sentences kept from the start of every chunk
+    remaining = budget
+
+    def take(i: int, limit: int) -> int:
+        """Keeps the next sentences of chunk i that fit in limit tokens, returns the tokens used."""
+        used = 0
+        while taken[i] < len(tokens[i]):
+            cost = tokens[i][taken[i]] + (overheads[i] if taken[i] == 0 else 0)
+            if used + cost > limit:
+                break
+            used += cost
+            taken[i] += 1
+        return used
+
+    # An equal share each first, then what's left to the most relevant chunks
+    share = budget // len(candidates)
+    for i in range(len(candidates)):
+        remaining -= take(i, share)
+    remaining -= take(0, remaining)
+    # A most relevant chunk whose first sentence is too long is cut between words instead,
+    # before the others top up so at least its own share is left for it
+    if taken[0] == 0:
+        words = candidates[0][1][0].split()
+        room = remaining - overheads[0]
+        # Most words that fit, found by bisection
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if counter.count(" ".join(words[:middle])) <= room:
+                low = middle
+            else:
+                high = middle - 1
+        if low > 0:
+            candidates[0][1][0] = " ".join(words[:low])
+            tokens[0][0] = counter.count(candidates[0][1][0])
+            remaining -= take(0, remaining)
+    for i in range(1, len(candidates)):
+        remaining -= take(i, remaining)
+
+    return [
+        (name, " ".join(sentences[:count]))
+        for (name, sentences), count in zip(candidates, taken)
+        if count > 0
+    ]
@@ -14,20 +14,53 @@ Other formats will be ignored. Once cleaned the data will be extracted to a unif
 # Standard imports
 import os
 import re
-import json
 from pathlib import Path
-from typing import Tuple, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Tuple, List, Optional
 
 # Internal imports
-from utils import embed_text
+from utils import embed_texts
+from manifest import IngestionManifest
+from shards import list_shards, load_shard, save_shard, remove_shard
+from config import (
+    EMBEDDING_CHUNKS_PER_PASS,
+    EMBEDDING_WORKERS,
+    CLEANING_WORKERS,
+    VECTOR_SHARD_FORMAT,
+)
+from embedding_pool import EmbeddingPool
 from const import PATH_TO_DATA, PATH_TO_CLEANED_DATA, PATH_TO_VECTORIZED_DATA
 
 # External imports
-import fitz
-import docx2txt
+# The parsers for each file type are imported when a file of that type is cleaned
+import numpy as np
 from tqdm import tqdm
-import lxml.etree as et
-from pptx import Presentation
+
+# Handler used by each cleaning worker process, set up once per process by _init_clean_worker
+_worker_handler = None
+
+
+def _init_clean_worker(
+    data_path: Path, clean_data_path: Path, vectorized_data_path: Path
+) -> None:
+    """
+    Sets up the data handler of a cleaning worker process.
+    """
+    global _worker_handler
+    _worker_handler = DataHandler(
+        data_path=data_path,
+        clean_data_path=clean_data_path,
+        vectorized_data_path=vectorized_data_path,
+    )
+
+
+def _clean_file_in_worker(file: str) -> List[Tuple[str, str]]:
+    """
+    Cleans a single file in a worker process, see DataHandler.clean_file.
+    The sections are sent back and written by the parent, in the order of the files.
+    """
+    return _worker_handler.clean_file(file)
 
 
 class DataHandler:
@@ -39,10 +72,13 @@ class DataHandler:
     - clean_data_path: str, path to the cleaned data folder
     - vectorized_data_path: str, path to the vectorized data folder
     - max_size_per_file: int, maximum size (number of key value pairs) of the dictionary before saving
+    - manifest: IngestionManifest, if given only new or modified files are cleaned and vectorized
+    - shard_format: str, format vectorized data is saved in, "npy" or "json" (see shards.py)
 
     Methods:
     - load_data: loads the data from the data folder
     - clean_data: cleans the data
+    - clean_file: cleans a single file
     """
 
     def __init__(
@@ -51,6 +87,8 @@ class DataHandler:
         clean_data_path: Path = Path(PATH_TO_CLEANED_DATA),
         vectorized_data_path: Path = Path(PATH_TO_VECTORIZED_DATA),
         max_size_per_file: int = 1000,
+        manifest: Optional[IngestionManifest] = None,
+        shard_format: str = VECTOR_SHARD_FORMAT,
     ) -> None:
         # Ensure the params are paths
         if not isinstance(data_path, Path):
@@ -69,6 +107,8 @@ class DataHandler:
             raise FileNotFoundError(
                 f"Vectorized data path {vectorized_data_path} does not exist."
             )
+        if shard_format not in ["npy", "json"]:
+            raise ValueError(f"Unknown shard format {shard_format}.")
         self.data_path = data_path
         self.clean_data_path = clean_data_path
         self.vectorized_data_path = vectorized_data_path
@@ -79,6 +119,11 @@ class DataHandler:
         )
         self.data_dict = {}  # Dictionary of titles and extracted content
         self.vectorized_data = {}  # Dictionary of titles and vectorized content
+        self.current_count = 0  # Titles in the vectorized data dictionary
+        self.file_counter = 1  # Number of the next vectorized data file
+        # Record of what was already ingested, only used in incremental mode
+        self.manifest = manifest
+        self.shard_format = shard_format
 
     def load_data(self) -> None:
         print("Loading data...")
@@ -95,35 +140,104 @@ class DataHandler:
                     print(f"File {file} is not in the accepted file types. Deleting...")
                     os.remove(os.path.join(root, file))
 
-    def clean_data(self) -> None:
+    def clean_data(self, num_workers: int = CLEANING_WORKERS) -> None:
+        """
+        Function that cleans the loaded data and writes it to the cleaned data folder.
+
+        Parameters:
+        - num_workers: int, number of processes to clean files with (1 cleans in this process)
+        """
         print("Cleaning data...")
-        for file in tqdm(self.data):
-            if file.split(".")[-1] in ["pdf", "PDF"]:
-                section_list = self.__clean_pdf(file)
-                for title, text in section_list:
-                    self.data_dict[title] = text
-                    self.__write_to_file(self.clean_data_path, title, text)
-                    continue
-            elif file.split(".")[-1] in ["txt", "TXT"]:
-                title, text = self.__clean_txt(file)
-            elif file.split(".")[-1] in ["docx", "DOCX"]:
-                title, text = self.__clean_docx(file)
-            elif file.split(".")[-1] in ["pptx", "PPTX"]:
-                title, text = self.__clean_pptx(file)
-            elif file.split(".")[-1] == "nxml":
-                title, text = self.__clean_nxml(file)
-            else:
-                print(
-                    f"File {file} is not in the accepted file types. Should have been deleted... Skipping..."
+        files = self.data
+        if self.manifest is not None:
+            # Drop the sections of files that were removed from the data folder
+            for file in self.manifest.deleted_files(self.data):
+                print(f"{file} was removed. Dropping its sections...")
+                for title in self.manifest.remove_file(file):
+                    self.__remove_file(self.clean_data_path, title)
+
+            # Only clean files that are new or were modified since the last run
+            files = self.manifest.changed_files(self.data)
+            print(f"{len(files)} of {len(self.data)} files are new or modified.")
+
+        if num_workers > 1:
+            # Hand out files in small groups, there can be thousands of tiny nxml files
+            chunksize = max(1, len(files) // (num_workers * 16))
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=_init_clean_worker,
+                initargs=(
+                    self.data_path,
+                    self.clean_data_path,
+                    self.vectorized_data_path,
+                ),
+            ) as executor:
+                # map yields in the order of files no matter which worker finishes first
+                results = executor.map(
+                    _clean_file_in_worker, files, chunksize=chunksize
                 )
-                continue
+                self.__merge_cleaned(files, results)
+        else:
+            self.__merge_cleaned(files, map(self.clean_file, files))
 
-            if title is None or text is None:
-                print(f"Error cleaning {file}. Skipping...")
-                continue
-            self.data_dict[title] = text
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def __merge_cleaned(
+        self, files: List[str], results: Iterable[List[Tuple[str, str]]]
+    ) -> None:
+        """
+        Helper function that writes the sections of cleaned files to the cleaned data folder,
+        adds them to the data dictionary and records them in the manifest.
+
+        Sections are written here, in the order of files, rather than by the workers that
+        cleaned them, so when two files give the same title the later file always wins.
+
+        Parameters:
+        - files: list[str], paths of the cleaned files
+        - results: iterable of the section lists of the files, in the same order
+        """
+        for file, section_list in tqdm(zip(files, results), total=len(files)):
+            for title, text in section_list:
+                self.__write_to_file(self.clean_data_path, title, text)
+                self.data_dict[title] = text
+
+            if self.manifest is not None:
+                gone = self.manifest.record_file(file, [t for t, _ in section_list])
+                for title in gone:
+                    self.__remove_file(self.clean_data_path, title)
+
+    def clean_file(self, file: str) -> List[Tuple[str, str]]:
+        """
+        Function that cleans a single file. Nothing is written, clean_data writes the sections.
+
+        Parameters:
+        - file: str, path to the file
+
+        Returns:
+        - List of tuples in the format (title, text), empty if the file could not be cleaned
+        """
+        if file.split(".")[-1] in ["pdf", "PDF"]:
+            return self.__clean_pdf(file)
+        elif file.split(".")[-1] in ["txt", "TXT"]:
+            title, text = self.__clean_txt(file)
+        elif file.split(".")[-1] in ["docx", "DOCX"]:
+            title, text = self.__clean_docx(file)
+        elif file.split(".")[-1] in ["pptx", "PPTX"]:
+            title, text = self.__clean_pptx(file)
+        elif file.split(".")[-1] == "nxml":
+            title, text = self.__clean_nxml(file)
+        else:
+            print(
+                f"File {file} is not in the accepted file types. Should have been deleted... Skipping..."
+            )
+            return []
 
-            self.__write_to_file(self.clean_data_path, title, text)
+        if title is None or text is None:
+            print(f"Error cleaning {file}. Skipping...")
+            return []
+
+        return [(title, text)]
 
     def __write_to_file(self, path: Path, title: str, text: str) -> None:
         """
@@ -134,7 +248,38 @@ class DataHandler:
         - title: str, title of the data
         - text: str, cleaned text of the data
         """
+        # Make sure the path exists
+        path.mkdir(parents=True, exist_ok=True)
+
+        # Define the full path to save the cleaned data
+        file_path = path / Path(self.__safe_title(title) + ".txt")
+
+        # Save the cleaned data
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def __remove_file(self, path: Path, title: str) -> None:
+        """
+        Function that removes the cleaned data of a section that no longer exists.
+
+        Parameters:
+        - path: Path, path to the folder where the cleaned data is saved
+        - title: str, title of the data
+        """
+        file_path = path / Path(self.__safe_title(title) + ".txt")
+        if file_path.exists():
+            os.remove(file_path)
+
+    def __safe_title(self, title: str) -> str:
+        """
+        Function that turns a title into a name that is safe to use as a file name.
 
+        Parameters:
+        - title: str, title of the data
+
+        Returns:
+        - safe_title: str, sanitized title
+        """
         # Sanitize the title by replacing path separators and invalid filename characters
         invalid_chars = '<>:"/\\|?*,.\r\n'
         safe_title = "".join(c for c in title if c not in invalid_chars)
@@ -150,33 +295,43 @@ class DataHandler:
             safe_title = "Untitled"
 
         # Clean up any leading or trailing spaces and ensure the title is safe
-        safe_title = safe_title.strip()
-
-        # Make sure the path exists
-        path.mkdir(parents=True, exist_ok=True)
-
-        # Define the full path to save the cleaned data
-        file_path = path / Path(safe_title + ".txt")
-
-        # Save the cleaned data
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(text)
+        return safe_title.strip()
 
-    def vectorize_data(self) -> None:
+    def vectorize_data(self, num_workers: int = EMBEDDING_WORKERS) -> None:
         """
         Function that vectorizes the data and saves them in multiple files when the dictionary size exceeds the limit.
+        With a manifest only the sections that were not vectorized yet are processed.
+
+        Parameters:
+        - num_workers: int, number of processes to embed with, each pinned to its own cores (1 embeds in this process)
         """
+        to_vectorize = None  # Titles left to vectorize when using a manifest
+        if self.manifest is not None:
+            to_vectorize = self.manifest.pending_vectorize()
+            if not to_vectorize:
+                print("No new or modified data to vectorize.")
+                return
+
         if not self.data_dict:
             print(
                 "Didn't clean data, assuming it's done already and saved. Loading data..."
             )
+            # Cleaned files are named after the sanitized titles
+            safe_titles = None
+            if to_vectorize is not None:
+                safe_titles = {self.__safe_title(t): t for t in to_vectorize}
+
             # Get data from the cleaned data folder
             for root, dirs, files in os.walk(self.clean_data_path):
                 print(f"Reading {root}...")
                 for file in tqdm(files):
+                    title = Path(file).stem
+                    if safe_titles is not None:
+                        if title not in safe_titles:
+                            continue
+                        title = safe_titles[title]
                     with open(os.path.join(root, file), "r", encoding="utf-8") as f:
                         text = f.read()
-                    title = Path(file).stem
                     self.data_dict[title] = text
 
         if not self.data_dict:
@@ -184,61 +339,173 @@ class DataHandler:
 
         print("Vectorizing data...")
 
-        current_count = 0  # To keep track of how many items are processed before saving
-        file_counter = 1  # To keep track of file names
+        self.current_count = 0  # To keep track of how many items are in the file
+        self.file_counter = 1  # To keep track of file names
+        if self.manifest is not None:
+            # Never overwrite shards that still hold vectors of unchanged files
+            self.file_counter = self.__next_file_counter()
 
-        # Vectorize the data and store them in batches
-        for title, text in tqdm(self.data_dict.items()):
-            if title == ".gitkeep":
-                continue
+        pool = EmbeddingPool(num_workers) if num_workers > 1 else None
+        try:
+            # Gather documents until we have enough chunks for a big embedding pass
+            # so short documents don't each get their own tiny batches
+            pending = {}
+            pending_chunks = 0
+            for title, text in tqdm(self.data_dict.items()):
+                if title == ".gitkeep":
+                    continue
+                if to_vectorize is not None and title not in to_vectorize:
+                    continue
+
+                pending[title] = text
+                # Rough chunk count, only used to decide when to embed. Passes grow with the
+                # workers so each of them gets several tasks before the pass is written out
+                pending_chunks += len(text.split()) // 256 + 1
+
+                if pending_chunks >= EMBEDDING_CHUNKS_PER_PASS * max(num_workers, 1):
+                    self.__vectorize_batch(pending, pool)
+                    pending = {}
+                    pending_chunks = 0
+
+            if pending:
+                self.__vectorize_batch(pending, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+
+        # Save any remaining data that was not saved in the last file
+        if self.vectorized_data:
+            self.__save_vectorized_data(self.file_counter)
+
+        if self.manifest is not None:
+            # Delete shards whose sections were all re-vectorized into newer shards
+            for shard in self.manifest.stale_shards():
+                remove_shard(self.vectorized_data_path, shard)
+                self.manifest.forget_shard(shard)
+            self.manifest.save()
 
-            embeddings, chunks = embed_text(text)
+    def __next_file_counter(self) -> int:
+        """
+        Helper function that finds the number following the highest existing vectorized data file.
+        """
+        numbers = [
+            int(match.group(1))
+            for shard, _ in list_shards(self.vectorized_data_path)
+            if (match := re.fullmatch(r"vectorized_data_(\d+)", shard))
+        ]
+        return max(numbers, default=0) + 1
+
+    def __vectorize_batch(
+        self, texts: dict, pool: Optional[EmbeddingPool] = None
+    ) -> None:
+        """
+        Helper function that embeds a group of documents in one go and stores them,
+        saving to a new file whenever the dictionary size reaches the limit.
 
-            # Vectorize the text (assuming embed_text is defined elsewhere)
+        Parameters:
+        - texts: dict, titles mapped to the cleaned text to vectorize
+        - pool: EmbeddingPool, worker processes to embed with (None embeds in this process)
+        """
+        for title, (embeddings, chunks) in embed_texts(texts, pool=pool).items():
             self.vectorized_data[title] = {
-                "embeddings": embeddings.tolist(),
+                "embeddings": embeddings,
                 "texts": chunks,
             }
 
-            current_count += 1  # Increment the count
+            self.current_count += 1  # Increment the count
 
             # Check if the current dictionary has reached the size limit
-            if current_count >= self.max_size_per_file:
+            if self.current_count >= self.max_size_per_file:
                 # Save the vectorized data to a file
-                self.__save_vectorized_data(file_counter)
-                file_counter += 1  # Increment the file counter
-                current_count = 0  # Reset the count
+                self.__save_vectorized_data(self.file_counter)
+                self.file_counter += 1  # Increment the file counter
+                self.current_count = 0  # Reset the count
                 self.vectorized_data = {}  # Clear the current dictionary to start fresh
 
-        # Save any remaining data that was not saved in the last file
-        if self.vectorized_data:
-            self.__save_vectorized_data(file_counter)
-
     def __save_vectorized_data(self, file_counter: int) -> None:
         """
         Helper function to save vectorized data to a file.
         """
-        file_name = f"vectorized_data_{file_counter}.json"
-        with open(
-            self.vectorized_data_path / Path(file_name), "w", encoding="utf-8"
-        ) as f:
-            json.dump(self.vectorized_data, f)
-        # print(f"Saved vectorized data to {file_name}")
+        shard = f"vectorized_data_{file_counter}"
+        save_shard(
+            self.vectorized_data_path, shard, self.vectorized_data, self.shard_format
+        )
 
-    def load_vectorized_data(self):
+        if self.manifest is not None:
+            self.manifest.record_shard(
+                list(self.vectorized_data),
+                shard,
+                {title: len(v["texts"]) for title, v in self.vectorized_data.items()},
+            )
+        # print(f"Saved vectorized data to {shard}")
+
+    def load_vectorized_data(self, pending_only: bool = False, num_workers: int = 1):
         """
         Generator that yields (key, vector) pairs from vectorized data files,
         instead of loading everything into memory at once.
+
+        With a manifest, copies of sections that were superseded by a newer shard are skipped.
+
+        Parameters:
+        - pending_only: bool, only yield sections the manifest has not marked as loaded into the vector DB
+        - num_workers: int, number of shards read ahead on threads. With 1 the shards are streamed one
+          section at a time, otherwise up to num_workers whole shards are held in memory
+        """
+        pending = None
+        if pending_only and self.manifest is not None:
+            pending = self.manifest.pending_index()
+            pending_shards = {self.manifest.titles[title]["shard"] for title in pending}
+
+        shards = [
+            (shard, shard_format)
+            for shard, shard_format in list_shards(self.vectorized_data_path)
+            if pending is None or shard in pending_shards
+        ]
+
+        if num_workers <= 1:
+            for shard, shard_format in shards:
+                yield from self.__read_shard(shard, shard_format, pending)
+            return
+
+        # Read the next shards while the current one is being consumed, in order
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            reads = deque()
+            for shard, shard_format in shards:
+                reads.append(
+                    executor.submit(
+                        self.__read_shard_fully, shard, shard_format, pending
+                    )
+                )
+                if len(reads) > num_workers:
+                    yield from reads.popleft().result()
+            while reads:
+                yield from reads.popleft().result()
+
+    def __read_shard(
+        self, shard: str, shard_format: str, pending: Optional[set]
+    ) -> Iterable[Tuple[str, dict]]:
+        """
+        Helper generator that yields the sections of a shard that should be loaded.
+        """
+        print(f"Loading {shard} ({shard_format})...")
+        for k, v in load_shard(self.vectorized_data_path, shard, shard_format):
+            if self.manifest is not None and self.manifest.is_stale(k, shard):
+                continue
+            if pending is not None and k not in pending:
+                continue
+            yield k, v
+
+    def __read_shard_fully(
+        self, shard: str, shard_format: str, pending: Optional[set]
+    ) -> List[Tuple[str, dict]]:
+        """
+        Helper function that reads the sections of a shard into memory, so it can run on a worker thread.
         """
-        for file in os.listdir(self.vectorized_data_path):
-            if file.endswith(".json"):
-                print(f"Loading {file}...")
-                with open(
-                    self.vectorized_data_path / Path(file), "r", encoding="utf-8"
-                ) as f:
-                    data = json.load(f)
-                    for k, v in data.items():
-                        yield k, dict(v)
+        return [
+            # Copied out of the memory map so the disk is read here, not by the consumer
+            (k, {"embeddings": np.array(v["embeddings"]), "texts": v["texts"]})
+            for k, v in self.__read_shard(shard, shard_format, pending)
+        ]
 
     def __clean_pdf(self, file: str) -> List[Tuple[str, str]]:
         """
@@ -257,6 +524,8 @@ class DataHandler:
         if not file.lower().endswith(".pdf"):
             raise ValueError(f"File {file} is not a PDF file. Cannot clean as PDF.")
 
+        import fitz
+
         pdf = fitz.open(file)
         title = Path(file).stem  # Extract filename without extension
         sections_list = []
@@ -316,6 +585,8 @@ class DataHandler:
         if file.split(".")[-1].lower() != "pdf":
             raise ValueError(f"File {file} is not a PDF file. Cannot clean as PDF.")
 
+        import fitz
+
         pdf = fitz.open(file)
         sections_list = []
         current_section = "Introduction"  # Default section title if no headers detected
@@ -430,6 +701,8 @@ class DataHandler:
         if file.split(".")[-1] not in ["docx", "DOCX"]:
             raise ValueError(f"File {file} is not a DOCX file. Cannot clean as DOCX.")
         # Open the DOCX file
+        import docx2txt
+
         text = docx2txt.process(file)
         title = file.split("/")[-1].split(".")[0]
         return title, text
@@ -450,6 +723,8 @@ class DataHandler:
         if file.split(".")[-1] not in ["pptx", "PPTX"]:
             raise ValueError(f"File {file} is not a PPTX file. Cannot clean as PPTX.")
         # Open the PPTX file
+        from pptx import Presentation
+
         ppt = Presentation(file)
         text = ""
         for slide in ppt.slides:
@@ -476,6 +751,8 @@ class DataHandler:
             raise ValueError(f"File {file} is not an nxml file. Cannot clean as nxml.")
 
         # Set up file extraction
+        import lxml.etree as et
+
         tree = et.parse(file)
         root = tree.getroot()
 
@@ -0,0 +1,173 @@
+"""
+File that contains a pool of embedding worker processes for bulk vectorization.
+
+PyTorch splits one forward pass over all the cores, which scales poorly for a model as small as
+MiniLM. The pool instead runs one copy of the model per worker process, each pinned to its own
+slice of the cores and running on that many threads, so the workers don't fight over cores.
+
+The parent sorts the chunks by length and cuts them into tasks of whole batches, so the workers
+embed the same length-sorted batches that embedding in one process would and the vectors (and the
+shards saved from them) don't change. Results are collected back in the order of the chunks.
+"""
+
+# Standard imports
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+# Internal imports
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS, EMBEDDING_BATCHES_PER_TASK
+
+# External imports
+import numpy as np
+
+
+def _init_embedding_worker(core_slices, threads: int) -> None:
+    """
+    Pins an embedding worker process to the next free slice of cores and loads the model.
+    """
+    cores = core_slices.get()
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # Read by the BLAS and OpenMP libraries when torch or onnxruntime is first imported
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[variable] = str(threads)
+
+    # Imported here so the parent process never loads the model
+    from utils import get_embedding_model
+
+    get_embedding_model(threads=threads)
+
+
+def _embed_in_worker(chunks: List[str], batch_size: int) -> np.ndarray:
+    """
+    Embeds chunks (already sorted by length) in an embedding worker process.
+    """
+    from utils import get_embedding_model
+
+    model = get_embedding_model()
+    if not chunks:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    return np.asarray(
+        model.encode(
+            chunks,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ),
+        dtype=np.float32,
+    )
+
+
+def core_slices(num_workers: int) -> List[List[int]]:
+    """
+    Function that splits the cores this process may run on into one slice per worker.
+
+    Parameters:
+    - num_workers: int, number of worker processes
+
+    Returns:
+    - list with the cores of every worker (empty lists if the cores can't be listed)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = []
+    if len(cores) < num_workers:
+        # Fewer cores than workers, or no affinity on this platform: don't pin
+        return [[] for _ in range(num_workers)]
+    per_worker = len(cores) // num_workers
+    return [cores[i * per_worker : (i + 1) * per_worker] for i in range(num_workers)]
+
+
+class EmbeddingPool:
+    """
+    Class for a pool of processes that embed chunks, each pinned to its own slice of cores.
+
+    Close it (or use it as a context manager) to stop the workers. Workers are started (and load
+    the model) as the first tasks are sent to them.
+
+    Attributes:
+    - num_workers: int, number of worker processes
+    - batch_size: int, number of chunks per forward pass of the model
+    - batches_per_task: int, number of batches sent to a worker at a time
+    """
+
+    def __init__(
+        self,
+        num_workers: int = EMBEDDING_WORKERS,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        batches_per_task: int = EMBEDDING_BATCHES_PER_TASK,
+    ) -> None:
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1.")
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.batches_per_task = batches_per_task
+
+        # Spawned, since forking a process that already started threads (torch, tqdm) can deadlock
+        context = multiprocessing.get_context("spawn")
+        slices = core_slices(self.num_workers)
+        free_slices = context.Queue()
+        for cores in slices:
+            free_slices.put(cores)
+        threads = max(1, len(slices[0]) or (os.cpu_count() or 1) // self.num_workers)
+
+        self.__executor: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=context,
+            initializer=_init_embedding_worker,
+            initargs=(free_slices, threads),
+        )
+
+    def __enter__(self) -> "EmbeddingPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Function that stops the worker processes.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def embed_chunks(self, chunks: List[str]) -> np.ndarray:
+        """
+        Function that embeds a list of chunks on the workers, like utils.embed_chunks.
+
+        Parameters:
+        - chunks: list[str], chunks to embed
+
+        Returns:
+        - np.array of shape (len(chunks), embedding_dim), in the order of the chunks
+        """
+        if self.__executor is None:
+            raise RuntimeError("The pool is closed.")
+        if not chunks:
+            # The parent never loads the model, a worker knows its dimensions
+            return self.__executor.submit(
+                _embed_in_worker, [], self.batch_size
+            ).result()
+
+        # Longest first, like utils.embed_chunks, so the batches are the same
+        order = sorted(range(len(chunks)), key=lambda i: len(chunks[i]), reverse=True)
+        task_size = self.batch_size * self.batches_per_task
+        futures = [
+            self.__executor.submit(
+                _embed_in_worker,
+                [chunks[i] for i in order[start : start + task_size]],
+                self.batch_size,
+            )
+            for start in range(0, len(order), task_size)
+        ]
+        # Waited on in the order they were submitted, whichever worker finishes first
+        sorted_embeddings = np.concatenate([future.result() for future in futures])
+
+        # Put the embeddings back in the order of the chunks
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
@@ -0,0 +1,766 @@
+"""
+File that contains an inverted-file index with product-quantized residuals (IVF-PQ), for corpora
+whose embeddings don't fit in memory as a flat matrix or an HNSW graph.
+
+Namely:
+- kmeans: Lloyd's k-means in numpy, used to train both levels of the index
+- IVFPQIndex: the index itself, trained on a sample of the embeddings
+- IVFPQVectorStore: the vector store backend built on it (VECTOR_STORE_BACKEND = "ivf_pq")
+
+How the index works:
+- The embeddings are split into nlist clusters (the inverted lists) by k-means on their centroids.
+- What is left of an embedding once its centroid is taken away (the residual) is cut into
+  subspaces dimension slices, each replaced by the id of its nearest of 256 trained centroids,
+  so a chunk is stored as subspaces bytes instead of 4 bytes per dimension.
+- A search only scores the chunks of the nprobe lists whose centroids are closest to the query.
+  The dot product with a chunk is the one with its centroid plus a sum of subspaces values looked
+  up in a table computed once per query.
+
+The scores are those of the reconstructed embeddings, so they are approximate: a higher nprobe
+finds more of the true neighbours but scores more chunks. The vector store keeps the full precision
+embeddings on disk as well, and rescores the best rescore * n_results candidates with them.
+"""
+
+# Standard imports
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Internal imports
+from cache import QueryEmbeddingCache
+from const import PATH_TO_IVF_PQ_INDEX
+from config import (
+    DEFAULT_RESULTS_PER_SEARCH,
+    IVF_PQ_NLIST,
+    IVF_PQ_SUBSPACES,
+    IVF_PQ_NPROBE,
+    IVF_PQ_RESCORE,
+    IVF_PQ_TRAIN_SIZE,
+    IVF_PQ_KMEANS_ITERATIONS,
+)
+from text_store import TextStore
+from vector_store import VectorStore, chunk_id
+
+# External imports
+import numpy as np
+
+PQ_CENTROIDS = 256  # Centroids per subspace, so a code fits in one byte
+# k-means trains on at most this many vectors per centroid, more barely moves the centroids
+MAX_POINTS_PER_CENTROID = 64
+ASSIGN_BLOCK_ROWS = 16384  # Rows assigned to their nearest centroid at a time
+# Chunk ids are 32 hex characters (see chunk_id), kept as bytes rather than 4-byte characters
+ID_DTYPE = "S32"
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Function that finds the closest centroid (by euclidean distance) of every vector.
+
+    Parameters:
+    - vectors: np.array, (n, d) vectors
+    - centroids: np.array, (k, d) centroids
+
+    Returns:
+    - np.array, (n,) index of the nearest centroid of every vector
+    """
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 is the same for every centroid
+    squared_norms = (centroids * centroids).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = vectors[start : start + ASSIGN_BLOCK_ROWS]
+        distances = squared_norms - 2 * (block @ centroids.T)
+        assignment[start : start + len(block)] = distances.argmin(axis=1)
+    return assignment
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """
+    Function that clusters vectors with Lloyd's k-means.
+    Centroids start as random vectors and empty clusters are restarted from random vectors.
+    At most MAX_POINTS_PER_CENTROID * k of the vectors (picked at random) are used.
+
+    Parameters:
+    - vectors: np.array, (n, d) float32 vectors to cluster
+    - k: int, number of clusters (at most n)
+    - iterations: int, number of assignment and update steps
+    - seed: int, seed of the random generator
+
+    Returns:
+    - np.array, (k, d) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    if len(vectors) > k * MAX_POINTS_PER_CENTROID:
+        vectors = vectors[
+            rng.choice(len(vectors), k * MAX_POINTS_PER_CENTROID, replace=False)
+        ]
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+
+        # Sums of every cluster in one pass over the vectors sorted by cluster
+        order = np.argsort(assignment, kind="stable")
+        starts = (np.cumsum(counts) - counts)[filled]
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+
+        if not filled.all():
+            centroids[~filled] = vectors[rng.choice(len(vectors), (~filled).sum())]
+    return centroids.astype(np.float32)
+
+
+class IVFPQIndex:
+    """
+    Class for an IVF-PQ index over normalized embeddings, searched by dot product.
+
+    Rows are numbered in the order they are added, the caller keeps what each row is.
+
+    Attributes:
+    - nlist: int, number of inverted lists
+    - subspaces: int, number of slices an embedding is cut into (must divide its dimensions)
+    - centroids: np.array, (nlist, d) centroids of the inverted lists
+    - codebooks: np.array, (subspaces, 256, d / subspaces) centroids of every slice of the residuals
+    - lists: np.array, (rows,) inverted list of every row
+    - codes: np.array, (rows, subspaces) uint8 codes of every row
+    """
+
+    def __init__(self, nlist: int = IVF_PQ_NLIST, subspaces: int = IVF_PQ_SUBSPACES):
+        self.nlist = nlist
+        self.subspaces = subspaces
+        self.centroids = None
+        self.codebooks = None
+        self.lists = np.zeros(0, dtype=np.int32)
+        self.codes = np.zeros((0, subspaces), dtype=np.uint8)
+        self.__order = np.zeros(0, dtype=np.int64)
+        self.__list_starts = np.zeros(1, dtype=np.int64)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return len(self.lists)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Bytes held in memory by the index.
+        """
+        arrays = [self.lists, self.codes, self.__order, self.__list_starts]
+        if self.is_trained:
+            arrays += [self.centroids, self.codebooks]
+        return sum(a.nbytes for a in arrays)
+
+    def train(
+        self,
+        vectors: np.ndarray,
+        iterations: int = IVF_PQ_KMEANS_ITERATIONS,
+        seed: int = 0,
+    ) -> None:
+        """
+        Function that trains the centroids of the lists and the codebooks of the residuals.
+
+        Parameters:
+        - vectors: np.array, (n, d) sample of the normalized embeddings to index
+        - iterations: int, k-means iterations of each training
+        - seed: int, seed of the random generator
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        dimensions = vectors.shape[1]
+        if dimensions % self.subspaces != 0:
+            raise ValueError(
+                f"{self.subspaces} subspaces don't divide {dimensions} dimensions."
+            )
+
+        self.centroids = kmeans(vectors, self.nlist, iterations, seed)
+        self.nlist = len(self.centroids)
+        residuals = vectors - self.centroids[nearest_centroids(vectors, self.centroids)]
+
+        width = dimensions // self.subspaces
+        self.codebooks = np.zeros(
+            (self.subspaces, PQ_CENTROIDS, width), dtype=np.float32
+        )
+        for j in range(self.subspaces):
+            # Small samples train fewer centroids, the unused codes are never assigned
+            trained = kmeans(
+                np.ascontiguousarray(residuals[:, j * width : (j + 1) * width]),
+                PQ_CENTROIDS,
+                iterations,
+                seed + j + 1,
+            )
+            self.codebooks[j, : len(trained)] = trained
+            self.codebooks[j, len(trained) :] = np.inf
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Function that assigns vectors to their list and encodes their residuals.
+
+        Parameters:
+        - vectors: np.array, (n, d) normalized embeddings
+
+        Returns:
+        - tuple in the format (lists, codes) of shapes (n,) and (n, subspaces)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        lists = nearest_centroids(vectors, self.centroids)
+        residuals = vectors - self.centroids[lists]
+        width = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            codebook = self.codebooks[j]
+            trained = np.isfinite(codebook[:, 0])
+            codes[:, j] = np.flatnonzero(trained)[
+                nearest_centroids(
+                    residuals[:, j * width : (j + 1) * width], codebook[trained]
+                )
+            ]
+        return lists.astype(np.int32), codes
+
+    def add(self, vectors: np.ndarray) -> None:
+        """
+        Function that encodes and appends vectors, as rows numbered after the existing ones.
+
+        Parameters:
+        - vectors: np.array, (n, d) normalized embeddings
+        """
+        if not self.is_trained:
+            raise RuntimeError("The index must be trained before vectors are added.")
+        lists, codes = self.encode(vectors)
+        self.set_rows(
+            np.concatenate([self.lists, lists]), np.concatenate([self.codes, codes])
+        )
+
+    def set_rows(self, lists: np.ndarray, codes: np.ndarray) -> None:
+        """
+        Function that replaces the encoded rows, e.g. with a subset of them once some are removed.
+
+        Parameters:
+        - lists: np.array, (rows,) inverted list of every row
+        - codes: np.array, (rows, subspaces) codes of every row
+        """
+        self.lists = np.ascontiguousarray(lists, dtype=np.int32)
+        self.codes = np.ascontiguousarray(codes, dtype=np.uint8)
+        # Rows grouped by list, so a probed list is one contiguous slice
+        self.__order = np.argsort(self.lists, kind="stable")
+        counts = np.bincount(self.lists, minlength=self.nlist)
+        self.__list_starts = np.concatenate([[0], np.cumsum(counts)])
+
+    def search(
+        self, queries: np.ndarray, n_results: int, nprobe: int = IVF_PQ_NPROBE
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Function that finds the rows with the highest approximate dot product with every query.
+
+        Parameters:
+        - queries: np.array, (d,) or (number of queries, d) normalized embeddings
+        - n_results: int, number of rows to return per query
+        - nprobe: int, number of inverted lists scored per query
+
+        Returns:
+        - list with, for every query, a list of (row, score) best match first
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if len(self) == 0:
+            return [[] for _ in queries]
+        nprobe = min(nprobe, self.nlist)
+        width = self.codebooks.shape[2]
+        subspace = np.arange(self.subspaces)
+
+        coarse = queries @ self.centroids.T
+        probed = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, query_coarse, lists in zip(queries, coarse, probed):
+            # Dot product of every slice of the query with every centroid of its codebook
+            table = np.einsum(
+                "jkw,jw->jk",
+                self.codebooks,
+                query.reshape(self.subspaces, width),
+            )
+            table[~np.isfinite(table)] = 0
+
+            rows = np.concatenate(
+                [
+                    self.__order[self.__list_starts[l] : self.__list_starts[l + 1]]
+                    for l in lists
+                ]
+            )
+            if len(rows) == 0:
+                results.append([])
+                continue
+            scores = query_coarse[self.lists[rows]] + table[
+                subspace, self.codes[rows]
+            ].sum(axis=1)
+            k = min(n_results, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            results.append([(int(rows[i]), float(scores[i])) for i in best])
+        return results
+
+    def save(self, path: Path) -> None:
+        """
+        Function that saves the index to <path>.npz, through a temporary file.
+
+        Parameters:
+        - path: Path, path of the index without extension
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            codebooks=self.codebooks,
+            lists=self.lists,
+            codes=self.codes,
+        )
+        os.replace(tmp_path, path.with_name(path.name + ".npz"))
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFPQIndex":
+        """
+        Function that loads an index saved by save.
+
+        Parameters:
+        - path: Path, path of the index without extension
+
+        Returns:
+        - IVFPQIndex, the index
+        """
+        with np.load(path.with_name(path.name + ".npz")) as arrays:
+            index = cls(len(arrays["centroids"]), arrays["codes"].shape[1])
+            index.centroids = arrays["centroids"]
+            index.codebooks = arrays["codebooks"]
+            index.set_rows(arrays["lists"], arrays["codes"])
+        return index
+
+
+class IVFPQVectorStore(VectorStore):
+    """
+    Class for a vector store backed by an IVF-PQ index.
+
+    The index is trained on a random sample of the vector shards the first time data is added,
+    then every shard is encoded. Later additions are encoded with the same training, so delete
+    the index files to train it again once the corpus has changed a lot. Chunk texts are kept
+    in a TextStore and the full precision embeddings in a memory-mapped file, so only the codes,
+    ids, title numbers and text offsets are held in memory, in fixed-width arrays.
+
+    Files:
+    - <path>.npz: the trained index and the codes of every chunk
+    - <path>.vectors.f32: the normalized float32 embeddings of every chunk, one row after the other
+    - <path>.meta.npz: the chunk ids, titles and text offsets, and the data version
+    - <path>_texts.*: the text store
+
+    Attributes:
+    - path: Path, path of the index files without extension
+    - nprobe: int, number of inverted lists scored per query
+    - rescore: int, candidates rescored with full precision per result asked for (0 to use the codes' scores)
+    - train_size: int, number of embeddings sampled to train the index
+    - index: IVFPQIndex, the index
+    - text_store: TextStore, texts of the chunks
+    - ids: np.array, (number of chunks,) ASCII id of every chunk
+    - title_table: list[str], every title, each once
+    - title_rows: np.array, (number of chunks,) int32 position in title_table of every chunk's title
+    - spans: np.array, (number of chunks, 2) int64 offset and length of every chunk's text in the text store
+    """
+
+    def __init__(
+        self,
+        path: Path = Path(PATH_TO_IVF_PQ_INDEX),
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        nlist: int = IVF_PQ_NLIST,
+        subspaces: int = IVF_PQ_SUBSPACES,
+        nprobe: int = IVF_PQ_NPROBE,
+        rescore: int = IVF_PQ_RESCORE,
+        train_size: int = IVF_PQ_TRAIN_SIZE,
+    ) -> None:
+        super().__init__(query_cache)
+        if not isinstance(path, Path):
+            raise ValueError("Index path must be a Path object.")
+        self.path = path
+        self.nprobe = nprobe
+        self.rescore = rescore
+        self.train_size = train_size
+        self.index = IVFPQIndex(nlist, subspaces)
+        self.text_store = TextStore(path.with_name(path.name + "_texts"))
+        self.ids = np.empty(0, dtype=ID_DTYPE)
+        self.title_table = []
+        self.title_rows = np.empty(0, dtype=np.int32)
+        self.spans = np.empty((0, 2), dtype=np.int64)
+        self.__title_numbers = {}
+        self.__version = 0
+        self.__dimensions = 0
+        self.__vectors = None
+
+        if self.__meta_path.exists():
+            self.__load()
+            print(f"IVF-PQ index '{self.path}' loaded with {len(self)} chunks.")
+
+    @property
+    def __meta_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".meta.npz")
+
+    @property
+    def __vectors_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".vectors.f32")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Bytes of the index and the chunk ids, titles and text offsets held in memory (texts not included).
+        """
+        titles = sys.getsizeof(self.title_table) + sum(
+            sys.getsizeof(title) for title in self.title_table
+        )
+        return (
+            self.index.memory_bytes
+            + self.ids.nbytes
+            + self.title_rows.nbytes
+            + self.spans.nbytes
+            + titles
+        )
+
+    @property
+    def data_version(self) -> str:
+        """
+        Version of the index's contents, changes whenever data is added or removed.
+        """
+        return f"{self.__version}:{len(self)}"
+
+    def add_data(self, handler) -> None:
+        """
+        Function that adds the vectorized data of a DataHandler to the index and saves it.
+
+        Behaves like NumpyVectorStore.add_data: without a manifest the data is only added
+        if the index is empty, with one only pending sections are added and removed or
+        modified ones are dropped first. An untrained index reads the shards twice, once
+        to sample the training embeddings and once to encode them.
+
+        Parameters:
+        - handler: DataHandler, handler to load the vectorized data from
+        """
+        manifest = handler.manifest
+        if manifest is None:
+            if len(self) > 0:
+                print("Index already populated. Skipping data addition.")
+                return
+        elif len(self) > 0:
+            stale_titles = manifest.removed_titles | manifest.pending_index()
+            if not stale_titles:
+                print("Index is up to date. Skipping data addition.")
+                return
+            self.__drop_titles(stale_titles)
+
+        pending_only = manifest is not None and len(self) > 0
+        if not self.index.is_trained:
+            sample = self.__sample(handler.load_vectorized_data())
+            if len(sample) == 0:
+                print("No vectorized data to index.")
+                return
+            print(f"Training the IVF-PQ index on {len(sample)} embeddings...")
+            self.index.train(sample)
+
+        added_titles = self.add_sections(
+            handler.load_vectorized_data(pending_only=pending_only)
+        )
+
+        if manifest is not None:
+            manifest.mark_indexed(added_titles)
+            manifest.clear_removed()
+            manifest.save()
+
+    def __sample(self, sections: Iterable[Tuple[str, dict]]) -> np.ndarray:
+        """
+        Helper function that draws a uniform random sample of the embeddings (reservoir sampling),
+        holding at most train_size of them in memory.
+        """
+        rng = np.random.default_rng(0)
+        reservoir = None
+        seen = 0
+        for _, emb_and_text in sections:
+            embeddings = self.__normalize(
+                np.asarray(emb_and_text["embeddings"], dtype=np.float32)
+            )
+            if len(embeddings) == 0:
+                continue
+            if reservoir is None:
+                reservoir = np.empty(
+                    (self.train_size, embeddings.shape[1]), dtype=np.float32
+                )
+            # Rows that fit are kept, then row t replaces a random slot with probability size / (t + 1)
+            fill = max(min(self.train_size - seen, len(embeddings)), 0)
+            reservoir[seen : seen + fill] = embeddings[:fill]
+            positions = np.arange(seen + fill, seen + len(embeddings))
+            slots = rng.integers(0, positions + 1)
+            kept = slots < self.train_size
+            reservoir[slots[kept]] = embeddings[fill:][kept]
+            seen += len(embeddings)
+        if reservoir is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return reservoir[: min(seen, self.train_size)]
+
+    def add_sections(self, sections: Iterable[Tuple[str, dict]]) -> list:
+        """
+        Function that encodes sections into the (trained) index and saves it.
+
+        Parameters:
+        - sections: iterable of (title, {"embeddings": np.array, "texts": list of chunks})
+
+        Returns:
+        - list[str], the titles that were added
+        """
+        lists = [self.index.lists]
+        codes = [self.index.codes]
+        ids = [self.ids]
+        title_rows = [self.title_rows]
+        spans = [self.spans]
+        added_titles = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.__vectors_path, "ab") as vectors_file:
+            # Drop rows a crashed run appended after the last save (all of them if it never
+            # saved), so the rows of the file stay the rows of the index
+            vectors_file.truncate(len(self) * self.__dimensions * 4)
+            for title, emb_and_text in sections:
+                embeddings = np.asarray(emb_and_text["embeddings"], dtype=np.float32)
+                if len(embeddings) == 0:
+                    continue
+                embeddings = self.__normalize(embeddings)
+                self.__dimensions = embeddings.shape[1]
+                vectors_file.write(embeddings.tobytes())
+                section_lists, section_codes = self.index.encode(embeddings)
+                lists.append(section_lists)
+                codes.append(section_codes)
+                ids.append(
+                    np.array(
+                        [
+                            chunk_id(title, i, text)
+                            for i, text in enumerate(emb_and_text["texts"])
+                        ],
+                        dtype=ID_DTYPE,
+                    )
+                )
+                title_rows.append(
+                    np.full(len(embeddings), self.__title_number(title), np.int32)
+                )
+                spans.append(
+                    np.array(
+                        self.text_store.append_many(emb_and_text["texts"]),
+                        dtype=np.int64,
+                    ).reshape(-1, 2)
+                )
+                added_titles.append(title)
+
+        if added_titles:
+            # Grown once so adding many sections doesn't copy the rows every time
+            self.index.set_rows(np.concatenate(lists), np.concatenate(codes))
+            self.ids = np.concatenate(ids)
+            self.title_rows = np.concatenate(title_rows)
+            self.spans = np.concatenate(spans)
+            self.__version += 1
+            self.save()
+        return added_titles
+
+    def __title_number(self, title: str) -> int:
+        """
+        Helper function that returns the position of a title in the title table, adding it if it's new.
+        """
+        number = self.__title_numbers.get(title)
+        if number is None:
+            number = self.__title_numbers[title] = len(self.title_table)
+            self.title_table.append(title)
+        return number
+
+    def __key(self, row: int) -> str:
+        """
+        Helper function that returns the "<chunk id>_<title>" key of a row.
+        """
+        return (
+            f"{self.ids[row].decode('ascii')}_{self.title_table[self.title_rows[row]]}"
+        )
+
+    def __text(self, row: int) -> str:
+        """
+        Helper function that reads the text of a row from the text store.
+        """
+        offset, length = self.spans[row]
+        return self.text_store.get(int(offset), int(length))
+
+    def __normalize(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Helper function that scales rows to unit length so a dot product is the cosine similarity.
+        """
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def __drop_titles(self, titles: Iterable[str]) -> None:
+        """
+        Helper function that removes every chunk of the given sections.
+        Their texts and titles stay in the append-only text store and the title table.
+        """
+        numbers = [self.__title_numbers[t] for t in titles if t in self.__title_numbers]
+        keep = ~np.isin(self.title_rows, numbers)
+        if keep.all():
+            return
+        # Compacted first, the embeddings file is mapped with the rows the index has
+        self.__compact_vectors(keep)
+        self.index.set_rows(self.index.lists[keep], self.index.codes[keep])
+        self.ids = self.ids[keep]
+        self.title_rows = self.title_rows[keep]
+        self.spans = self.spans[keep]
+        self.__version += 1
+        self.save()
+
+    def __compact_vectors(self, keep: np.ndarray) -> None:
+        """
+        Helper function that rewrites the embeddings file with only the kept rows, a block at a time.
+        """
+        vectors = self.__mapped_vectors()
+        tmp_path = self.path.with_name(self.path.name + ".vectors.tmp")
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(keep), ASSIGN_BLOCK_ROWS):
+                block = slice(start, start + ASSIGN_BLOCK_ROWS)
+                f.write(np.ascontiguousarray(vectors[block][keep[block]]).tobytes())
+        self.__vectors = None
+        os.replace(tmp_path, self.__vectors_path)
+
+    def __mapped_vectors(self) -> np.ndarray:
+        """
+        Helper function that memory-maps the embeddings file, mapping it again if it grew.
+        """
+        if self.__vectors is None or len(self.__vectors) != len(self.index):
+            self.__vectors = np.memmap(
+                self.__vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self.index), self.__dimensions),
+            )
+        return self.__vectors
+
+    def top_k(
+        self, queries: np.ndarray, n_results: int
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Function that finds the chunks with the highest approximate cosine similarity to queries.
+
+        Parameters:
+        - queries: np.array, (d,) or (number of queries, d) query embeddings
+        - n_results: int, number of chunks to return per query
+
+        Returns:
+        - list with, for every query, a list of (row, cosine similarity) best match first
+        """
+        queries = self.__normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if self.rescore < 1 or len(self) == 0:
+            return self.index.search(queries, n_results, self.nprobe)
+
+        vectors = self.__mapped_vectors()
+        results = []
+        candidates = self.index.search(queries, n_results * self.rescore, self.nprobe)
+        for query, found in zip(queries, candidates):
+            # Sorted so the rows are read from disk in order
+            rows = np.sort(np.array([row for row, _ in found], dtype=np.int64))
+            exact = vectors[rows] @ query
+            best = np.argsort(-exact)[:n_results]
+            results.append([(int(rows[i]), float(exact[i])) for i in best])
+        return results
+
+    def warm_up(self) -> None:
+        """
+        Function that runs a search for a stored embedding and reads its text, so the first real
+        search doesn't pay for reading the index and the text store from disk.
+        """
+        if len(self) > 0:
+            for row, _ in self.top_k(self.__mapped_vectors()[0], 1)[0]:
+                self.__text(row)
+
+    def search(
+        self, search_str: str, n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> Dict[str, str]:
+        """
+        Function that searches the index for the chunks closest to a string.
+
+        Parameters:
+        - search_str: str, the string to search for
+        - n_results: int, the number of results to return
+
+        Returns:
+        - dict, "<chunk id>_<title>" mapped to the chunk's text, best match first
+        """
+        if not search_str or not isinstance(search_str, str):
+            raise ValueError("Search string must be a non-empty string.")
+
+        return {
+            self.__key(row): self.__text(row)
+            for row, _ in self.top_k(self.embed_query(search_str), n_results)[0]
+        }
+
+    def search_many(
+        self, search_strs: List[str], n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> List[Dict[str, Tuple[str, float]]]:
+        """
+        Function that searches the index for many strings with one batched embedding.
+
+        Parameters:
+        - search_strs: list[str], the strings to search for
+        - n_results: int, the number of results to return per string
+
+        Returns:
+        - list with, for every string, "<chunk id>_<title>" mapped to (text, cosine distance), best match first
+        """
+        if not search_strs or not all(s and isinstance(s, str) for s in search_strs):
+            raise ValueError("Search strings must be non-empty strings.")
+
+        return [
+            {self.__key(row): (self.__text(row), 1.0 - score) for row, score in rows}
+            for rows in self.top_k(self.embed_queries(search_strs), n_results)
+        ]
+
+    def save(self) -> None:
+        """
+        Function that saves the index.
+        The texts are flushed and the index written before the metadata pointing at them is replaced.
+        """
+        self.text_store.flush()
+        self.index.save(self.path)
+        tmp_meta = self.path.with_name(self.path.name + ".meta.tmp.npz")
+        np.savez(
+            tmp_meta,
+            version=self.__version,
+            dimensions=self.__dimensions,
+            ids=self.ids,
+            title_table=np.array(self.title_table, dtype=str),
+            title_rows=self.title_rows,
+            spans=self.spans,
+        )
+        os.replace(tmp_meta, self.__meta_path)
+
+    def __load(self) -> None:
+        """
+        Helper function that loads a saved index.
+        """
+        with np.load(self.__meta_path) as meta:
+            self.__version = int(meta["version"])
+            self.__dimensions = int(meta["dimensions"])
+            self.ids = meta["ids"]
+            self.title_table = meta["title_table"].tolist()
+            self.title_rows = meta["title_rows"]
+            self.spans = meta["spans"].reshape(-1, 2)
+        self.__title_numbers = {
+            title: number for number, title in enumerate(self.title_table)
+        }
+        self.index = IVFPQIndex.load(self.path)
+        expected_size = len(self.ids) * self.__dimensions * 4
+        if (
+            len(self.index) != len(self.ids)
+            or not self.__vectors_path.exists()
+            or os.path.getsize(self.__vectors_path) < expected_size
+        ):
+            raise ValueError(
+                f"IVF-PQ index '{self.path}' is corrupt, delete it to rebuild it."
+            )
+        # Drop rows a crashed run appended after the last save
+        os.truncate(self.__vectors_path, expected_size)
@@ -0,0 +1,276 @@
+"""
+Class that keeps track of what has already been ingested so the pipeline only redoes the work for files that changed.
+
+The manifest is a JSON file that records:
+- for every source file in the data folder: the hash of its content and the section titles cleaning produced from it
+- for every section title: the vector shard it was saved in, its number of chunks and whether it has been loaded into the vector DB
+- the section titles whose vectors still have to be dropped from the vector DB
+- the section titles of deleted sources, whose copies left in shards must never be loaded again
+"""
+
+# Standard imports
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+# Internal imports
+from const import PATH_TO_MANIFEST
+
+
+class IngestionManifest:
+    """
+    Class that records the state of the ingestion pipeline between runs.
+
+    Attributes:
+    - path: Path, path to the manifest file
+    - files: dict, source file mapped to {"hash": content hash, "titles": section titles}
+    - titles: dict, section title mapped to {"shard": shard name or None, "indexed": bool, "chunks": int}
+    - shards: set, names of the vector shards written while the manifest was in use
+    - removed_titles: set, titles whose vectors must be dropped from the vector DB
+    - deleted_titles: set, titles no source file produces anymore, kept across runs
+
+    Methods:
+    - changed_files: source files that are new or were modified since they were recorded
+    - deleted_files: recorded source files that no longer exist
+    - record_file: records the titles produced by cleaning a source file
+    - remove_file: forgets a deleted source file
+    - record_shard: records the shard a group of titles was saved in
+    - is_stale: whether the copy of a title stored in a shard must not be loaded
+    - indexed_chunks: number of chunks the vector DB should hold
+    - mark_indexed: records that titles were loaded into the vector DB
+    - save: writes the manifest to disk
+    """
+
+    def __init__(self, path: Path = Path(PATH_TO_MANIFEST)) -> None:
+        if not isinstance(path, Path):
+            raise ValueError("Manifest path must be a Path object.")
+        self.path = path
+        self.files = {}
+        self.titles = {}
+        self.shards = set()
+        self.removed_titles = set()
+        self.deleted_titles = set()
+        # Hashes computed during this run so every file is only read once
+        self.__hashes = {}
+
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.files = manifest.get("files", {})
+            self.titles = manifest.get("titles", {})
+            self.shards = set(manifest.get("shards", []))
+            self.removed_titles = set(manifest.get("removed_titles", []))
+            self.deleted_titles = set(manifest.get("deleted_titles", []))
+
+    def hash_file(self, file: str) -> str:
+        """
+        Function that hashes the content of a file.
+
+        Parameters:
+        - file: str, path to the file
+
+        Returns:
+        - str, hex digest of the file content
+        """
+        if file not in self.__hashes:
+            digest = hashlib.sha256()
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            self.__hashes[file] = digest.hexdigest()
+        return self.__hashes[file]
+
+    def changed_files(self, files: List[str]) -> List[str]:
+        """
+        Function that finds the source files that are new or whose content changed.
+
+        Parameters:
+        - files: list[str], paths of the source files currently in the data folder
+
+        Returns:
+        - list[str], the files that need to be cleaned again, in the order given
+        """
+        return [
+            file
+            for file in files
+            if file not in self.files
+            or self.files[file]["hash"] != self.hash_file(file)
+        ]
+
+    def deleted_files(self, files: List[str]) -> List[str]:
+        """
+        Function that finds the recorded source files that are no longer in the data folder.
+
+        Parameters:
+        - files: list[str], paths of the source files currently in the data folder
+
+        Returns:
+        - list[str], the recorded files that no longer exist
+        """
+        current = set(files)
+        return [file for file in self.files if file not in current]
+
+    def record_file(self, file: str, titles: List[str]) -> List[str]:
+        """
+        Function that records the section titles produced by cleaning a source file.
+        Every title is marked as needing to be vectorized again.
+
+        Parameters:
+        - file: str, path to the source file
+        - titles: list[str], section titles produced by cleaning the file
+
+        Returns:
+        - list[str], titles the previous version of the file produced that are gone now
+        """
+        old_titles = self.files.get(file, {}).get("titles", [])
+        self.files[file] = {"hash": self.hash_file(file), "titles": list(titles)}
+
+        for title in titles:
+            self.titles[title] = {"shard": None, "indexed": False}
+            self.removed_titles.discard(title)
+            self.deleted_titles.discard(title)
+
+        return self.__drop_titles(set(old_titles) - set(titles))
+
+    def remove_file(self, file: str) -> List[str]:
+        """
+        Function that forgets a source file that was deleted from the data folder.
+
+        Parameters:
+        - file: str, path to the source file
+
+        Returns:
+        - list[str], the section titles that are no longer produced by any source file
+        """
+        titles = self.files.pop(file, {}).get("titles", [])
+        return self.__drop_titles(set(titles))
+
+    def __drop_titles(self, titles: Set[str]) -> List[str]:
+        """
+        Helper function that forgets titles no source file produces anymore, marks
+        their vectors for removal from the vector DB and remembers them as deleted.
+        """
+        still_produced = {
+            title for entry in self.files.values() for title in entry["titles"]
+        }
+        dropped = sorted(titles - still_produced)
+        for title in dropped:
+            self.titles.pop(title, None)
+            self.removed_titles.add(title)
+            self.deleted_titles.add(title)
+        return dropped
+
+    def pending_vectorize(self) -> Set[str]:
+        """
+        Returns the titles that were cleaned but not vectorized yet.
+        """
+        return {title for title, entry in self.titles.items() if entry["shard"] is None}
+
+    def pending_index(self) -> Set[str]:
+        """
+        Returns the titles that were vectorized but not loaded into the vector DB yet.
+        """
+        return {
+            title
+            for title, entry in self.titles.items()
+            if entry["shard"] is not None and not entry["indexed"]
+        }
+
+    def record_shard(
+        self, titles: List[str], shard: str, chunks: Optional[Dict[str, int]] = None
+    ) -> None:
+        """
+        Function that records the vector shard a group of titles was saved in.
+
+        Parameters:
+        - titles: list[str], section titles saved in the shard
+        - shard: str, name of the shard without extension (e.g. vectorized_data_3)
+        - chunks: dict, title mapped to its number of chunks (default: not recorded)
+        """
+        for title in titles:
+            self.titles[title] = {"shard": shard, "indexed": False}
+            if chunks is not None:
+                self.titles[title]["chunks"] = chunks[title]
+            self.deleted_titles.discard(title)
+        self.shards.add(shard)
+
+    def is_stale(self, title: str, shard: str) -> bool:
+        """
+        Returns whether the copy of a title stored in a shard must not be loaded.
+        Older copies are left behind in earlier shards when a file is modified or deleted.
+        A shard written by the manifest only holds live copies of the titles recorded in it,
+        in shards built before the manifest existed only deleted and superseded titles are stale.
+        """
+        entry = self.titles.get(title)
+        if entry is not None:
+            return entry["shard"] != shard
+        return shard in self.shards or title in self.deleted_titles
+
+    def stale_shards(self) -> Set[str]:
+        """
+        Returns the shards written by the manifest that no longer hold the current
+        version of any title and can be deleted.
+        """
+        live = {entry["shard"] for entry in self.titles.values()}
+        return self.shards - live
+
+    def forget_shard(self, shard: str) -> None:
+        """
+        Function that records that a stale shard was deleted.
+
+        Parameters:
+        - shard: str, name of the shard without extension
+        """
+        self.shards.discard(shard)
+
+    def indexed_chunks(self) -> Optional[int]:
+        """
+        Returns the number of chunks the vector DB should hold, or None if the manifest
+        doesn't know it (titles recorded before chunks were counted).
+        """
+        total = 0
+        for entry in self.titles.values():
+            if entry["indexed"]:
+                if "chunks" not in entry:
+                    return None
+                total += entry["chunks"]
+        return total
+
+    def mark_indexed(self, titles: List[str]) -> None:
+        """
+        Function that records that titles were loaded into the vector DB.
+
+        Parameters:
+        - titles: list[str], section titles loaded into the vector DB
+        """
+        for title in titles:
+            if title in self.titles:
+                self.titles[title]["indexed"] = True
+
+    def clear_removed(self) -> None:
+        """
+        Function that records that the vectors of the removed titles were dropped from the vector DB.
+        """
+        self.removed_titles = set()
+
+    def save(self) -> None:
+        """
+        Function that writes the manifest to disk.
+        Writes to a temporary file first so an interrupted run never leaves a corrupt manifest.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "files": self.files,
+                    "titles": self.titles,
+                    "shards": sorted(self.shards),
+                    "removed_titles": sorted(self.removed_titles),
+                    "deleted_titles": sorted(self.deleted_titles),
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,240 @@
+"""
+File that contains a client for Ollama's local HTTP API.
+
+One client is shared by every question asked in a process, so:
+- the HTTP connections are pooled and kept alive instead of opening a new one per prompt
+- whether the model is available is only checked once instead of before every prompt
+- Ollama is asked to keep the model loaded between prompts so it is not reloaded after idling
+- at most max_concurrency generations run at once, the rest wait their turn
+- a streamed answer closes its HTTP response as soon as the caller stops reading it
+- preload loads the model (and can evaluate the system message) before the first question
+- chat sends the static instructions as a system message ahead of the question, so Ollama can
+  reuse the cached prefix of the prompt instead of evaluating it again every time
+- a stream that fails, before or after its first tokens, raises LLMError so a partial answer is
+  never taken for a whole one (e.g. cached)
+"""
+
+# Standard imports
+import json
+import shutil
+import threading
+import subprocess
+from typing import Callable, Iterator, List, Optional, Union
+
+# Internal imports
+from config import (
+    LLM_MODEL,
+    OLLAMA_HOST,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_READ_TIMEOUT,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_MAX_CONCURRENCY,
+)
+
+
+class LLMError(Exception):
+    """
+    Error raised when Ollama can't be reached or a streamed answer breaks off.
+    """
+
+
+class OllamaClient:
+    """
+    Class for sending prompts to Ollama and streaming back the answers.
+
+    Attributes:
+    - host: str, base URL of the Ollama server
+    - model: str, model used when a call doesn't name one
+    - timeout: tuple, (connect, read) timeouts in seconds, the read timeout applies between streamed tokens
+    - keep_alive: str or int, how long Ollama keeps the model loaded after a request (e.g. "30m", -1 for forever)
+    - session: requests.Session, pooled HTTP connections to the server
+    - on_prompt_eval: function called with every prompt and its number of tokens, as counted by Ollama
+    """
+
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        model: str = LLM_MODEL,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        keep_alive: Union[str, int] = OLLAMA_KEEP_ALIVE,
+        max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+        on_prompt_eval: Optional[Callable[[str, int], None]] = None,
+    ) -> None:
+        # Imported here so importing this module stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+        self.host = host.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.on_prompt_eval = on_prompt_eval
+
+        self.session = requests.Session()
+        # One pooled connection per generation that can run at once
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.__slots = threading.BoundedSemaphore(max_concurrency)
+        self.__available_models = set()
+        self.__models_lock = threading.Lock()
+
+    def ensure_model(self, model: Optional[str] = None) -> None:
+        """
+        Function that makes sure a model is available, pulling it with the ollama CLI if needed.
+        Only the first call per model talks to the server.
+
+        Parameters:
+        - model: str, name of the model (defaults to the client's model)
+        """
+        import requests
+
+        model = model or self.model
+        if model in self.__available_models:
+            return
+
+        with self.__models_lock:
+            if model in self.__available_models:
+                return
+            try:
+                tags = self.session.get(
+                    f"{self.host}/api/tags", timeout=self.timeout
+                ).json()
+                if model not in [m["name"] for m in tags.get("models", [])]:
+                    if shutil.which("ollama") is None:
+                        raise EnvironmentError(
+                            f"Model '{model}' is not available and the ollama CLI is not installed to pull it."
+                        )
+                    print(
+                        f"Model '{model}' not found locally. Pulling with ollama CLI..."
+                    )
+                    subprocess.run(["ollama", "pull", model], check=True)
+            except (requests.exceptions.RequestException, OSError, ValueError) as e:
+                raise RuntimeError(
+                    f"Error downloading model '{model}': {e}\n\nPlease ensure Ollama is running and the model name is correct."
+                )
+            self.__available_models.add(model)
+
+    def preload(
+        self, model: Optional[str] = None, messages: Optional[List[dict]] = None
+    ) -> None:
+        """
+        Function that makes Ollama load a model, and keep it loaded for keep_alive, without answering anything.
+
+        Parameters:
+        - model: str, name of the model (defaults to the client's model)
+        - messages: list of chat messages to evaluate as well (e.g. the system message), so their
+          tokens are in Ollama's prompt cache for the first question
+        """
+        model = model or self.model
+        self.ensure_model(model)
+        if messages:
+            # One token is generated, the point is evaluating the messages
+            endpoint = "/api/chat"
+            payload = {"messages": messages, "options": {"num_predict": 1}}
+        else:
+            # An empty prompt only loads the model
+            endpoint = "/api/generate"
+            payload = {"prompt": ""}
+        response = self.session.post(
+            f"{self.host}{endpoint}",
+            json={
+                "model": model,
+                "stream": False,
+                "keep_alive": self.keep_alive,
+                **payload,
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+    def generate(self, prompt: str, model: Optional[str] = None) -> Iterator[str]:
+        """
+        Generator that streams the answer to a prompt from /api/generate.
+
+        Closing the generator (or stopping iteration and letting it be collected) closes the
+        HTTP response, so Ollama stops generating for a client that went away.
+
+        Parameters:
+        - prompt: str, the prompt
+        - model: str, name of the model (defaults to the client's model)
+
+        Yields:
+        - str, the tokens of the answer
+
+        Raises:
+        - LLMError, if Ollama can't be reached or the stream breaks off
+        """
+        yield from self.__stream(
+            "/api/generate",
+            {"model": model or self.model, "prompt": prompt},
+            lambda data: data.get("response", ""),
+        )
+
+    def chat(self, messages: List[dict], model: Optional[str] = None) -> Iterator[str]:
+        """
+        Generator that streams the answer to a conversation from /api/chat, like generate.
+
+        Parameters:
+        - messages: list of {"role": "system", "user" or "assistant", "content": str}
+        - model: str, name of the model (defaults to the client's model)
+
+        Yields:
+        - str, the tokens of the answer
+
+        Raises:
+        - LLMError, if Ollama can't be reached or the stream breaks off
+        """
+        yield from self.__stream(
+            "/api/chat",
+            {"model": model or self.model, "messages": messages},
+            lambda data: data.get("message", {}).get("content", ""),
+        )
+
+    def __stream(self, endpoint: str, payload: dict, extract) -> Iterator[str]:
+        """
+        Helper generator that posts a streaming request and yields what extract pulls out of each line.
+        """
+        import requests
+
+        self.ensure_model(payload["model"])
+        payload = {**payload, "stream": True, "keep_alive": self.keep_alive}
+
+        with self.__slots:
+            try:
+                with self.session.post(
+                    f"{self.host}{endpoint}",
+                    json=payload,
+                    stream=True,
+                    timeout=self.timeout,
+                ) as response:
+                    response.raise_for_status()
+                    # Read to the end of the stream so the connection goes back to the pool
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        # The last line of the stream has the timings and token counts
+                        if (
+                            data.get("done")
+                            and "prompt_eval_count" in data
+                            and self.on_prompt_eval is not None
+                        ):
+                            prompt = payload.get("prompt") or "\n\n".join(
+                                m["content"] for m in payload.get("messages", [])
+                            )
+                            self.on_prompt_eval(prompt, data["prompt_eval_count"])
+                        yield extract(data)
+            except requests.exceptions.RequestException as e:
+                print(f"Error contacting Ollama at {self.host}: {e}")
+                raise LLMError("Could not get a response") from e
+
+    def close(self) -> None:
+        """
+        Function that closes the pooled connections.
+        """
+        self.session.close()
@@ -0,0 +1,299 @@
+"""
+File that contains an ONNX Runtime backend for the embedding model (EMBEDDING_BACKEND = "onnx").
+
+The first time it is used, the sentence-transformers model is exported to ONNX (optionally with its
+weights quantized to int8) and saved in PATH_TO_ONNX_MODELS, along with what the model does after
+the transformer (pooling, normalizing), its maximum sequence length and its tokenizer. The export
+is checked against the PyTorch model on a few sample sentences and refused if any embedding drifts
+further than ONNX_DRIFT_TOLERANCE in cosine similarity, since the stored vectors and the queries
+must stay comparable across backends.
+
+Once exported, embedding only needs onnxruntime and the tokenizers library: neither torch nor
+transformers is imported at all, which also makes the first query of a process much faster.
+"""
+
+# Standard imports
+import os
+import re
+import json
+from pathlib import Path
+from typing import List, Union
+
+# Internal imports
+from const import PATH_TO_ONNX_MODELS
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    ONNX_QUANTIZE,
+    ONNX_THREADS,
+    ONNX_DRIFT_TOLERANCE,
+)
+
+# External imports
+import numpy as np
+
+# Sentences the export is checked on, short and long so padding and truncation are covered
+DRIFT_CHECK_SENTENCES = [
+    "What causes atrial fibrillation?",
+    "Heart failure",
+    "Rheumatoid arthritis is a chronic inflammatory disorder that affects the joints. It occurs "
+    "when the immune system mistakenly attacks the synovium, the lining of the membranes that "
+    "surround the joints, which leads to inflammation, pain and swelling.",
+    "First-line treatment of uncomplicated hypertension includes thiazide diuretics, ACE "
+    "inhibitors, angiotensin receptor blockers and calcium channel blockers. " * 12,
+]
+
+
+class OnnxEmbeddingModel:
+    """
+    Class that embeds text with an ONNX export of a sentence-transformers model.
+
+    Its encode method takes the arguments the pipeline passes to SentenceTransformer.encode, so
+    it can be used in its place.
+
+    Attributes:
+    - model_name: str, name of the sentence-transformers model
+    - path: Path, path of the exported .onnx file
+    - tokenizer: tokenizers.Tokenizer, the model's tokenizer, padding and truncating its input
+    - max_seq_length: int, tokens read by the model, longer texts are truncated
+    - pooling: str, "mean" or "cls"
+    - normalize: bool, whether embeddings are scaled to unit length
+    - session: onnxruntime.InferenceSession, the exported model
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL,
+        quantize: bool = ONNX_QUANTIZE,
+        threads: int = ONNX_THREADS,
+        folder: Path = Path(PATH_TO_ONNX_MODELS),
+    ) -> None:
+        # Imported here so importing this module stays cheap
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.path = folder / f"{name}{'.int8' if quantize else ''}.onnx"
+        config_path = self.path.with_suffix(".json")
+        tokenizer_path = self.path.with_suffix(".tokenizer.json")
+        # Exports from before the tokenizer was saved with them are redone
+        if not all(p.exists() for p in [self.path, config_path, tokenizer_path]):
+            export(model_name, self.path, quantize)
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.max_seq_length = config["max_seq_length"]
+        self.pooling = config["pooling"]
+        self.normalize = config["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(str(tokenizer_path))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        # Padded to the longest text of each batch
+        self.tokenizer.enable_padding(
+            pad_id=config["pad_token_id"], pad_token=config["pad_token"]
+        )
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        # 0 lets onnxruntime use one thread per physical core
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            str(self.path), options, providers=["CPUExecutionProvider"]
+        )
+        self.__input_names = [i.name for i in self.session.get_inputs()]
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """
+        Function that embeds one or many texts, like SentenceTransformer.encode.
+
+        Parameters:
+        - sentences: str or list[str], text(s) to embed
+        - batch_size: int, number of texts per run of the model
+        - convert_to_numpy: bool, accepted for compatibility, the result is always a numpy array
+        - show_progress_bar: bool, accepted for compatibility, no progress bar is shown
+
+        Returns:
+        - np.array, (dimensions,) for one text or (number of texts, dimensions) for a list
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(
+                sentences[start : start + batch_size]
+            )
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array(
+                    [e.attention_mask for e in encodings], dtype=np.int64
+                ),
+                "token_type_ids": np.array(
+                    [e.type_ids for e in encodings], dtype=np.int64
+                ),
+            }
+            feed = {name: inputs[name] for name in self.__input_names}
+            token_embeddings = self.session.run(None, feed)[0]
+            batches.append(self.__pool(token_embeddings, inputs["attention_mask"]))
+
+        if not batches:
+            embeddings = np.zeros((0, self.dimensions), dtype=np.float32)
+        else:
+            embeddings = np.concatenate(batches)
+        return embeddings[0] if single else embeddings
+
+    @property
+    def dimensions(self) -> int:
+        return self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """
+        Function that returns the size of the embeddings, like SentenceTransformer's.
+        """
+        return self.dimensions
+
+    def __pool(
+        self, token_embeddings: np.ndarray, attention_mask: np.ndarray
+    ) -> np.ndarray:
+        """
+        Helper function that turns the token embeddings of a batch into one embedding per text.
+        """
+        if self.pooling == "cls":
+            embeddings = token_embeddings[:, 0]
+        else:
+            # Mean of the tokens that are not padding
+            mask = attention_mask[..., None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(
+                mask.sum(axis=1), 1e-9
+            )
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        return embeddings.astype(np.float32)
+
+
+def export(model_name: str, path: Path, quantize: bool) -> None:
+    """
+    Function that exports a sentence-transformers model to ONNX and checks it against PyTorch.
+    Needs torch, sentence-transformers and onnx, and onnxruntime to quantize and check.
+
+    Parameters:
+    - model_name: str, name of the sentence-transformers model
+    - path: Path, path of the .onnx file to write, its configuration goes next to it as .json
+      and its tokenizer as .tokenizer.json
+    - quantize: bool, whether to quantize the weights to int8 (dynamic quantization)
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    print(f"Exporting {model_name} to {path}...")
+    model = SentenceTransformer(model_name, device="cpu")
+    pooling = next(m for m in model if isinstance(m, Pooling))
+    config = {
+        "max_seq_length": model.max_seq_length,
+        "pooling": "cls" if pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(isinstance(m, Normalize) for m in model),
+        "pad_token": model.tokenizer.pad_token,
+        "pad_token_id": model.tokenizer.pad_token_id,
+    }
+
+    transformer = model[0].auto_model.eval()
+    inputs = model.tokenizer(
+        DRIFT_CHECK_SENTENCES[:2], padding=True, return_tensors="pt"
+    )
+    input_names = [
+        name
+        for name in ["input_ids", "attention_mask", "token_type_ids"]
+        if name in inputs
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written under temporary names, so a failed export or check leaves nothing behind to load
+    tmp_path = path.with_name(path.stem + ".tmp.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(inputs[name] for name in input_names),
+            str(tmp_path),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = path.with_name(path.stem + ".tmp.int8.onnx")
+        quantize_dynamic(
+            str(tmp_path), str(quantized_path), weight_type=QuantType.QInt8
+        )
+        os.replace(quantized_path, tmp_path)
+
+    config_path = path.with_suffix(".json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    # The fast tokenizer sentence-transformers runs, so loading it only needs the tokenizers library
+    tokenizer_path = path.with_suffix(".tokenizer.json")
+    model.tokenizer.backend_tokenizer.save(str(tokenizer_path))
+    os.replace(tmp_path, path)
+    try:
+        drift = check_drift(
+            model, OnnxEmbeddingModel(model_name, quantize, folder=path.parent)
+        )
+    except Exception:
+        path.unlink(missing_ok=True)
+        config_path.unlink(missing_ok=True)
+        tokenizer_path.unlink(missing_ok=True)
+        raise
+    config["min_cosine_similarity"] = drift
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    print(f"Exported {model_name}, lowest cosine similarity to PyTorch: {drift:.5f}")
+
+
+def check_drift(
+    reference,
+    onnx_model: OnnxEmbeddingModel,
+    sentences: List[str] = DRIFT_CHECK_SENTENCES,
+    tolerance: float = ONNX_DRIFT_TOLERANCE,
+) -> float:
+    """
+    Function that compares the embeddings of the ONNX model with those of the PyTorch model.
+
+    Parameters:
+    - reference: SentenceTransformer, the PyTorch model
+    - onnx_model: OnnxEmbeddingModel, the exported model
+    - sentences: list[str], texts to compare the embeddings of
+    - tolerance: float, lowest cosine similarity accepted between the two embeddings of a text
+
+    Returns:
+    - float, the lowest cosine similarity between the two embeddings of a text
+
+    Raises:
+    - ValueError, if an embedding drifted further than the tolerance
+    """
+    expected = reference.encode(sentences, convert_to_numpy=True)
+    actual = onnx_model.encode(sentences)
+    similarity = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    )
+    lowest = float(similarity.min())
+    if lowest < tolerance:
+        raise ValueError(
+            f"ONNX embeddings of {onnx_model.model_name} drifted to a cosine similarity of "
+            f"{lowest:.5f} (tolerance {tolerance}). Try ONNX_QUANTIZE = False."
+        )
+    return lowest
@@ -5,6 +5,7 @@ This should:
 - Load the data
 - Clean the data
 - Extract the text from the data and vectorize
+- Warm up the embedding model, the vector DB and the LLM alongside the steps above
 - Set up a local vector DB if it doesn't already exist (else connect to it)
 - Load the vectorized data into the vector DB (if it doesn't already exist)
 - Run the LLM on the data
@@ -12,18 +13,40 @@ This should:
 """
 
 # Standard imports
+import os
 import json
 import argparse
 import shutil
-import requests
-import subprocess
 from pathlib import Path
+from typing import Optional, Union
 
 # Internal imports
-from const import PATH_TO_DATA, SYSTEM_PROMPT_TEMPLATE
-from config import LLM_MODEL
+from const import (
+    PATH_TO_DATA,
+    PATH_TO_ANSWER_CACHE,
+    SYSTEM_PROMPT_TEMPLATE,
+    SYSTEM_PROMPT,
+    USER_PROMPT_TEMPLATE,
+    SOURCE_TEMPLATE,
+)
+from config import (
+    LLM_MODEL,
+    OLLAMA_HOST,
+    CLEANING_WORKERS,
+    EMBEDDING_WORKERS,
+    SERVE_HOST,
+    SERVE_PORT,
+    CONTEXT_TOKEN_BUDGET,
+    OLLAMA_CHAT,
+    WARMUP,
+)
 from data_handler import DataHandler
-from chroma import ChromaDB
+from manifest import IngestionManifest
+from cache import AnswerCache
+from vector_store import VectorStore, get_vector_store
+from ollama_client import LLMError, OllamaClient
+from context_packing import pack_context, get_token_counter
+from warmup import Warmup, warm_up_embedding_model
 
 # Create an argument parser
 parser = argparse.ArgumentParser(
@@ -41,148 +64,286 @@ parser.add_argument(
     default=True,
     help="Whether to vectorize data (default: True)",
 )
-args = parser.parse_args()
-
-# See if None
-if args is None:
-    clean_data = True
-    vectorize_data = True
-
-# Use the argument
-if args.clean_data:
-    clean_data = True
-else:
-    clean_data = False
-
-if args.vectorize_data:
-    vectorize_data = True
-else:
-    vectorize_data = False
+parser.add_argument(
+    "--clean_workers",
+    type=int,
+    default=CLEANING_WORKERS,
+    help=f"Number of processes used to clean the data (default: {CLEANING_WORKERS})",
+)
+parser.add_argument(
+    "--embed_workers",
+    type=int,
+    default=EMBEDDING_WORKERS,
+    help=f"Number of processes used to embed the data, each pinned to its own cores (default: {EMBEDDING_WORKERS})",
+)
+parser.add_argument(
+    "--incremental",
+    type=lambda x: x.lower() == "true",
+    default=False,
+    help="Only clean, vectorize and load files that are new or changed since the last incremental run (default: False)",
+)
+parser.add_argument(
+    "--serve",
+    type=lambda x: x.lower() == "true",
+    default=False,
+    help="Serve search and answers over HTTP instead of asking questions in the terminal (default: False)",
+)
+parser.add_argument(
+    "--host",
+    type=str,
+    default=SERVE_HOST,
+    help=f"Interface to serve on (default: {SERVE_HOST})",
+)
+parser.add_argument(
+    "--port",
+    type=int,
+    default=SERVE_PORT,
+    help=f"Port to serve on (default: {SERVE_PORT})",
+)
+parser.add_argument(
+    "--warm_up",
+    type=lambda x: x.lower() == "true",
+    default=WARMUP,
+    help=f"Load the embedding model, the vector DB's index and the LLM at startup, alongside each other (default: {WARMUP})",
+)
 
 
-def run_LLM(clean_data: bool = True, vectorize_data: bool = True):
+def run_LLM(
+    clean_data: bool = True,
+    vectorize_data: bool = True,
+    clean_workers: int = CLEANING_WORKERS,
+    embed_workers: int = EMBEDDING_WORKERS,
+    incremental: bool = False,
+    serve: bool = False,
+    host: str = SERVE_HOST,
+    port: int = SERVE_PORT,
+    warm_up: bool = WARMUP,
+):
     """
-    Function that runs the LLM.
+    Function that runs the LLM, either in the terminal or as an HTTP server.
     """
+    client = __get_ollama_client()
+
+    # Started first so the models load while the data is loaded
+    warmup = None
+    if warm_up:
+        warmup = Warmup()
+        warmup.start("embedding model", warm_up_embedding_model)
+        warmup.start(
+            "Ollama model",
+            client.preload,
+            messages=(
+                [{"role": "system", "content": SYSTEM_PROMPT}] if OLLAMA_CHAT else None
+            ),
+        )
+
     datahandler = __traverse_data_pipeline(
-        Path(PATH_TO_DATA), clean_data=clean_data, vectorize_data=vectorize_data
+        Path(PATH_TO_DATA),
+        clean_data=clean_data,
+        vectorize_data=vectorize_data,
+        clean_workers=clean_workers,
+        embed_workers=embed_workers,
+        incremental=incremental,
     )
 
     # Set up the local vector DB and add data to it
     vector_db = __set_up_local_vector_db(datahandler)
+    if warmup is not None:
+        warmup.start("vector DB", vector_db.warm_up)
+        warmup.wait()
 
     # To verify this works search and print results
     # context = vector_db.search("Teach me about medullary thyroid cancer")
     # print("Context: ", context)
 
     # Get LLM ready and run it
-    __set_up_and_run_LLM(vector_db)
+    if serve:
+        # Imported here since only serve mode needs it
+        from server import run_server
+
+        answer_cache = __get_answer_cache(vector_db)
+        run_server(
+            vector_db,
+            __get_llm(client),
+            __get_prompt_builder(),
+            answer_cache=answer_cache,
+            host=host,
+            port=port,
+        )
+    else:
+        __set_up_and_run_LLM(vector_db, __get_llm(client))
 
 
 def __traverse_data_pipeline(
     data_path: Path = Path(PATH_TO_DATA),
     clean_data: bool = True,
     vectorize_data: bool = True,
+    clean_workers: int = CLEANING_WORKERS,
+    embed_workers: int = EMBEDDING_WORKERS,
+    incremental: bool = False,
 ) -> DataHandler:
     """
     Function that traverses the data pipeline.
 
     Parameters:
     - data_path: str, path to the data
+    - clean_workers: int, number of processes used to clean the data
+    - embed_workers: int, number of processes used to embed the data
+    - incremental: bool, whether to only process files that changed since the last incremental run
 
     Returns:
     - data_handler: DataHandler, the data handler object
     """
     # Load the data
-    data_handler = DataHandler(data_path=data_path)
+    manifest = IngestionManifest() if incremental else None
+    data_handler = DataHandler(data_path=data_path, manifest=manifest)
 
     # If we need to clean the data and save it then let's do that
     if clean_data:
         data_handler.load_data()
-        data_handler.clean_data()
+        data_handler.clean_data(num_workers=clean_workers)
 
     # If we need to vectorize the data then let's do that
     if vectorize_data:
-        data_handler.vectorize_data()
+        data_handler.vectorize_data(num_workers=embed_workers)
     else:
         data_handler.load_vectorized_data()
 
     return data_handler
 
 
-def __set_up_local_vector_db(datahandler: DataHandler) -> ChromaDB:
+def __set_up_local_vector_db(datahandler: DataHandler) -> VectorStore:
     """
     Function that sets up a local vector DB if it doesn't already exist.
+    The backend (Chroma, an in-memory numpy index or an IVF-PQ index) is chosen by VECTOR_STORE_BACKEND in config.py.
     """
     # Set up the local vector DB and add data to it
-    vector_db = ChromaDB()
+    vector_db = get_vector_store()
     vector_db.add_data(datahandler)
 
     return vector_db
 
 
-def __get_llm():
+def __get_ollama_client(host: Optional[str] = None) -> OllamaClient:
     """
-    Returns a function that sends a prompt to Ollama's local API using the specified model.
-    Supports streaming output. Automatically pulls the model if not already downloaded.
+    Returns the OllamaClient shared by every prompt, so every prompt reuses its connections.
+    The number of prompt tokens Ollama reports after every answer calibrates the token estimate
+    used to pack the sources into the prompt.
+
+    The server is at OLLAMA_HOST, unless the OLLAMA_HOST environment variable points elsewhere
+    (e.g. a remote Ollama or a stand-in for it), in which case the ollama CLI isn't needed.
     """
+    host = host or os.environ.get("OLLAMA_HOST")
+    if host is None:
+        # Check if Ollama is installed
+        if shutil.which("ollama") is None:
+            raise EnvironmentError(
+                r'Ollama is not installed. Please install it from https://ollama.com/download. If installed, ensure it\'s in your PATH. You can do this with: $env:Path += ";C:\Users\<YourUsername>\AppData\Local\Programs\Ollama\" and restarting your computer.'
+            )
+        host = OLLAMA_HOST
+    elif "://" not in host:
+        # Ollama's own OLLAMA_HOST is often just host:port
+        host = f"http://{host}"
 
-    # Check if Ollama is installed
-    if shutil.which("ollama") is None:
-        raise EnvironmentError(
-            r'Ollama is not installed. Please install it from https://ollama.com/download. If installed, ensure it\'s in your PATH. You can do this with: $env:Path += ";C:\Users\<YourUsername>\AppData\Local\Programs\Ollama\" and restarting your computer.'
-        )
+    return OllamaClient(host=host, on_prompt_eval=get_token_counter().calibrate)
 
-    def ensure_model(model: str):
-        try:
-            # Check if model exists
-            tags = requests.get("http://localhost:11434/api/tags").json()
-            if model not in [m["name"] for m in tags.get("models", [])]:
-                print(f"Model '{model}' not found locally. Pulling with ollama CLI...")
-                subprocess.run(["ollama", "pull", model], check=True)
-        except Exception as e:
-            raise RuntimeError(
-                f"Error downloading model '{model}': {e}\n\nPlease ensure Ollama is running and the model name is correct."
-            )
 
-    def llm(prompt: str, model=LLM_MODEL, host="http://localhost:11434"):
-        ensure_model(model)
+def __get_llm(client: OllamaClient):
+    """
+    Returns a function that sends a prompt to Ollama's local API using the specified model.
+    Supports streaming output. Automatically pulls the model if not already downloaded.
+    A prompt given as a list of chat messages is sent to /api/chat, a string to /api/generate.
+    """
 
-        try:
-            print("LLM is preparing it's response...")
-            with requests.post(
-                f"{host}/api/generate",
-                json={"model": model, "prompt": prompt, "stream": True},
-                stream=True,
-            ) as response:
-                response.raise_for_status()
-                for line in response.iter_lines(decode_unicode=True):
-                    if line:
-                        data = json.loads(line)
-                        yield data.get("response", "")
-        except requests.exceptions.RequestException as e:
-            print(f"Error contacting Ollama at {host}: {e}")
-            yield "[LLM Error: Could not get a response]"
+    def llm(prompt: Union[str, list[dict]], model=LLM_MODEL):
+        if isinstance(prompt, list):
+            return client.chat(prompt, model=model)
+        return client.generate(prompt, model=model)
 
     return llm
 
 
-def build_system_prompt(prompt: str, sources: list[tuple[str, str]]) -> str:
+def build_system_prompt(
+    prompt: str,
+    sources: list[tuple[str, str]],
+    budget: Optional[int] = CONTEXT_TOKEN_BUDGET,
+) -> str:
+    """
+    Function that builds the prompt for a question from the retrieved sources, most relevant first.
+    Repeated sentences are dropped and the sources are cut at sentence boundaries to fit in
+    budget tokens (see context_packing.py), None for sources that are already packed.
+    """
     formatted_sources = "\n\n".join(
-        f"Source {name} says ...{content}..." for name, content in sources
+        SOURCE_TEMPLATE.format(name=name, content=content)
+        for name, content in pack_context(sources, budget)
     )
     return SYSTEM_PROMPT_TEMPLATE.format(
         prompt=prompt, formatted_sources=formatted_sources
     )
 
 
-def __set_up_and_run_LLM(vector_db):
+def build_chat_messages(
+    prompt: str,
+    sources: list[tuple[str, str]],
+    budget: Optional[int] = CONTEXT_TOKEN_BUDGET,
+) -> list[dict]:
+    """
+    Function that builds the chat messages for a question, packing the sources like build_system_prompt.
+    The system message is the same for every question, so Ollama can reuse it from its prompt cache
+    and only has to evaluate the sources and the question.
+    """
+    formatted_sources = "\n\n".join(
+        SOURCE_TEMPLATE.format(name=name, content=content)
+        for name, content in pack_context(sources, budget)
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": USER_PROMPT_TEMPLATE.format(
+                prompt=prompt, formatted_sources=formatted_sources
+            ),
+        },
+    ]
+
+
+def __get_prompt_builder():
+    """
+    Returns the function that builds the prompt for a question, chat messages if OLLAMA_CHAT is set.
+    """
+    return build_chat_messages if OLLAMA_CHAT else build_system_prompt
+
+
+def __get_answer_cache(vector_db: VectorStore) -> AnswerCache:
+    """
+    Returns the answer cache, emptied if the vector DB's contents changed.
+    Answers are keyed on everything that shapes the prompt: the templates of the prompt layout,
+    the layout itself and the token budget the sources are packed into.
+    """
+    if OLLAMA_CHAT:
+        templates = [SYSTEM_PROMPT, USER_PROMPT_TEMPLATE]
+    else:
+        templates = [SYSTEM_PROMPT_TEMPLATE]
+    prompt_setup = json.dumps(
+        [*templates, SOURCE_TEMPLATE, OLLAMA_CHAT, CONTEXT_TOKEN_BUDGET]
+    )
+    answer_cache = AnswerCache(
+        persist_path=Path(PATH_TO_ANSWER_CACHE), template=prompt_setup
+    )
+    # Answers are only reused while the vector DB holds the same data
+    answer_cache.validate(vector_db.data_version)
+    return answer_cache
+
+
+def __set_up_and_run_LLM(vector_db, llm):
     """
     Function that sets up the LLM and queries a vector DB for context.
     """
-    llm = __get_llm()
+    build_prompt = __get_prompt_builder()
     response = None
 
+    answer_cache = __get_answer_cache(vector_db)
+
     while True:
         query = input("Enter your question (or type 'q' to quit): ").strip()
         if query.lower() == "q":
@@ -207,25 +368,70 @@ def __set_up_and_run_LLM(vector_db):
             print("Invalid context format from vector DB. Expected list of dicts.")
             continue
 
-        # Build the prompt
-        prompt = build_system_prompt(query, sources)
+        # Reuse the answer to the same (or a nearly identical) question if we have one
+        chunk_ids = [title.split("_", 1)[0] for title in context_results.keys()]
+        query_embedding = vector_db.embed_query(query)
+        cached = answer_cache.lookup(query, chunk_ids, query_embedding)
+        if cached is not None:
+            print("Answer from cache:")
+            print(cached["answer"], end="", flush=True)
+            references = cached["references"]
+        else:
+            # Build the prompt, only the sources packed into it are cited
+            packed = pack_context(sources, CONTEXT_TOKEN_BUDGET)
+            references = list(dict.fromkeys(name for name, _ in packed))
+            prompt = build_prompt(query, packed, budget=None)
 
-        print(f"Prompt: {prompt}")
+            if isinstance(prompt, str):
+                print(f"Prompt: {prompt}")
+            else:
+                print(f"Prompt: {prompt[-1]['content']}")
 
-        # Get the LLM response (streaming)
-        for chunk in llm(prompt):
-            print(chunk, end="", flush=True)
+            # Get the LLM response (streaming)
+            print("LLM is preparing it's response...")
+            answer = []
+            try:
+                for chunk in llm(prompt):
+                    print(chunk, end="", flush=True)
+                    answer.append(chunk)
+            except LLMError as e:
+                # A partial answer isn't cached
+                print(f"\n[LLM Error: {e}]")
+            else:
+                answer = "".join(answer)
+                answer_cache.put(query, chunk_ids, query_embedding, answer, references)
 
         # Print sources that we pulled from the vector DB
         print("\n\nReferences pulled:")
-        reference_list = [title.split("_", 1)[1] for title in context_results.keys()]
-        references = list(set(reference_list))
         for ref in references:
             print(f"- {ref}")
 
         print("\n")  # new line after streaming completes
 
+    # Keep the query embeddings (if persistence is turned on) and answers for next time
+    vector_db.query_cache.save()
+    answer_cache.save()
+    for name, cache in [
+        ("Query embedding", vector_db.query_cache),
+        ("Answer", answer_cache),
+    ]:
+        stats = cache.stats()
+        print(f"{name} cache: {stats['hits']} hits, {stats['misses']} misses")
+
     return response
 
 
-run_LLM(clean_data=clean_data, vectorize_data=vectorize_data)
+# Guarded so importing this module (e.g. from cleaning worker processes) doesn't run the pipeline
+if __name__ == "__main__":
+    args = parser.parse_args()
+    run_LLM(
+        clean_data=args.clean_data,
+        vectorize_data=args.vectorize_data,
+        clean_workers=args.clean_workers,
+        embed_workers=args.embed_workers,
+        incremental=args.incremental,
+        serve=args.serve,
+        host=args.host,
+        port=args.port,
+        warm_up=args.warm_up,
+    )
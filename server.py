@@ -0,0 +1,394 @@
+"""
+File that contains an asyncio HTTP server for the RAG pipeline, so one process can serve many users.
+
+It shares one warm vector DB and embedding model between all sessions and exposes:
+- GET /health: {"status": "ok"}
+- POST /search {"query": str, "n_results": int}: the retrieved chunks as JSON
+- POST /answer {"query": str, "n_results": int}: the LLM's answer streamed as server-sent events,
+  a "sources" event with the references, one "token" event per streamed token and a final "done" event
+  (or an "error" event if the LLM fails part way)
+
+Retrieval (embedding the query and querying the vector DB) and the blocking LLM stream run in thread
+pools so the event loop is free to serve other sessions. The LLM is any function that takes a prompt
+and yields tokens, so the server can be run against a stand-in for Ollama's /api/generate and
+/api/chat endpoints (see test_server.py).
+"""
+
+# Standard imports
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple, Union
+
+# Internal imports
+from cache import AnswerCache
+from config import (
+    DEFAULT_RESULTS_PER_SEARCH,
+    SERVE_HOST,
+    SERVE_PORT,
+    SERVE_RETRIEVAL_WORKERS,
+    SERVE_MAX_STREAMS,
+    SERVE_MAX_RESULTS,
+)
+
+MAX_BODY_SIZE = 1 << 20  # Largest request body accepted, questions are short
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    """
+    Error that is sent back to the client with an HTTP status code.
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RAGServer:
+    """
+    Class for serving search and answers over HTTP.
+
+    Attributes:
+    - vector_db: the vector DB to search, anything with ChromaDB's search and embed_query methods
+    - llm: function that takes a prompt (a string or chat messages) and yields the tokens of the answer
+    - build_prompt: function that builds the prompt from the question and a list of (source name, text)
+    - answer_cache: AnswerCache, cache of previous answers (None answers every question with the LLM)
+    """
+
+    def __init__(
+        self,
+        vector_db,
+        llm: Callable[[Union[str, List[dict]]], Iterator[str]],
+        build_prompt: Callable[[str, List[Tuple[str, str]]], Union[str, List[dict]]],
+        answer_cache: Optional[AnswerCache] = None,
+        retrieval_workers: int = SERVE_RETRIEVAL_WORKERS,
+        max_streams: int = SERVE_MAX_STREAMS,
+    ) -> None:
+        self.vector_db = vector_db
+        self.llm = llm
+        self.build_prompt = build_prompt
+        self.answer_cache = answer_cache
+        self.retrieval_pool = ThreadPoolExecutor(
+            max_workers=retrieval_workers, thread_name_prefix="retrieval"
+        )
+        # Each streamed answer holds a thread for as long as the LLM is generating
+        self.stream_pool = ThreadPoolExecutor(
+            max_workers=max_streams, thread_name_prefix="llm-stream"
+        )
+
+    async def serve(self, host: str = SERVE_HOST, port: int = SERVE_PORT) -> None:
+        """
+        Function that serves requests until cancelled.
+
+        Parameters:
+        - host: str, interface to listen on
+        - port: int, port to listen on
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        """
+        Function that shuts down the thread pools.
+        """
+        self.retrieval_pool.shutdown(wait=False, cancel_futures=True)
+        self.stream_pool.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Function that handles one HTTP connection (one request per connection).
+        """
+        try:
+            method, path, body = await self.__read_request(reader)
+            if path == "/health":
+                if method != "GET":
+                    raise HTTPError(405, "Use GET.")
+                await self.__send_json(writer, 200, {"status": "ok"})
+            elif path == "/search":
+                if method != "POST":
+                    raise HTTPError(405, "Use POST.")
+                query, n_results = self.__parse_query(body)
+                results = await self.__search(query, n_results)
+                await self.__send_json(
+                    writer,
+                    200,
+                    {
+                        "results": [
+                            {
+                                "id": key.split("_", 1)[0],
+                                "title": key.split("_", 1)[1],
+                                "text": text,
+                            }
+                            for key, text in results.items()
+                        ]
+                    },
+                )
+            elif path == "/answer":
+                if method != "POST":
+                    raise HTTPError(405, "Use POST.")
+                query, n_results = self.__parse_query(body)
+                await self.__stream_answer(reader, writer, query, n_results)
+            else:
+                raise HTTPError(404, f"No endpoint at {path}.")
+        except HTTPError as e:
+            await self.__send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # The client went away, nothing to answer
+        except Exception as e:
+            print(f"Error handling request: {e}")
+            try:
+                await self.__send_json(writer, 500, {"error": "Internal server error."})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def __read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[str, str, bytes]:
+        """
+        Helper function that reads the request line, headers and body of a request.
+        """
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.")
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = headers.get("content-length") or "0"
+        # int() would also take signs, spaces and underscores
+        if not (length.isascii() and length.isdigit()):
+            raise HTTPError(400, "Content-Length must be a non-negative integer.")
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413, "Request body is too large.")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], body
+
+    def __parse_query(self, body: bytes) -> Tuple[str, int]:
+        """
+        Helper function that reads the question and number of results from a JSON body.
+        More than SERVE_MAX_RESULTS results are lowered to it.
+        """
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            raise HTTPError(400, "Body must be JSON.")
+        query = payload.get("query")
+        if not query or not isinstance(query, str):
+            raise HTTPError(400, "query must be a non-empty string.")
+        n_results = payload.get("n_results", DEFAULT_RESULTS_PER_SEARCH)
+        # Not isinstance, bool is a subclass of int and true isn't a number of results
+        if type(n_results) is not int or n_results < 1:
+            raise HTTPError(400, "n_results must be a positive integer.")
+        return query.strip(), min(n_results, SERVE_MAX_RESULTS)
+
+    async def __search(self, query: str, n_results: int) -> dict:
+        """
+        Helper function that runs retrieval in the thread pool.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.retrieval_pool, self.vector_db.search, query, n_results
+        )
+
+    async def __stream_answer(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        query: str,
+        n_results: int,
+    ) -> None:
+        """
+        Helper function that retrieves context for a question and streams the LLM's answer as server-sent events.
+        """
+        results = await self.__search(query, n_results)
+        sources = [(key.split("_", 1)[1], text) for key, text in results.items()]
+        references = sorted({name for name, _ in sources})
+
+        # Reuse a cached answer if there is one, looked up first so the sources match the answer
+        chunk_ids = [key.split("_", 1)[0] for key in results]
+        embedding = None
+        cached = None
+        if self.answer_cache is not None:
+            loop = asyncio.get_running_loop()
+            embedding = await loop.run_in_executor(
+                self.retrieval_pool, self.vector_db.embed_query, query
+            )
+            cached = self.answer_cache.lookup(query, chunk_ids, embedding)
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        if cached is not None:
+            await self.__send_event(
+                writer, "sources", {"references": cached["references"]}
+            )
+            await self.__send_event(writer, "token", {"token": cached["answer"]})
+            await self.__send_event(writer, "done", {"cached": True})
+            return
+        await self.__send_event(writer, "sources", {"references": references})
+
+        prompt = self.build_prompt(query, sources)
+        answer = []
+        try:
+            async for token in self.__iterate_in_thread(self.llm(prompt), reader):
+                answer.append(token)
+                await self.__send_event(writer, "token", {"token": token})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # The response has started, so the failure is sent as an event and the partial answer isn't cached
+            print(f"Error streaming the answer: {e}")
+            await self.__send_event(
+                writer, "error", {"error": "The LLM failed to answer."}
+            )
+            return
+        await self.__send_event(writer, "done", {"cached": False})
+
+        answer = "".join(answer)
+        if self.answer_cache is not None:
+            self.answer_cache.put(query, chunk_ids, embedding, answer, references)
+
+    async def __iterate_in_thread(
+        self, tokens: Iterator[str], reader: asyncio.StreamReader
+    ) -> AsyncIterator[str]:
+        """
+        Helper function that consumes a blocking token generator in the stream pool and yields
+        its tokens on the event loop. The client's connection is watched meanwhile: if it goes
+        away ConnectionResetError is raised right away, and the worker stops pulling tokens and
+        closes the generator so the LLM stream is released. The same happens if the consumer
+        stops early.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        async def watch_connection() -> None:
+            # The request was read in full, so the end of the stream means the client went away
+            try:
+                while await reader.read(1024):
+                    pass
+            except ConnectionError:
+                pass
+            stop.set()
+            queue.put_nowait(ConnectionResetError("The client disconnected."))
+
+        def produce() -> None:
+            try:
+                for token in tokens:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+                    if stop.is_set():
+                        break
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                # Closing the generator releases the LLM's HTTP stream
+                if hasattr(tokens, "close"):
+                    tokens.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(self.stream_pool, produce)
+        watcher = asyncio.ensure_future(watch_connection())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            watcher.cancel()
+            await asyncio.shield(producer)
+
+    async def __send_event(
+        self, writer: asyncio.StreamWriter, event: str, data: dict
+    ) -> None:
+        """
+        Helper function that sends one server-sent event.
+        """
+        writer.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        await writer.drain()
+
+    async def __send_json(
+        self, writer: asyncio.StreamWriter, status: int, payload: dict
+    ) -> None:
+        """
+        Helper function that sends a complete JSON response.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
+
+
+def run_server(
+    vector_db,
+    llm: Callable[[Union[str, List[dict]]], Iterator[str]],
+    build_prompt: Callable[[str, List[Tuple[str, str]]], Union[str, List[dict]]],
+    answer_cache: Optional[AnswerCache] = None,
+    host: str = SERVE_HOST,
+    port: int = SERVE_PORT,
+) -> None:
+    """
+    Function that runs the server until interrupted.
+
+    Parameters:
+    - vector_db: the vector DB to search
+    - llm: function that takes a prompt and yields the tokens of the answer
+    - build_prompt: function that builds the prompt from the question and its sources
+    - answer_cache: AnswerCache, cache of previous answers
+    - host: str, interface to listen on
+    - port: int, port to listen on
+    """
+    server = RAGServer(vector_db, llm, build_prompt, answer_cache=answer_cache)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.close()
+        if answer_cache is not None:
+            answer_cache.save()
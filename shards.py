@@ -0,0 +1,299 @@
+"""
+File that contains functions for reading and writing vector shards, the files the vectorized data is saved in.
+
+Two formats are supported:
+- json: the original format, vectorized_data_N.json maps each title to its embeddings (as lists of floats) and chunk texts
+- npy: vectorized_data_N.npy holds every embedding of the shard as one contiguous float32 matrix that can be memory-mapped,
+  and vectorized_data_N.meta.json holds the titles, the rows each title spans and the chunk texts
+
+The npy format is about 3-4x smaller on disk and does not need to rebuild Python float lists when loading.
+json shards are parsed one title at a time, so loading them only ever holds a single document in memory.
+Existing json shards can be converted with:
+
+    python shards.py --convert
+"""
+
+# Standard imports
+import os
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, TextIO, Tuple
+
+# Internal imports
+from const import PATH_TO_VECTORIZED_DATA
+
+# External imports
+import numpy as np
+
+META_SUFFIX = ".meta.json"
+NUMBER_CHARACTERS = set("0123456789+-.eE")
+
+
+class _JsonObjectStream:
+    """
+    Class that parses a file holding one JSON object incrementally, one top-level entry at a time.
+
+    Values are decoded with json.JSONDecoder.raw_decode on a buffer that only holds the entry being
+    parsed, reading more of the file whenever the entry is not complete yet.
+    """
+
+    def __init__(self, f: TextIO, read_size: int) -> None:
+        self.f = f
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0  # Position of the next unparsed character in the buffer
+
+    def __read_more(self, size: int, required: bool = True) -> bool:
+        """
+        Helper function that drops the parsed part of the buffer and appends more of the file.
+        Returns False at the end of the file if more wasn't required, raises otherwise.
+        """
+        data = self.f.read(size)
+        if not data:
+            if required:
+                raise ValueError("Unexpected end of file while parsing JSON shard.")
+            return False
+        self.buffer = self.buffer[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def __peek(self) -> str:
+        """
+        Helper function that skips whitespace and returns the next character without consuming it.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.__read_more(self.read_size)
+
+    def __value(self) -> Any:
+        """
+        Helper function that decodes the next JSON value, reading until it is complete.
+        """
+        self.__peek()
+        size = self.read_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut off by the end of the buffer decodes as a shorter one ("1.5e" as 1.5),
+                # it is only whole once a character that can't continue it follows
+                cut = isinstance(value, (int, float)) and (
+                    end == len(self.buffer) or self.buffer[end] in NUMBER_CHARACTERS
+                )
+                if not cut or not self.__read_more(size, required=False):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                # Grow the reads so a large value is only re-parsed a few times
+                self.__read_more(size)
+                size *= 2
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Generator that yields the (key, value) entries of the top-level object in file order.
+        """
+        if self.__peek() != "{":
+            raise ValueError("JSON shard must hold an object.")
+        self.pos += 1
+        if self.__peek() == "}":
+            return
+
+        while True:
+            key = self.__value()
+            if self.__peek() != ":":
+                raise ValueError("Expected ':' while parsing JSON shard.")
+            self.pos += 1
+            yield key, self.__value()
+
+            separator = self.__peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError("Expected ',' or '}' while parsing JSON shard.")
+
+
+def iter_json_shard(path: Path, read_size: int = 1 << 20) -> Iterator[Tuple[str, dict]]:
+    """
+    Generator that streams the sections of a json shard without loading the whole file.
+
+    Parameters:
+    - path: Path, path to the json shard
+    - read_size: int, number of characters read from the file at a time
+
+    Yields:
+    - tuples in the format (title, {"embeddings": np.array, "texts": list of chunks})
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for title, v in _JsonObjectStream(f, read_size).items():
+            yield title, {
+                "embeddings": np.asarray(v["embeddings"], dtype=np.float32),
+                "texts": v["texts"],
+            }
+
+
+def list_shards(directory: Path) -> List[Tuple[str, str]]:
+    """
+    Function that lists the vector shards in a folder.
+    If a shard exists in both formats (e.g. after converting without removing) the npy copy is used.
+
+    Parameters:
+    - directory: Path, folder holding the shards
+
+    Returns:
+    - list of tuples in the format (shard name without extension, format)
+    """
+    files = set(os.listdir(directory))
+    shards = {}
+    for file in sorted(files):
+        if file.endswith(META_SUFFIX):
+            continue
+        if file.endswith(".npy") and file[: -len(".npy")] + META_SUFFIX in files:
+            shards[file[: -len(".npy")]] = "npy"
+        elif file.endswith(".json"):
+            shards.setdefault(file[: -len(".json")], "json")
+    return list(shards.items())
+
+
+def save_shard(
+    directory: Path, name: str, vectorized_data: Dict[str, dict], shard_format: str
+) -> None:
+    """
+    Function that saves vectorized data as a shard.
+
+    Parameters:
+    - directory: Path, folder to save the shard in
+    - name: str, name of the shard without extension (e.g. vectorized_data_3)
+    - vectorized_data: dict, titles mapped to {"embeddings": np.array, "texts": list of chunks}
+    - shard_format: str, "npy" or "json"
+    """
+    if shard_format == "json":
+        with open(directory / Path(f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    title: {
+                        "embeddings": np.asarray(v["embeddings"]).tolist(),
+                        "texts": v["texts"],
+                    }
+                    for title, v in vectorized_data.items()
+                },
+                f,
+            )
+    elif shard_format == "npy":
+        titles = list(vectorized_data)
+        matrices = [
+            np.asarray(vectorized_data[title]["embeddings"], dtype=np.float32)
+            for title in titles
+        ]
+        offsets = np.cumsum([0] + [len(m) for m in matrices]).tolist()
+        np.save(directory / Path(f"{name}.npy"), np.concatenate(matrices))
+        with open(directory / Path(name + META_SUFFIX), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "titles": titles,
+                    "offsets": offsets,
+                    "texts": [
+                        t for title in titles for t in vectorized_data[title]["texts"]
+                    ],
+                },
+                f,
+            )
+    else:
+        raise ValueError(f"Unknown shard format {shard_format}.")
+
+
+def load_shard(
+    directory: Path, name: str, shard_format: str
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Generator that yields the sections of a shard.
+
+    Embeddings of npy shards are read-only views into a memory-mapped matrix, so they are only
+    read from disk when used. json shards are streamed one title at a time.
+
+    Parameters:
+    - directory: Path, folder holding the shard
+    - name: str, name of the shard without extension
+    - shard_format: str, "npy" or "json"
+
+    Yields:
+    - tuples in the format (title, {"embeddings": embeddings, "texts": list of chunks})
+    """
+    if shard_format == "json":
+        yield from iter_json_shard(directory / Path(f"{name}.json"))
+    elif shard_format == "npy":
+        with open(directory / Path(name + META_SUFFIX), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        embeddings = np.load(directory / Path(f"{name}.npy"), mmap_mode="r")
+        offsets = meta["offsets"]
+        for i, title in enumerate(meta["titles"]):
+            start, end = offsets[i], offsets[i + 1]
+            yield title, {
+                "embeddings": embeddings[start:end],
+                "texts": meta["texts"][start:end],
+            }
+    else:
+        raise ValueError(f"Unknown shard format {shard_format}.")
+
+
+def remove_shard(directory: Path, name: str) -> None:
+    """
+    Function that deletes every file of a shard, in any format.
+
+    Parameters:
+    - directory: Path, folder holding the shard
+    - name: str, name of the shard without extension
+    """
+    for suffix in [".json", ".npy", META_SUFFIX]:
+        path = directory / Path(name + suffix)
+        if path.exists():
+            os.remove(path)
+
+
+def convert_json_shard(directory: Path, name: str, remove_json: bool = False) -> None:
+    """
+    Function that converts a json shard to the npy format.
+
+    Parameters:
+    - directory: Path, folder holding the shard
+    - name: str, name of the shard without extension
+    - remove_json: bool, whether to delete the json shard once converted
+    """
+    vectorized_data = dict(load_shard(directory, name, "json"))
+    save_shard(directory, name, vectorized_data, "npy")
+    if remove_json:
+        os.remove(directory / Path(f"{name}.json"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage vector shards.")
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help="Convert every json shard to the npy format",
+    )
+    parser.add_argument(
+        "--remove_json",
+        action="store_true",
+        help="Delete json shards once they are converted",
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        default=Path(PATH_TO_VECTORIZED_DATA),
+        help=f"Folder holding the shards (default: {PATH_TO_VECTORIZED_DATA})",
+    )
+    args = parser.parse_args()
+
+    if args.convert:
+        for name, shard_format in list_shards(args.path):
+            if shard_format == "json":
+                print(f"Converting {name}.json...")
+                convert_json_shard(args.path, name, remove_json=args.remove_json)
+    else:
+        for name, shard_format in list_shards(args.path):
+            print(f"{name} ({shard_format})")
@@ -0,0 +1,254 @@
+"""
+File that contains a generator of synthetic medical-like corpora, for benchmarking without the real
+data, the embedding model or network access.
+
+Sentences are built from templates over lists of conditions, drugs, findings and tests, so the
+text chunks and tokenizes roughly like the cleaned sections. Everything is drawn from a seeded
+generator, so the same arguments give the same corpus on every machine.
+
+Namely:
+- synthetic_sentences / synthetic_sections / synthetic_chunks: the text
+- RandomEmbedder: stands in for the embedding model, with the same encode as SentenceTransformer
+- SyntheticDataHandler: stands in for a DataHandler, yielding sections of chunks and their embeddings
+"""
+
+# Standard imports
+import zlib
+from typing import Iterator, List, Tuple, Union
+
+# Internal imports
+from config import EMBEDDING_BATCH_SIZE
+
+# External imports
+import numpy as np
+
+CONDITIONS = [
+    "atrial fibrillation",
+    "congenital adrenal hyperplasia (CAH)",
+    "rheumatoid arthritis",
+    "Barrett's esophagus",
+    "pulmonary tuberculosis",
+    "type 2 diabetes mellitus",
+    "heart failure with reduced ejection fraction",
+    "chronic kidney disease",
+    "systemic lupus erythematosus",
+    "community-acquired pneumonia",
+    "Kawasaki disease",
+    "medullary thyroid cancer",
+    "iron deficiency anemia",
+    "Graves' disease",
+    "acute pancreatitis",
+    "multiple sclerosis",
+]
+DRUGS = [
+    "metformin",
+    "hydrocortisone",
+    "fludrocortisone",
+    "methotrexate",
+    "apixaban",
+    "warfarin",
+    "amiodarone",
+    "isoniazid",
+    "rifampin",
+    "omeprazole",
+    "lisinopril",
+    "furosemide",
+    "intravenous immunoglobulin",
+    "levothyroxine",
+    "DMARDs",
+    "beta blockers",
+]
+FINDINGS = [
+    "an irregularly irregular pulse",
+    "hyponatremia and hyperkalemia",
+    "morning stiffness lasting more than an hour",
+    "chronic cough with night sweats",
+    "elevated 17-hydroxyprogesterone",
+    "intestinal metaplasia on biopsy",
+    "peripheral edema",
+    "a malar rash",
+    "epigastric pain radiating to the back",
+    "conjunctival injection and strawberry tongue",
+    "weight loss and fatigue",
+    "a raised serum calcitonin",
+]
+TESTS = [
+    "an electrocardiogram",
+    "a transesophageal echocardiogram (TEE)",
+    "a cosyntropin stimulation test",
+    "upper endoscopy",
+    "sputum acid-fast bacilli smear",
+    "an HbA1c measurement",
+    "anti-CCP antibodies",
+    "serum lipase",
+    "a complete blood count",
+    "thyroid function tests",
+    "magnetic resonance imaging",
+]
+TEMPLATES = [
+    "{condition} typically presents with {finding}.",
+    "First-line treatment of {condition} is {drug}, adjusted to renal function.",
+    "The diagnosis of {condition} is confirmed with {test}.",
+    "Patients with {condition} who are started on {drug} should be monitored for adverse effects.",
+    "{finding} in a patient with {condition} warrants {test}.",
+    "Complications of untreated {condition} include progression of {finding}.",
+    "In {condition}, {drug} reduces mortality when combined with lifestyle changes.",
+    "Guidelines recommend {test} before starting {drug} in suspected {condition}.",
+    "The pathophysiology of {condition} explains why {finding} is common.",
+    "{drug} is contraindicated in {condition} with {finding}.",
+]
+
+
+def synthetic_sentences(count: int, seed: int = 0) -> List[str]:
+    """
+    Function that makes up medical-like sentences.
+
+    Parameters:
+    - count: int, number of sentences
+    - seed: int, seed of the random generator
+
+    Returns:
+    - list[str], the sentences
+    """
+    rng = np.random.default_rng(seed)
+    picks = {
+        name: rng.integers(0, len(words), count)
+        for name, words in [
+            ("template", TEMPLATES),
+            ("condition", CONDITIONS),
+            ("drug", DRUGS),
+            ("finding", FINDINGS),
+            ("test", TESTS),
+        ]
+    }
+    sentences = []
+    for i in range(count):
+        sentence = TEMPLATES[picks["template"][i]].format(
+            condition=CONDITIONS[picks["condition"][i]],
+            drug=DRUGS[picks["drug"][i]],
+            finding=FINDINGS[picks["finding"][i]],
+            test=TESTS[picks["test"][i]],
+        )
+        sentences.append(sentence[0].upper() + sentence[1:])
+    return sentences
+
+
+def synthetic_sections(
+    count: int, sentences_per_section: int = 120, seed: int = 0
+) -> List[Tuple[str, str]]:
+    """
+    Function that makes up sections like the cleaned ones, from a pool of sentences.
+    A section of 120 sentences makes about ten chunks of CHUNK_MAX_TOKENS tokens.
+
+    Parameters:
+    - count: int, number of sections
+    - sentences_per_section: int, number of sentences in every section
+    - seed: int, seed of the random generator
+
+    Returns:
+    - list of (title, text)
+    """
+    rng = np.random.default_rng(seed)
+    pool = synthetic_sentences(min(50000, count * sentences_per_section), seed)
+    picks = rng.integers(0, len(pool), (count, sentences_per_section))
+    return [
+        (f"Synthetic section {i}", " ".join(pool[j] for j in row))
+        for i, row in enumerate(picks)
+    ]
+
+
+def synthetic_chunks(
+    count: int, sentences_per_chunk: int = 12, seed: int = 0
+) -> List[str]:
+    """
+    Function that makes up chunks of about CHUNK_MAX_TOKENS tokens, from a pool of sentences.
+    Much faster than chunking made-up sections, for corpora of up to millions of chunks.
+
+    Parameters:
+    - count: int, number of chunks
+    - sentences_per_chunk: int, number of sentences in every chunk
+    - seed: int, seed of the random generator
+
+    Returns:
+    - list[str], the chunks
+    """
+    rng = np.random.default_rng(seed)
+    pool = synthetic_sentences(min(50000, count * sentences_per_chunk), seed)
+    picks = rng.integers(0, len(pool), (count, sentences_per_chunk))
+    return [" ".join(pool[j] for j in row) for row in picks]
+
+
+class RandomEmbedder:
+    """
+    Class that stands in for the embedding model: a text's embedding is a random unit vector
+    seeded by the text, so the same text always gets the same embedding. Its speed says
+    nothing about the model's, it only lets the rest of the pipeline run without it.
+
+    Attributes:
+    - dimensions: int, dimensions of every embedding (384 like all-MiniLM-L6-v2)
+    """
+
+    def __init__(self, dimensions: int = 384) -> None:
+        self.dimensions = dimensions
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """
+        Function that embeds one or many texts, like SentenceTransformer.encode.
+
+        Returns:
+        - np.array, (dimensions,) for one text or (number of texts, dimensions) for a list
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = np.empty((len(sentences), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(sentences):
+            rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+            embeddings[i] = rng.standard_normal(self.dimensions, dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings[0] if single else embeddings
+
+
+class SyntheticDataHandler:
+    """
+    Class that stands in for a DataHandler when loading a vector store, yielding sections of
+    chunks with their embeddings.
+
+    Attributes:
+    - embeddings: np.array, (number of chunks, dimensions) embedding of every chunk
+    - texts: list[str], text of every chunk
+    - chunks_per_section: int, number of chunks in every section
+    """
+
+    manifest = None
+
+    def __init__(
+        self, embeddings: np.ndarray, texts: List[str], chunks_per_section: int = 10
+    ) -> None:
+        if len(embeddings) != len(texts):
+            raise ValueError("There must be one embedding per text.")
+        self.embeddings = embeddings
+        self.texts = texts
+        self.chunks_per_section = chunks_per_section
+
+    def load_vectorized_data(
+        self, pending_only: bool = False, num_workers: int = 1
+    ) -> Iterator[Tuple[str, dict]]:
+        """
+        Generator that yields the sections like DataHandler.load_vectorized_data.
+
+        Yields:
+        - tuples in the format (title, {"embeddings": np.array, "texts": list of chunks})
+        """
+        for start in range(0, len(self.texts), self.chunks_per_section):
+            end = start + self.chunks_per_section
+            yield f"Synthetic section {start // self.chunks_per_section}", {
+                "embeddings": self.embeddings[start:end],
+                "texts": self.texts[start:end],
+            }
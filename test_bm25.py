@@ -0,0 +1,171 @@
+"""
+Tests for bm25.py.
+
+    python -m unittest test_bm25
+"""
+
+# Standard imports
+import math
+import tempfile
+import unittest
+from pathlib import Path
+from collections import Counter
+
+# Internal imports
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+CORPUS = [
+    (
+        "1",
+        "CAH",
+        "Congenital adrenal hyperplasia (CAH) is caused by 21-hydroxylase deficiency.",
+    ),
+    ("2", "CAH", "Newborn screening for CAH measures 17-hydroxyprogesterone."),
+    (
+        "3",
+        "CAH",
+        "Salt-wasting CAH presents with vomiting, dehydration and hyponatremia.",
+    ),
+    (
+        "4",
+        "RA",
+        "DMARDs such as methotrexate are the first line treatment of rheumatoid arthritis.",
+    ),
+    ("5", "RA", "Methotrexate needs folic acid supplementation."),
+    (
+        "6",
+        "TB",
+        "Tuberculosis is treated with isoniazid, rifampicin, pyrazinamide and ethambutol.",
+    ),
+    (
+        "7",
+        "TB",
+        "Isoniazid can cause peripheral neuropathy, prevented with pyridoxine.",
+    ),
+]
+QUERIES = [
+    "What causes CAH?",
+    "DMARD methotrexate",
+    "isoniazid neuropathy pyridoxine",
+    "CAH screening newborn 17-hydroxyprogesterone",
+    "treatment",
+]
+
+
+def brute_force_bm25(corpus: list, query: str, k1: float, b: float) -> dict:
+    """
+    Scores every chunk of corpus for query with the BM25 formula, term by term.
+    Returns row mapped to score for the chunks sharing a term with the query.
+    """
+    documents = [Counter(tokenize(text)) for _, _, text in corpus]
+    lengths = [sum(d.values()) for d in documents]
+    average = sum(lengths) / len(lengths)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(term in d for d in documents)
+        if df == 0:
+            continue
+        idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        for row, (document, length) in enumerate(zip(documents, lengths)):
+            f = document[term]
+            if f:
+                norm = k1 * (1 - b + b * length / average)
+                scores[row] = scores.get(row, 0.0) + idf * f * (k1 + 1) / (f + norm)
+    return scores
+
+
+class BM25IndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "bm25_index"
+        self.index = BM25Index(self.path, k1=1.2, b=0.75)
+
+    def add(self, index: BM25Index, corpus: list) -> None:
+        index.add(*map(list, zip(*corpus)))
+
+    def assertScoresMatch(self, index: BM25Index, corpus: list) -> None:
+        """
+        Checks the index scores every query like brute_force_bm25 does, in order.
+        """
+        for query in QUERIES:
+            with self.subTest(query=query):
+                expected = brute_force_bm25(corpus, query, index.k1, index.b)
+                results = index.search(query, len(corpus))
+                self.assertEqual(len(results), len(expected))
+                for row, score in results:
+                    self.assertAlmostEqual(score, expected[row], places=5)
+                scores = [score for _, score in results]
+                self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_scores_match_brute_force(self) -> None:
+        self.add(self.index, CORPUS)
+        self.index.commit()
+        self.assertScoresMatch(self.index, CORPUS)
+        self.assertEqual(self.index.search("unrelated words", 3), [])
+        self.assertEqual(len(self.index.search("CAH", 2)), 2)
+
+    def test_scores_match_brute_force_after_changes(self) -> None:
+        self.add(self.index, CORPUS[:5])
+        self.index.commit()
+        self.index.remove_titles(["RA"])
+        self.index.remove_ids(["2"])
+        self.add(self.index, CORPUS[5:])
+        # Nothing changes until the commit
+        self.assertEqual(len(self.index.search("isoniazid", 3)), 0)
+        self.index.commit()
+
+        corpus = [CORPUS[0], CORPUS[2]] + CORPUS[5:]
+        self.assertEqual(self.index.ids, [id for id, _, _ in corpus])
+        self.assertEqual(self.index.titles, [title for _, title, _ in corpus])
+        self.assertScoresMatch(self.index, corpus)
+
+    def test_save_and_load(self) -> None:
+        self.add(self.index, CORPUS)
+        self.index.save("3:7")
+        loaded = BM25Index(self.path, k1=1.2, b=0.75)
+        self.assertEqual(loaded.data_version, "3:7")
+        self.assertEqual(loaded.ids, self.index.ids)
+        self.assertEqual(loaded.titles, self.index.titles)
+        for query in QUERIES:
+            self.assertEqual(loaded.search(query, 5), self.index.search(query, 5))
+
+        # A loaded index keeps changing from where it was saved
+        loaded.remove_titles(["TB"])
+        loaded.save("4:5")
+        loaded = BM25Index(self.path, k1=1.2, b=0.75)
+        self.assertEqual(loaded.data_version, "4:5")
+        self.assertScoresMatch(loaded, CORPUS[:5])
+
+    def test_clear(self) -> None:
+        self.add(self.index, CORPUS)
+        self.index.commit()
+        self.index.clear()
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.search("CAH", 3), [])
+        self.add(self.index, CORPUS[3:])
+        self.index.commit()
+        self.assertScoresMatch(self.index, CORPUS[3:])
+
+
+class ReciprocalRankFusionTest(unittest.TestCase):
+    def test_ordering(self) -> None:
+        # a: 1/61 + 1/62, c: 1/63 + 1/61, b: 1/62, d: 1/63
+        self.assertEqual(
+            reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], k=60),
+            ["a", "c", "b", "d"],
+        )
+
+    def test_ties_keep_the_order_first_seen(self) -> None:
+        self.assertEqual(
+            reciprocal_rank_fusion([["x", "y"], ["y", "x"]], k=60), ["x", "y"]
+        )
+        self.assertEqual(reciprocal_rank_fusion([["x"], [], ["y"]]), ["x", "y"])
+
+    def test_empty(self) -> None:
+        self.assertEqual(reciprocal_rank_fusion([]), [])
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Tests for cache.py.
+
+    python -m unittest test_cache
+"""
+
+# Standard imports
+import unittest
+
+# Internal imports
+from cache import AnswerCache, jaccard
+
+# External imports
+import numpy as np
+
+
+def near(embedding: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Returns an embedding with a cosine similarity of about 0.99 to embedding.
+    """
+    noise = np.random.default_rng(seed).standard_normal(len(embedding))
+    return embedding + 0.1 * noise / np.linalg.norm(noise)
+
+
+class AnswerCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = AnswerCache(similarity=0.95, chunk_overlap=0.8)
+        self.embedding = np.random.default_rng(0).standard_normal(384)
+        self.embedding /= np.linalg.norm(self.embedding)
+
+    def test_exact_hit(self) -> None:
+        self.cache.put("What is CAH?", ["1", "2"], self.embedding, "An answer.", ["A"])
+        entry = self.cache.lookup("what is  CAH?", ["1", "2"], self.embedding)
+        self.assertEqual(entry["answer"], "An answer.")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_similar_question_with_the_same_chunks_shares_the_answer(self) -> None:
+        chunks = [str(i) for i in range(7)]
+        self.cache.put(
+            "How is type 1 diabetes treated?", chunks, self.embedding, "Insulin.", ["A"]
+        )
+        entry = self.cache.lookup(
+            "How do you treat type 1 diabetes?",
+            list(reversed(chunks)),
+            near(self.embedding, 1),
+        )
+        self.assertEqual(entry["answer"], "Insulin.")
+
+    def test_similar_question_with_other_chunks_does_not_share_the_answer(
+        self,
+    ) -> None:
+        self.cache.put(
+            "How is type 1 diabetes treated?",
+            ["t1-a", "t1-b", "t1-c", "shared"],
+            self.embedding,
+            "Insulin.",
+            ["Type 1 diabetes"],
+        )
+        embedding = near(self.embedding, 2)
+        self.assertGreater(float(embedding @ self.embedding), 0.95)
+        self.assertIsNone(
+            self.cache.lookup(
+                "How is type 2 diabetes treated?",
+                ["t2-a", "t2-b", "t2-c", "shared"],
+                embedding,
+            )
+        )
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_semantic_tier_off(self) -> None:
+        cache = AnswerCache(similarity=None)
+        cache.put("What is CAH?", ["1"], self.embedding, "An answer.", ["A"])
+        self.assertIsNone(cache.lookup("Define CAH.", ["1"], self.embedding))
+
+    def test_validate_drops_answers_when_the_data_changes(self) -> None:
+        self.cache.validate("1:10")
+        self.cache.put("What is CAH?", ["1"], self.embedding, "An answer.", ["A"])
+        self.cache.validate("1:10")
+        self.assertEqual(len(self.cache), 1)
+        self.cache.validate("2:12")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_jaccard(self) -> None:
+        self.assertEqual(jaccard({"1", "2"}, ["2", "3"]), 1 / 3)
+        self.assertEqual(jaccard(set(), []), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
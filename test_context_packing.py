@@ -0,0 +1,118 @@
+"""
+Tests for context_packing.py, counting tokens with the character estimate so no tokenizer is needed.
+
+    python -m unittest test_context_packing
+"""
+
+# Standard imports
+import random
+import unittest
+
+# Internal imports
+from const import SOURCE_TEMPLATE
+from context_packing import TokenCounter, pack_context
+
+WORDS = "adrenal cortisol deficiency screening newborn salt wasting enzyme steroid CAH".split()
+
+
+def random_sources(rng: random.Random, n_sources: int) -> list:
+    """
+    Returns (source name, text) pairs of random sentences, some repeated across sources.
+    """
+    pool = [
+        " ".join(rng.choices(WORDS, k=rng.randint(1, 25))).capitalize() + "."
+        for _ in range(3 * n_sources)
+    ]
+    return [
+        (f"Source {i}", " ".join(rng.choices(pool, k=rng.randint(1, 6))))
+        for i in range(n_sources)
+    ]
+
+
+class PackContextTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.counter = TokenCounter(tokenizer_name=None, chars_per_token=3.5)
+
+    def prompt_tokens(self, packed: list, counter: TokenCounter = None) -> int:
+        """
+        Tokens the packed sources take in the prompt, each formatted as it is there.
+        """
+        counter = counter or self.counter
+        return sum(
+            counter.count(SOURCE_TEMPLATE.format(name=name, content=content))
+            for name, content in packed
+        )
+
+    def test_never_exceeds_the_budget(self) -> None:
+        rng = random.Random(0)
+        for chars_per_token in [1.0, 3.5, 4.0]:
+            counter = TokenCounter(tokenizer_name=None, chars_per_token=chars_per_token)
+            for _ in range(200):
+                sources = random_sources(rng, rng.randint(1, 8))
+                budget = rng.randint(5, 400)
+                with self.subTest(chars_per_token=chars_per_token, budget=budget):
+                    packed = pack_context(sources, budget, counter)
+                    self.assertLessEqual(self.prompt_tokens(packed, counter), budget)
+
+    def test_everything_fits_whole(self) -> None:
+        sources = [("A", "One sentence. Two sentences."), ("B", "Three sentences.")]
+        self.assertEqual(pack_context(sources, 1000, self.counter), sources)
+        self.assertEqual(pack_context(sources, None, self.counter), sources)
+
+    def test_duplicate_sentences_are_removed(self) -> None:
+        sources = [
+            ("A", "CAH is common. It is screened for at birth."),
+            ("B", "It is screened for  at birth. Salt wasting is dangerous."),
+            ("C", "cah is COMMON."),
+            ("A", "Salt wasting is dangerous. Cortisol is low."),
+        ]
+        self.assertEqual(
+            pack_context(sources, None, self.counter),
+            [
+                ("A", "CAH is common. It is screened for at birth."),
+                ("B", "Salt wasting is dangerous."),
+                ("A", "Cortisol is low."),
+            ],
+        )
+        # The copy kept is the one in the most relevant source, whatever the budget
+        packed = pack_context(sources, 40, self.counter)
+        text = " ".join(content for _, content in packed)
+        for sentence in ["CAH is common.", "Salt wasting is dangerous."]:
+            self.assertLessEqual(text.lower().count(sentence.lower()), 1)
+
+    def test_sources_lose_sentences_from_their_end(self) -> None:
+        sources = [
+            ("A", "First of A. Second of A. Third of A."),
+            ("B", "First of B. Second of B. Third of B."),
+        ]
+        packed = pack_context(sources, 30, self.counter)
+        self.assertEqual([name for name, _ in packed], ["A", "B"])
+        for (_, content), (_, text) in zip(packed, sources):
+            self.assertTrue(text.startswith(content))
+        self.assertLessEqual(self.prompt_tokens(packed), 30)
+
+    def test_first_source_survives_a_long_first_sentence(self) -> None:
+        long_sentence = " ".join(["adrenal"] * 100) + "."
+        sources = [
+            ("A", long_sentence + " Short one."),
+            ("B", "A short sentence from B."),
+        ]
+        for budget in [20, 60, 150]:
+            with self.subTest(budget=budget):
+                packed = pack_context(sources, budget, self.counter)
+                self.assertEqual(packed[0][0], "A")
+                self.assertTrue(long_sentence.startswith(packed[0][1]))
+                self.assertGreater(len(packed[0][1]), 0)
+                self.assertLessEqual(self.prompt_tokens(packed), budget)
+
+    def test_budget_too_small_for_anything(self) -> None:
+        sources = [("A", "Some sentence."), ("B", "Another sentence.")]
+        self.assertEqual(pack_context(sources, 1, self.counter), [])
+
+    def test_empty_sources(self) -> None:
+        self.assertEqual(pack_context([], 100, self.counter), [])
+        self.assertEqual(pack_context([("A", "  ")], 100, self.counter), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Tests for the cleaning step of data_handler.py, with TXT files so no parser library is needed.
+
+    python -m unittest test_data_handler
+"""
+
+# Standard imports
+import io
+import tempfile
+import unittest
+import contextlib
+from pathlib import Path
+
+# Internal imports
+from data_handler import DataHandler
+
+
+class CleanDataTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        folder = Path(tmp.name)
+        self.paths = {}
+        for name in ["data", "cleaned", "vectorized"]:
+            self.paths[name] = folder / name
+            self.paths[name].mkdir()
+
+        # Every folder has a file titled "Shared", the last one cleaned is kept
+        for i in range(40):
+            subfolder = self.paths["data"] / f"folder_{i:02d}"
+            subfolder.mkdir()
+            (subfolder / "Shared.txt").write_text(f"Shared text of folder {i}.")
+            (subfolder / f"Own {i}.txt").write_text(f"Text only in folder {i}.")
+
+    def handler(self) -> DataHandler:
+        """
+        Returns a handler over the test folders with the data loaded, without printing.
+        """
+        handler = DataHandler(
+            data_path=self.paths["data"],
+            clean_data_path=self.paths["cleaned"],
+            vectorized_data_path=self.paths["vectorized"],
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            handler.load_data()
+        return handler
+
+    def clean(self, num_workers: int) -> DataHandler:
+        handler = self.handler()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+            io.StringIO()
+        ):
+            handler.clean_data(num_workers=num_workers)
+        return handler
+
+    def test_duplicate_titles_keep_the_last_file(self) -> None:
+        for num_workers in [1, 4]:
+            with self.subTest(num_workers=num_workers):
+                handler = self.clean(num_workers)
+                last = [f for f in handler.data if Path(f).stem == "Shared"][-1]
+                expected = Path(last).read_text()
+                self.assertEqual(handler.data_dict["Shared"], expected)
+                self.assertEqual(
+                    (self.paths["cleaned"] / "Shared.txt").read_text(), expected
+                )
+                self.assertEqual(len(handler.data_dict), 41)
+                self.assertEqual(len(list(self.paths["cleaned"].iterdir())), 41)
+
+    def test_clean_file_writes_nothing(self) -> None:
+        handler = self.handler()
+        file = next(f for f in handler.data if Path(f).stem == "Own 3")
+        self.assertEqual(
+            handler.clean_file(file), [("Own 3", "Text only in folder 3.")]
+        )
+        self.assertEqual(list(self.paths["cleaned"].iterdir()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""
+Tests for manifest.py.
+
+    python -m unittest test_manifest
+"""
+
+# Standard imports
+import tempfile
+import unittest
+from pathlib import Path
+
+# Internal imports
+from manifest import IngestionManifest
+
+
+class IngestionManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = Path(tmp.name)
+        self.manifest = IngestionManifest(self.folder / "manifest.json")
+
+    def write(self, name: str, content: str) -> str:
+        """
+        Writes a source file and returns its path.
+        """
+        path = self.folder / name
+        path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    def reopen(self) -> IngestionManifest:
+        """
+        Saves the manifest and returns a new one loaded from disk, as the next run would see it.
+        """
+        self.manifest.save()
+        return IngestionManifest(self.manifest.path)
+
+    def ingest(self, manifest: IngestionManifest, file: str, titles: list) -> list:
+        """
+        Records a file's titles as cleaned and vectorized into a shard of their own, and returns the dropped titles.
+        """
+        dropped = manifest.record_file(file, titles)
+        manifest.record_shard(titles, f"shard_{len(manifest.shards)}")
+        return dropped
+
+    def test_changed_file(self) -> None:
+        a = self.write("a.txt", "A")
+        b = self.write("b.txt", "B")
+        self.assertEqual(self.manifest.changed_files([a, b]), [a, b])
+        self.ingest(self.manifest, a, ["A1", "A2"])
+        self.ingest(self.manifest, b, ["B1"])
+        manifest = self.reopen()
+        self.assertEqual(manifest.changed_files([a, b]), [])
+
+        self.write("b.txt", "B modified")
+        manifest = IngestionManifest(self.manifest.path)
+        self.assertEqual(manifest.changed_files([a, b]), [b])
+        self.assertEqual(manifest.record_file(b, ["B1", "B2"]), [])
+        self.assertEqual(manifest.pending_vectorize(), {"B1", "B2"})
+        self.assertEqual(manifest.removed_titles, set())
+
+    def test_changed_file_dropping_a_title(self) -> None:
+        a = self.write("a.txt", "A")
+        self.ingest(self.manifest, a, ["A1", "A2"])
+        self.write("a.txt", "A without its second section")
+        manifest = IngestionManifest(self.reopen().path)
+        self.assertEqual(manifest.record_file(a, ["A1"]), ["A2"])
+        self.assertNotIn("A2", manifest.titles)
+        self.assertEqual(manifest.removed_titles, {"A2"})
+        self.assertEqual(manifest.deleted_titles, {"A2"})
+
+    def test_deleted_file(self) -> None:
+        a = self.write("a.txt", "A")
+        b = self.write("b.txt", "B")
+        self.ingest(self.manifest, a, ["A1"])
+        self.ingest(self.manifest, b, ["B1", "B2"])
+        manifest = self.reopen()
+        self.assertEqual(manifest.deleted_files([a]), [b])
+        self.assertEqual(manifest.remove_file(b), ["B1", "B2"])
+        self.assertEqual(set(manifest.titles), {"A1"})
+        self.assertEqual(manifest.removed_titles, {"B1", "B2"})
+        # The copies left in the shard are never loaded again, even by a later run
+        self.manifest = manifest
+        manifest = self.reopen()
+        self.assertTrue(manifest.is_stale("B1", "shard_1"))
+        self.assertFalse(manifest.is_stale("A1", "shard_0"))
+
+    def test_title_moving_between_files(self) -> None:
+        a = self.write("a.txt", "A")
+        b = self.write("b.txt", "B")
+        self.ingest(self.manifest, a, ["Shared", "A1"])
+        self.ingest(self.manifest, b, ["B1"])
+        manifest = self.reopen()
+
+        # a no longer produces the title but b does: whichever is cleaned first, it ends up
+        # recorded as b's, waiting to be vectorized and not marked for removal
+        self.write("a.txt", "A without the shared section")
+        self.write("b.txt", "B with the shared section")
+        for files in ([a, b], [b, a]):
+            with self.subTest(order=files):
+                moved = IngestionManifest(manifest.path)
+                new_titles = {a: ["A1"], b: ["B1", "Shared"]}
+                for file in files:
+                    moved.record_file(file, new_titles[file])
+                self.assertEqual(moved.files[b]["titles"], ["B1", "Shared"])
+                self.assertEqual(moved.titles["Shared"]["shard"], None)
+                self.assertNotIn("Shared", moved.removed_titles)
+                self.assertNotIn("Shared", moved.deleted_titles)
+
+                moved.record_shard(["Shared"], "shard_2")
+                self.assertTrue(moved.is_stale("Shared", "shard_0"))
+                self.assertFalse(moved.is_stale("Shared", "shard_2"))
+
+    def test_stale_shard(self) -> None:
+        a = self.write("a.txt", "A")
+        b = self.write("b.txt", "B")
+        self.ingest(self.manifest, a, ["A1"])
+        self.ingest(self.manifest, b, ["B1"])
+        self.assertEqual(self.manifest.stale_shards(), set())
+
+        # A modified file is vectorized into a new shard, its old one holds nothing live
+        self.write("a.txt", "A modified")
+        manifest = IngestionManifest(self.reopen().path)
+        self.ingest(manifest, a, ["A1"])
+        self.assertEqual(manifest.stale_shards(), {"shard_0"})
+        self.assertTrue(manifest.is_stale("A1", "shard_0"))
+        self.assertFalse(manifest.is_stale("A1", "shard_2"))
+
+        manifest.forget_shard("shard_0")
+        self.assertEqual(manifest.stale_shards(), set())
+        self.assertEqual(manifest.shards, {"shard_1", "shard_2"})
+
+    def test_shard_from_before_the_manifest(self) -> None:
+        a = self.write("a.txt", "A")
+        self.ingest(self.manifest, a, ["A1"])
+        self.manifest.remove_file(a)
+        # Titles unknown to the manifest are only stale in a shard it wrote or once deleted
+        self.assertFalse(self.manifest.is_stale("Old", "vectorized_data_0"))
+        self.assertTrue(self.manifest.is_stale("Old", "shard_0"))
+        self.assertTrue(self.manifest.is_stale("A1", "vectorized_data_0"))
+
+    def test_mark_indexed_and_clear_removed(self) -> None:
+        a = self.write("a.txt", "A")
+        b = self.write("b.txt", "B")
+        self.manifest.record_file(a, ["A1", "A2"])
+        self.manifest.record_file(b, ["B1"])
+        self.manifest.record_shard(["A1", "A2"], "shard_0", {"A1": 3, "A2": 4})
+        self.manifest.record_shard(["B1"], "shard_1", {"B1": 5})
+        self.assertEqual(self.manifest.pending_index(), {"A1", "A2", "B1"})
+        self.assertEqual(self.manifest.indexed_chunks(), 0)
+
+        self.manifest.mark_indexed(["A1", "A2", "Unknown"])
+        self.assertEqual(self.manifest.pending_index(), {"B1"})
+        self.assertEqual(self.manifest.indexed_chunks(), 7)
+        self.assertNotIn("Unknown", self.manifest.titles)
+
+        self.manifest.remove_file(a)
+        manifest = self.reopen()
+        self.assertEqual(manifest.removed_titles, {"A1", "A2"})
+        self.assertEqual(manifest.indexed_chunks(), 0)
+        manifest.mark_indexed(["B1"])
+        manifest.clear_removed()
+        self.manifest = manifest
+        manifest = self.reopen()
+        self.assertEqual(manifest.removed_titles, set())
+        self.assertEqual(manifest.deleted_titles, {"A1", "A2"})
+        self.assertEqual(manifest.pending_index(), set())
+        self.assertEqual(manifest.indexed_chunks(), 5)
+
+    def test_chunks_not_recorded(self) -> None:
+        a = self.write("a.txt", "A")
+        self.ingest(self.manifest, a, ["A1"])
+        self.manifest.mark_indexed(["A1"])
+        self.assertIsNone(self.manifest.indexed_chunks())
+
+    def test_save_leaves_no_temporary_file(self) -> None:
+        self.ingest(self.manifest, self.write("a.txt", "A"), ["A1"])
+        self.manifest.save()
+        self.assertEqual(
+            sorted(p.name for p in self.folder.iterdir()), ["a.txt", "manifest.json"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Tests for loading and running an exported model in onnx_embedding.py, with a small WordPiece
+tokenizer and a stand-in for the onnxruntime session, so neither the model nor torch is needed.
+
+    python -m unittest test_onnx_embedding
+"""
+
+# Standard imports
+import sys
+import json
+import types
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Internal imports
+from onnx_embedding import OnnxEmbeddingModel
+from test_utils import WordPieceTokenizer
+
+# External imports
+import numpy as np
+
+MODEL_NAME = "stand-in/wordpiece"
+DIMENSIONS = 8
+
+
+class StandInSession:
+    """
+    Stand-in for onnxruntime.InferenceSession, giving every token an embedding made of its id.
+    """
+
+    feeds = []
+
+    def __init__(self, path: str, options, providers: list) -> None:
+        pass
+
+    def get_inputs(self) -> list:
+        return [types.SimpleNamespace(name=n) for n in ["input_ids", "attention_mask"]]
+
+    def get_outputs(self) -> list:
+        return [types.SimpleNamespace(shape=["batch", "sequence", DIMENSIONS])]
+
+    def run(self, output_names, feed: dict) -> list:
+        self.feeds.append(feed)
+        ids = feed["input_ids"].astype(np.float32)
+        return [np.repeat(ids[..., None], DIMENSIONS, axis=2)]
+
+
+class OnnxEmbeddingModelTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = Path(tmp.name)
+
+        # An export as export() leaves it, without running torch
+        path = self.folder / "stand-in_wordpiece.onnx"
+        path.touch()
+        with open(path.with_suffix(".json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "max_seq_length": 6,
+                    "pooling": "mean",
+                    "normalize": False,
+                    "pad_token": "[UNK]",
+                    "pad_token_id": 0,
+                },
+                f,
+            )
+        self.wordpiece = WordPieceTokenizer()
+        self.wordpiece.tokenizer.save(str(path.with_suffix(".tokenizer.json")))
+
+        patcher = mock.patch("onnxruntime.InferenceSession", StandInSession)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        StandInSession.feeds.clear()
+
+    def test_batches_are_padded_and_truncated(self) -> None:
+        model = OnnxEmbeddingModel(MODEL_NAME, quantize=False, folder=self.folder)
+        texts = ["sentence is short", "congenital adrenal hyperplasia is short indeed"]
+        embeddings = model.encode(texts, batch_size=2)
+
+        [feed] = StandInSession.feeds
+        self.assertEqual(sorted(feed), ["attention_mask", "input_ids"])
+        self.assertEqual(feed["input_ids"].dtype, np.int64)
+        self.assertEqual(feed["input_ids"].shape, (2, 6))
+        np.testing.assert_array_equal(
+            feed["attention_mask"], [[1, 1, 1, 1, 1, 0], [1, 1, 1, 1, 1, 1]]
+        )
+
+        # The mean of the ids of the tokens that aren't padding, [CLS] and [SEP] included
+        for text, embedding, mask in zip(texts, embeddings, feed["attention_mask"]):
+            ids = self.wordpiece(text)["input_ids"][: int(mask.sum())]
+            ids[-1] = self.wordpiece.tokenizer.token_to_id("[SEP]")
+            np.testing.assert_allclose(embedding, np.full(DIMENSIONS, np.mean(ids)))
+
+    def test_transformers_is_not_imported(self) -> None:
+        with mock.patch.dict(sys.modules, {"transformers": None}):
+            model = OnnxEmbeddingModel(MODEL_NAME, quantize=False, folder=self.folder)
+            self.assertEqual(model.encode("sentence is short").shape, (DIMENSIONS,))
+            self.assertEqual(model.encode([]).shape, (0, DIMENSIONS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,375 @@
+"""
+Tests for server.py, run against a stand-in for Ollama's HTTP API so neither Ollama nor the
+embedding model is needed.
+
+    python -m unittest test_server
+"""
+
+# Standard imports
+import os
+import json
+import types
+import socket
+import asyncio
+import threading
+import http.client
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Internal imports
+import server as server_module
+import pipeline
+from cache import AnswerCache
+from config import SERVE_MAX_RESULTS
+from server import RAGServer
+
+# External imports
+import numpy as np
+
+MODEL = "stand-in:latest"
+ANSWER = ["Congenital ", "adrenal ", "hyperplasia."]
+SOURCES = {
+    "1_Endocrinology": "CAH is caused by 21-hydroxylase deficiency.",
+    "2_Pediatrics": "Newborn screening measures 17-hydroxyprogesterone.",
+}
+
+
+class StandInOllama(BaseHTTPRequestHandler):
+    """
+    Stand-in for Ollama's /api/tags, /api/generate and /api/chat, streaming ANSWER one token per line.
+    The body of every request is kept in requests.
+    """
+
+    requests = []
+    # Set to break the connection off after the first token
+    broken = False
+
+    def do_GET(self) -> None:
+        self.__send_lines([{"models": [{"name": MODEL}]}])
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StandInOllama.requests.append((self.path, body))
+        if self.path == "/api/generate":
+            lines = [{"response": token, "done": False} for token in ANSWER]
+        elif self.path == "/api/chat":
+            lines = [
+                {"message": {"role": "assistant", "content": token}, "done": False}
+                for token in ANSWER
+            ]
+        else:
+            self.send_error(404)
+            return
+        lines.append({"done": True, "prompt_eval_count": 100})
+        self.__send_lines(lines, broken=StandInOllama.broken)
+
+    def __send_lines(self, lines: list, broken: bool = False) -> None:
+        body = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        # A broken stream ends before the length it announced
+        self.send_header("Content-Length", str(len(body) + broken * 4096))
+        self.end_headers()
+        if broken:
+            # The first line whole, then part of a line longer than the client's reads
+            self.wfile.write(
+                body[: body.index(b"\n") + 1] + b'{"response": "' + b"x" * 2048
+            )
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class StandInVectorDB:
+    """
+    Stand-in for the vector DB, always returning SOURCES and recording the n_results asked for.
+    """
+
+    asked = []
+
+    def search(self, query: str, n_results: int) -> dict:
+        self.asked.append(n_results)
+        return dict(list(SOURCES.items())[:n_results])
+
+    def embed_query(self, query: str):
+        return np.ones(384, dtype=np.float32)
+
+
+class ServerTest(unittest.TestCase):
+    """
+    Runs the server on a free port in a thread, with the LLM built by the pipeline from a client
+    whose OLLAMA_HOST points at the stand-in.
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.ollama = ThreadingHTTPServer(("127.0.0.1", 0), StandInOllama)
+        threading.Thread(target=cls.ollama.serve_forever, daemon=True).start()
+        ollama_host = f"127.0.0.1:{cls.ollama.server_port}"
+        # No ollama CLI on the PATH, the environment variable is enough
+        with mock.patch.dict(os.environ, {"OLLAMA_HOST": ollama_host, "PATH": ""}):
+            cls.client = getattr(pipeline, "__get_ollama_client")()
+
+        cls.loop = asyncio.new_event_loop()
+        cls.loop_thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.loop_thread.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.loop_thread.join()
+        cls.loop.close()
+        cls.client.close()
+        cls.ollama.shutdown()
+        cls.ollama.server_close()
+
+    def start_server(self, build_prompt, answer_cache=None) -> RAGServer:
+        """
+        Starts a server building prompts with build_prompt and returns it.
+        """
+        llm = getattr(pipeline, "__get_llm")(self.client)
+        server = RAGServer(
+            StandInVectorDB(),
+            lambda prompt: llm(prompt, model=MODEL),
+            build_prompt,
+            answer_cache=answer_cache,
+        )
+        listening = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(server.handle, "127.0.0.1", 0), self.loop
+        ).result(timeout=5)
+        self.port = listening.sockets[0].getsockname()[1]
+        self.addCleanup(server.close)
+        self.addCleanup(
+            lambda: asyncio.run_coroutine_threadsafe(
+                self.__close(listening), self.loop
+            ).result(timeout=5)
+        )
+        StandInOllama.requests.clear()
+        StandInOllama.broken = False
+        return server
+
+    async def __close(self, listening: asyncio.AbstractServer) -> None:
+        listening.close()
+        await listening.wait_closed()
+
+    def post(self, path: str, payload: dict) -> http.client.HTTPResponse:
+        """
+        Posts a JSON payload to the server and returns the response.
+        """
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        self.addCleanup(connection.close)
+        connection.request(
+            "POST",
+            path,
+            json.dumps(payload),
+            {"Content-Type": "application/json"},
+        )
+        return connection.getresponse()
+
+    def status_of_raw_request(self, request: bytes) -> int:
+        """
+        Sends a request as raw bytes, so its headers can be malformed, and returns the status code.
+        """
+        with socket.create_connection(("127.0.0.1", self.port), timeout=10) as client:
+            client.sendall(request)
+            response = b""
+            while b"\r\n" not in response:
+                response += client.recv(4096)
+        return int(response.split(b" ", 2)[1])
+
+    def events(self, response: http.client.HTTPResponse) -> list:
+        """
+        Reads the server-sent events of a response as (event, data).
+        """
+        events = []
+        for block in response.read().decode("utf-8").split("\n\n"):
+            if block:
+                event, data = block.split("\n")
+                events.append(
+                    (event[len("event: ") :], json.loads(data[len("data: ") :]))
+                )
+        return events
+
+    def test_search(self) -> None:
+        self.start_server(pipeline.build_chat_messages)
+        response = self.post("/search", {"query": "What is CAH?", "n_results": 1})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(
+            json.loads(response.read()),
+            {
+                "results": [
+                    {
+                        "id": "1",
+                        "title": "Endocrinology",
+                        "text": SOURCES["1_Endocrinology"],
+                    }
+                ]
+            },
+        )
+
+    def test_search_rejects_bad_queries(self) -> None:
+        self.start_server(pipeline.build_chat_messages)
+        self.assertEqual(self.post("/search", {"query": ""}).status, 400)
+        self.assertEqual(self.post("/nowhere", {"query": "CAH"}).status, 404)
+        for n_results in [0, -1, True, 2.5, "2"]:
+            with self.subTest(n_results=n_results):
+                response = self.post(
+                    "/search", {"query": "CAH", "n_results": n_results}
+                )
+                self.assertEqual(response.status, 400)
+
+    def test_search_clamps_n_results(self) -> None:
+        self.start_server(pipeline.build_chat_messages)
+        StandInVectorDB.asked.clear()
+        response = self.post("/search", {"query": "CAH", "n_results": 10**9})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(StandInVectorDB.asked, [SERVE_MAX_RESULTS])
+
+    def test_bad_content_length(self) -> None:
+        self.start_server(pipeline.build_chat_messages)
+        for length in [b"-1", b"abc", b"+5", b"1_0", b"\xb2"]:
+            with self.subTest(length=length):
+                status = self.status_of_raw_request(
+                    b"POST /search HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n"
+                )
+                self.assertEqual(status, 400)
+        self.assertEqual(
+            self.status_of_raw_request(
+                b"POST /search HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (1 << 21)
+            ),
+            413,
+        )
+
+    def test_answer_generate(self) -> None:
+        self.start_server(pipeline.build_system_prompt)
+        response = self.post("/answer", {"query": "What is CAH?"})
+        self.assertEqual(response.status, 200)
+        events = self.events(response)
+        self.assertEqual(
+            events[0], ("sources", {"references": ["Endocrinology", "Pediatrics"]})
+        )
+        self.assertEqual(
+            "".join(data["token"] for event, data in events if event == "token"),
+            "".join(ANSWER),
+        )
+        self.assertEqual(events[-1], ("done", {"cached": False}))
+        [(path, body)] = StandInOllama.requests
+        self.assertEqual(path, "/api/generate")
+        self.assertIn("What is CAH?", body["prompt"])
+        self.assertIn(SOURCES["2_Pediatrics"], body["prompt"])
+
+    def test_answer_chat(self) -> None:
+        self.start_server(pipeline.build_chat_messages)
+        response = self.post("/answer", {"query": "What is CAH?"})
+        self.assertEqual(response.status, 200)
+        events = self.events(response)
+        self.assertEqual(
+            "".join(data["token"] for event, data in events if event == "token"),
+            "".join(ANSWER),
+        )
+        self.assertEqual(events[-1], ("done", {"cached": False}))
+        [(path, body)] = StandInOllama.requests
+        self.assertEqual(path, "/api/chat")
+        system, user = body["messages"]
+        self.assertEqual(system["role"], "system")
+        self.assertEqual(user["role"], "user")
+        self.assertIn("What is CAH?", user["content"])
+        self.assertIn(SOURCES["1_Endocrinology"], user["content"])
+
+    def test_cached_answer_is_sent_with_its_own_references(self) -> None:
+        answer_cache = AnswerCache()
+        self.start_server(pipeline.build_chat_messages, answer_cache)
+        first = self.events(self.post("/answer", {"query": "What is CAH?"}))
+        self.assertEqual(first[-1], ("done", {"cached": False}))
+        self.assertEqual(len(StandInOllama.requests), 1)
+
+        again = self.events(self.post("/answer", {"query": "what is CAH?"}))
+        self.assertEqual(again[0], first[0])
+        self.assertEqual(again[1], ("token", {"token": "".join(ANSWER)}))
+        self.assertEqual(again[-1], ("done", {"cached": True}))
+        self.assertEqual(len(StandInOllama.requests), 1)
+
+        # An answer cached from other sources cites those, not the ones retrieved now
+        answer_cache.put(
+            "Define CAH.",
+            ["1", "2"],
+            StandInVectorDB().embed_query("Define CAH."),
+            "Cached answer.",
+            ["Endocrinology"],
+        )
+        events = self.events(self.post("/answer", {"query": "Define CAH."}))
+        self.assertEqual(
+            events,
+            [
+                ("sources", {"references": ["Endocrinology"]}),
+                ("token", {"token": "Cached answer."}),
+                ("done", {"cached": True}),
+            ],
+        )
+
+    def test_broken_answer_is_not_cached(self) -> None:
+        answer_cache = AnswerCache()
+        self.start_server(pipeline.build_chat_messages, answer_cache)
+        StandInOllama.broken = True
+        events = self.events(self.post("/answer", {"query": "What is CAH?"}))
+        self.assertEqual(events[1], ("token", {"token": ANSWER[0]}))
+        self.assertEqual(events[-1][0], "error")
+        self.assertEqual(len(answer_cache), 0)
+
+        # The next answer comes through whole and is cached
+        StandInOllama.broken = False
+        events = self.events(self.post("/answer", {"query": "What is CAH?"}))
+        self.assertEqual(events[-1], ("done", {"cached": False}))
+        self.assertEqual(len(answer_cache), 1)
+
+    def test_answer_stops_when_client_disconnects(self) -> None:
+        produced = []
+        client_gone = threading.Event()
+        closed = threading.Event()
+
+        def held_llm(prompt):
+            try:
+                for i in range(20):
+                    produced.append(i)
+                    yield f"token {i} "
+                    # The next token is held back until the client has gone away
+                    client_gone.wait(timeout=5)
+            finally:
+                closed.set()
+
+        # The events the server creates to stop the stream, to know when it saw the disconnect
+        stops = []
+
+        def recorded_event() -> threading.Event:
+            stops.append(threading.Event())
+            return stops[-1]
+
+        server = self.start_server(pipeline.build_chat_messages)
+        server.llm = held_llm
+        body = json.dumps({"query": "What is CAH?"}).encode("utf-8")
+        with mock.patch.object(
+            server_module, "threading", types.SimpleNamespace(Event=recorded_event)
+        ), socket.create_connection(("127.0.0.1", self.port), timeout=10) as client:
+            client.sendall(
+                b"POST /answer HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body)
+                + body
+            )
+            received = b""
+            while b"event: token" not in received:
+                received += client.recv(4096)
+            client.close()
+            [stop] = stops
+            self.assertTrue(stop.wait(timeout=5))
+        client_gone.set()
+
+        # The token being generated when the client went away is the last one pulled
+        self.assertTrue(closed.wait(timeout=5))
+        self.assertEqual(produced, [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Tests for shards.py.
+
+    python -m unittest test_shards
+"""
+
+# Standard imports
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+from pathlib import Path
+
+# Internal imports
+import shards
+from shards import _JsonObjectStream, iter_json_shard, list_shards, load_shard
+
+# External imports
+import numpy as np
+
+
+def parse(text: str, read_size: int) -> list:
+    """
+    Parses text with a _JsonObjectStream reading read_size characters at a time.
+    """
+    return list(_JsonObjectStream(io.StringIO(text), read_size).items())
+
+
+class JsonObjectStreamTest(unittest.TestCase):
+    def assertParsesLikeJson(self, text: str) -> None:
+        """
+        Checks the entries of text match json.loads for every read size up to its length.
+        """
+        expected = list(json.loads(text).items())
+        for read_size in range(1, len(text) + 2):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(parse(text, read_size), expected)
+
+    def test_values_straddling_the_read_buffer(self) -> None:
+        self.assertParsesLikeJson(
+            '{"a": {"embeddings": [[0.125, -2.5e-3]], "texts": ["one"]},'
+            ' "b": 12345, "c": -0.5e10, "d": [true, false, null], "e": "text"}'
+        )
+
+    def test_escaped_quotes_and_braces_in_strings(self) -> None:
+        self.assertParsesLikeJson(
+            r'{"say \"}\"": {"texts": ["{not, an: object}", "\"quoted\" ,}{", "\\"]},'
+            r' "été {": "\\\"}"}'
+        )
+
+    def test_empty_object(self) -> None:
+        for text in ["{}", "  {  }  ", "{\n}"]:
+            self.assertEqual(parse(text, 1), [])
+            self.assertEqual(parse(text, 1 << 20), [])
+
+    def test_truncated_file(self) -> None:
+        text = '{"a": {"texts": ["one"]}, "b": {"texts": ["two", "three"]}}'
+        for end in range(len(text)):
+            with self.subTest(end=end), self.assertRaises(ValueError):
+                parse(text[:end], 4)
+
+    def test_not_an_object(self) -> None:
+        with self.assertRaises(ValueError):
+            parse('[{"a": 1}]', 4)
+        with self.assertRaises(ValueError):
+            parse('{"a": 1; "b": 2}', 4)
+
+
+class ShardTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = Path(tmp.name)
+        rng = np.random.default_rng(0)
+        self.data = {
+            f'Section {i} "{{': {
+                "embeddings": rng.standard_normal((i + 1, 8)).astype(np.float32),
+                "texts": [f"chunk {j} of section {i}" for j in range(i + 1)],
+            }
+            for i in range(5)
+        }
+
+    def assertShardHoldsData(self, sections: list) -> None:
+        """
+        Checks loaded sections match the data saved, in order.
+        """
+        self.assertEqual([title for title, _ in sections], list(self.data))
+        for title, section in sections:
+            np.testing.assert_array_equal(
+                section["embeddings"], self.data[title]["embeddings"]
+            )
+            self.assertEqual(section["texts"], self.data[title]["texts"])
+
+    def test_json_shard_streamed_in_small_reads(self) -> None:
+        shards.save_shard(self.folder, "vectorized_data_0", self.data, "json")
+        path = self.folder / "vectorized_data_0.json"
+        self.assertShardHoldsData(list(iter_json_shard(path, read_size=7)))
+
+    def test_convert_round_trip(self) -> None:
+        shards.save_shard(self.folder, "vectorized_data_0", self.data, "json")
+        subprocess.run(
+            [
+                sys.executable,
+                "shards.py",
+                "--convert",
+                "--remove_json",
+                "--path",
+                str(self.folder),
+            ],
+            cwd=os.path.dirname(os.path.abspath(shards.__file__)),
+            check=True,
+            capture_output=True,
+        )
+        self.assertEqual(list_shards(self.folder), [("vectorized_data_0", "npy")])
+        self.assertFalse((self.folder / "vectorized_data_0.json").exists())
+        self.assertShardHoldsData(
+            list(load_shard(self.folder, "vectorized_data_0", "npy"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests for text_store.py.
+
+    python -m unittest test_text_store
+"""
+
+# Standard imports
+import tempfile
+import unittest
+from pathlib import Path
+
+# Internal imports
+from text_store import TextStore
+
+TEXTS = [
+    "Congenital adrenal hyperplasia is caused by 21-hydroxylase deficiency.",
+    "",
+    "Newborn screening measures 17-hydroxyprogesterone (17-OHP).",
+    "Étude: β-blockers and α-agonists — 日本語 text, emoji 🙂.",
+] + [
+    f"Chunk {i} repeats the words adrenal, cortisol and aldosterone."
+    for i in range(200)
+]
+
+
+class TextStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "texts"
+
+    def open(self, compression, block_size: int = 512) -> TextStore:
+        """
+        Opens the store, closed again at the end of the test.
+        """
+        store = TextStore(self.path, compression=compression, block_size=block_size)
+        self.addCleanup(store.close)
+        return store
+
+    def assertHolds(self, store: TextStore, spans: list, texts: list) -> None:
+        for (offset, length), text in zip(spans, texts):
+            self.assertEqual(store.get(offset, length), text)
+
+    def test_round_trip(self) -> None:
+        for compression in [None, "zlib"]:
+            with self.subTest(compression=compression):
+                self.path = self.path.with_name(f"texts_{compression}")
+                store = self.open(compression)
+                spans = store.append_many(TEXTS)
+                # Readable before and after they are written
+                self.assertHolds(store, spans, TEXTS)
+                store.flush()
+                self.assertHolds(store, spans, TEXTS)
+                # Out of order reads, across blocks
+                self.assertHolds(store, spans[::-1], TEXTS[::-1])
+
+                reopened = self.open(None if compression else "zlib")
+                self.assertEqual(reopened.compression, compression)
+                self.assertEqual(reopened.size, store.size)
+                self.assertHolds(reopened, spans, TEXTS)
+
+                # Appends continue where the store left off
+                more = reopened.append_many(["One more.", "And another one."])
+                self.assertEqual(more[0][0], store.size)
+                reopened.flush()
+                self.assertHolds(
+                    self.open(compression),
+                    spans + more,
+                    TEXTS + ["One more.", "And another one."],
+                )
+
+    def test_compression_shrinks_the_file(self) -> None:
+        raw = self.open(None)
+        raw.append_many(TEXTS)
+        raw.flush()
+        self.path = self.path.with_name("compressed")
+        compressed = self.open("zlib")
+        compressed.append_many(TEXTS)
+        compressed.flush()
+        raw_size = self.path.with_name("texts.bin").stat().st_size
+        compressed_size = self.path.with_name("compressed.bin").stat().st_size
+        self.assertEqual(raw_size, raw.size)
+        self.assertLess(compressed_size, raw_size / 3)
+
+    def test_reopen_after_partial_write(self) -> None:
+        for compression in [None, "zlib"]:
+            with self.subTest(compression=compression):
+                self.path = self.path.with_name(f"partial_{compression}")
+                store = self.open(compression)
+                spans = store.append_many(TEXTS[:100])
+                store.flush()
+                size = store.size
+
+                # A run that writes texts, then stops before recording them in the metadata
+                crashed = TextStore(self.path, compression=compression, block_size=512)
+                crashed.append_many(TEXTS[100:])
+                getattr(crashed, "_TextStore__write_pending")()
+                with open(self.path.with_name(self.path.name + ".bin"), "ab") as f:
+                    f.write(b"\x00\xff half written block")
+
+                reopened = self.open(compression)
+                self.assertEqual(reopened.size, size)
+                self.assertHolds(reopened, spans, TEXTS[:100])
+                with self.assertRaises(ValueError):
+                    reopened.get(size, 1)
+
+                # What the crashed run wrote is overwritten, not read back
+                more = reopened.append_many(TEXTS[150:])
+                self.assertEqual(more[0][0], size)
+                reopened.flush()
+                self.assertHolds(reopened, spans + more, TEXTS[:100] + TEXTS[150:])
+                final = self.open(compression)
+                self.assertHolds(final, spans + more, TEXTS[:100] + TEXTS[150:])
+
+    def test_get_outside_the_store(self) -> None:
+        store = self.open(None)
+        offset, length = store.append("text")
+        for bad in [(-1, 1), (offset, length + 1), (offset + length, 1), (0, -1)]:
+            with self.assertRaises(ValueError):
+                store.get(*bad)
+
+
+if __name__ == "__main__":
+    unittest.main()
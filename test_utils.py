@@ -0,0 +1,203 @@
+"""
+Tests for the chunking and embedding functions of utils.py, counting tokens with a small WordPiece
+tokenizer built like the embedding model's (lowercased, split on whitespace and punctuation, [CLS]
+and [SEP] added) and embedding with a stand-in model.
+
+    python -m unittest test_utils
+"""
+
+# Standard imports
+import string
+import unittest
+from unittest import mock
+
+# Internal imports
+from utils import (
+    chunk_text_tokens,
+    embed_chunks,
+    sentence_splitter,
+    _split_long_sentence,
+)
+
+# External imports
+import numpy as np
+from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, processors
+
+WORDS = ["sentence", "is", "short", "congenital", "adrenal", "hyper", "##plasia"]
+
+
+class WordPieceTokenizer:
+    """
+    Tokenizer with the calling convention of a Hugging Face fast tokenizer, over a vocabulary of
+    WORDS, single characters and word pieces of one character, so any text can be tokenized.
+    """
+
+    def __init__(self) -> None:
+        vocab = ["[UNK]", "[CLS]", "[SEP]"] + WORDS
+        for character in string.ascii_lowercase + string.digits + string.punctuation:
+            vocab += [character, "##" + character]
+        self.tokenizer = Tokenizer(
+            models.WordPiece(
+                {token: i for i, token in enumerate(vocab)},
+                unk_token="[UNK]",
+                max_input_chars_per_word=1000,
+            )
+        )
+        self.tokenizer.normalizer = normalizers.BertNormalizer()
+        self.tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+        self.tokenizer.post_processor = processors.TemplateProcessing(
+            single="[CLS] $A [SEP]", special_tokens=[("[CLS]", 1), ("[SEP]", 2)]
+        )
+
+    def num_special_tokens_to_add(self, pair: bool = False) -> int:
+        return self.tokenizer.post_processor.num_special_tokens_to_add(pair)
+
+    def __call__(
+        self, text, add_special_tokens: bool = True, return_offsets_mapping=False
+    ) -> dict:
+        batch = isinstance(text, list)
+        encodings = self.tokenizer.encode_batch(
+            text if batch else [text], add_special_tokens=add_special_tokens
+        )
+        output = {"input_ids": [e.ids for e in encodings]}
+        if return_offsets_mapping:
+            output["offset_mapping"] = [e.offsets for e in encodings]
+        return output if batch else {k: v[0] for k, v in output.items()}
+
+
+class ChunkTextTokensTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tokenizer = WordPieceTokenizer()
+        # 5 tokens each: the four words and the full stop
+        self.sentences = [f"Sentence {c} is short." for c in "abcdefghijkl"]
+
+    def tokens(self, text: str) -> int:
+        """
+        Number of tokens of text as the model reads it, special tokens included.
+        """
+        return len(self.tokenizer(text)["input_ids"])
+
+    def test_chunks_fit_in_max_tokens_with_special_tokens(self) -> None:
+        text = " ".join(
+            self.sentences[:4]
+            + ["Congenital adrenal hyperplasia " * 20 + "x" * 40 + "."]
+            + self.sentences[4:]
+        )
+        for max_tokens in [3, 4, 8, 13, 32]:
+            for overlap_tokens in [0, 5, 12]:
+                with self.subTest(max_tokens=max_tokens, overlap=overlap_tokens):
+                    chunks = chunk_text_tokens(
+                        text, max_tokens, overlap_tokens, self.tokenizer
+                    )
+                    self.assertTrue(chunks)
+                    for chunk in chunks:
+                        self.assertLessEqual(self.tokens(chunk), max_tokens)
+
+    def test_overlap_repeats_whole_sentences(self) -> None:
+        text = " ".join(self.sentences)
+        # 20 tokens of text per chunk, the last 2 sentences (10 tokens) carried into the next
+        chunks = chunk_text_tokens(text, 22, 10, self.tokenizer)
+        s = self.sentences
+        self.assertEqual(
+            chunks,
+            [
+                " ".join(s[0:4]),
+                " ".join(s[2:6]),
+                " ".join(s[4:8]),
+                " ".join(s[6:10]),
+                " ".join(s[8:12]),
+            ],
+        )
+
+        # Less than a sentence of overlap carries nothing
+        chunks = chunk_text_tokens(text, 22, 4, self.tokenizer)
+        self.assertEqual(chunks, [" ".join(s[i : i + 4]) for i in range(0, 12, 4)])
+
+    def test_overlap_never_exceeds_overlap_tokens(self) -> None:
+        text = " ".join(
+            s.replace("short", "congenital adrenal hyperplasia " * (i % 3))
+            for i, s in enumerate(self.sentences)
+        )
+        for overlap_tokens in [0, 6, 9, 15]:
+            with self.subTest(overlap=overlap_tokens):
+                chunks = chunk_text_tokens(text, 30, overlap_tokens, self.tokenizer)
+                sentences = [sentence_splitter(chunk) for chunk in chunks]
+                recovered = list(sentences[0])
+                for previous, current in zip(sentences, sentences[1:]):
+                    shared = next(
+                        k
+                        for k in range(len(current), -1, -1)
+                        if k <= len(previous)
+                        and previous[len(previous) - k :] == current[:k]
+                    )
+                    self.assertLessEqual(
+                        sum(self.tokens(s) - 2 for s in current[:shared]),
+                        overlap_tokens,
+                    )
+                    recovered += current[shared:]
+                self.assertEqual(recovered, sentence_splitter(text))
+
+    def test_long_sentence_is_split(self) -> None:
+        sentence = "Congenital adrenal hyperplasia is short " * 12 + "indeed."
+        chunks = chunk_text_tokens(sentence, 12, 0, self.tokenizer)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(self.tokens(chunk), 12)
+        # Cut between words, so every word is kept whole and in order
+        self.assertEqual(" ".join(chunks).split(), sentence.split())
+
+    def test_word_longer_than_a_chunk_is_split(self) -> None:
+        sentence = "A " + "x" * 30 + " b."
+        pieces = _split_long_sentence(sentence, 8, self.tokenizer)
+        for piece, tokens in pieces:
+            self.assertEqual(
+                tokens,
+                len(self.tokenizer(piece, add_special_tokens=False)["input_ids"]),
+            )
+            self.assertLessEqual(tokens, 8)
+        self.assertEqual(
+            "".join(piece for piece, _ in pieces).replace(" ", ""),
+            sentence.replace(" ", ""),
+        )
+
+    def test_empty_text(self) -> None:
+        for text in ["", "   ", "\n\n"]:
+            self.assertEqual(chunk_text_tokens(text, 16, 4, self.tokenizer), [])
+
+    def test_max_tokens_too_small(self) -> None:
+        with self.assertRaises(ValueError):
+            chunk_text_tokens("Sentence a is short.", 2, 0, self.tokenizer)
+
+
+class StandInModel:
+    """
+    Embedding model with SentenceTransformer's interface, embedding a text as its length.
+    An empty list gives a flat empty array, like SentenceTransformer.encode.
+    """
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return 3
+
+    def encode(self, chunks: list, **kwargs) -> np.ndarray:
+        return np.asarray([[len(c), 0.0, 1.0] for c in chunks], dtype=np.float32)
+
+
+class EmbedChunksTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch("utils.get_embedding_model", return_value=StandInModel())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_embeddings_are_in_the_order_of_the_chunks(self) -> None:
+        chunks = ["bb", "a", "dddd", "ccc"]
+        embeddings = embed_chunks(chunks, batch_size=2)
+        self.assertEqual(embeddings[:, 0].tolist(), [2, 1, 4, 3])
+
+    def test_empty_batch(self) -> None:
+        embeddings = embed_chunks([])
+        self.assertEqual(embeddings.shape, (0, 3))
+        self.assertEqual(embeddings.dtype, np.float32)
+
+
+if __name__ == "__main__":
+    unittest.main()
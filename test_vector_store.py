@@ -0,0 +1,255 @@
+"""
+Tests for NumpyVectorStore in vector_store.py and for the distances ChromaDB reports, searching
+with embeddings directly or with cached query embeddings so the embedding model isn't needed.
+
+    python -m unittest test_vector_store
+"""
+
+# Standard imports
+import os
+import io
+import tempfile
+import unittest
+import contextlib
+from pathlib import Path
+from unittest import mock
+
+# Internal imports
+import vector_store
+from cache import QueryEmbeddingCache
+from chroma import ChromaDB
+from vector_store import NumpyVectorStore, VectorStore
+
+# External imports
+import numpy as np
+
+
+def clustered_sections(sections: int, chunks: int, dimensions: int, seed: int) -> list:
+    """
+    Returns sections of embeddings drawn around a few centres, so many chunks are close
+    together like real ones, as (title, {"embeddings", "texts"}).
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((8, dimensions)).astype(np.float32)
+    return [
+        (
+            f"Section {s}",
+            {
+                "embeddings": centres[rng.integers(0, len(centres), chunks)]
+                + 0.5 * rng.standard_normal((chunks, dimensions), dtype=np.float32),
+                "texts": [f"chunk {i} of section {s}" for i in range(chunks)],
+            },
+        )
+        for s in range(sections)
+    ]
+
+
+class NumpyVectorStoreTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = Path(tmp.name)
+        self.sections = clustered_sections(40, 50, 64, seed=0)
+        rng = np.random.default_rng(1)
+        self.queries = np.concatenate(
+            [e["embeddings"][:5] for _, e in self.sections[::4]]
+        ) + 0.5 * rng.standard_normal((50, 64), dtype=np.float32)
+
+    def store(self, name: str, quantization=None, rescore: int = 4):
+        """
+        Opens the store saved under name, without printing.
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            return NumpyVectorStore(
+                self.folder / name,
+                QueryEmbeddingCache(),
+                quantization=quantization,
+                rescore=rescore,
+            )
+
+    def test_quantized_top_k_matches_float32(self) -> None:
+        n_results = 7
+        exact = self.store("exact")
+        exact.add_sections(self.sections)
+        expected = exact.top_k(self.queries, n_results)
+        for quantization in ["int8", "float16"]:
+            with self.subTest(quantization=quantization):
+                store = self.store(quantization, quantization)
+                store.add_sections(self.sections)
+                self.assertIsNotNone(store.codes)
+                self.assertIsInstance(store.embeddings, np.memmap)
+                self.assertLess(store.memory_bytes, exact.memory_bytes / 1.9)
+
+                results = store.top_k(self.queries, n_results)
+                for found, wanted in zip(results, expected):
+                    # Rescored with the full precision embeddings, the scores are exact
+                    self.assertEqual(
+                        [row for row, _ in found], [row for row, _ in wanted]
+                    )
+                    np.testing.assert_allclose(
+                        [score for _, score in found],
+                        [score for _, score in wanted],
+                        rtol=1e-5,
+                    )
+
+    def test_quantized_store_reloads(self) -> None:
+        store = self.store("index", "int8")
+        store.add_sections(self.sections[:20])
+        expected = store.top_k(self.queries, 5)
+        codes = store.codes.copy()
+
+        loaded = self.store("index", "int8")
+        np.testing.assert_array_equal(loaded.codes, codes)
+        self.assertEqual(loaded.top_k(self.queries, 5), expected)
+        # Opened with another quantization, the codes are rebuilt
+        loaded = self.store("index", "float16")
+        self.assertEqual(loaded.codes.dtype, np.float16)
+        self.assertEqual(loaded.top_k(self.queries, 5), expected)
+        loaded = self.store("index")
+        self.assertIsNone(loaded.codes)
+        self.assertEqual(loaded.data_version, store.data_version)
+
+    def test_save_is_atomic(self) -> None:
+        """
+        Stops a save at every file it replaces or deletes: reopening gives the old index or the new one.
+        """
+        replace, unlink = os.replace, Path.unlink
+        for quantization in [None, "int8"]:
+            reference = self.store(f"{quantization}_reference", quantization)
+            reference.add_sections(self.sections[:10])
+            reference.add_sections(self.sections[10:20])
+            new = (reference.data_version, reference.top_k(self.queries, 5))
+            step = 0
+            while True:
+                name = f"{quantization}_{step}"
+                store = self.store(name, quantization)
+                store.add_sections(self.sections[:10])
+                old = (store.data_version, store.top_k(self.queries, 5))
+                calls = []
+
+                def crash(original):
+                    def wrapper(*args, **kwargs):
+                        calls.append(original)
+                        if len(calls) > step:
+                            raise KeyboardInterrupt
+                        return original(*args, **kwargs)
+
+                    return wrapper
+
+                with mock.patch.object(
+                    vector_store.os, "replace", crash(replace)
+                ), mock.patch.object(Path, "unlink", crash(unlink)):
+                    try:
+                        store.add_sections(self.sections[10:20])
+                        finished = True
+                    except KeyboardInterrupt:
+                        finished = False
+
+                with self.subTest(quantization=quantization, step=step):
+                    loaded = self.store(name, quantization)
+                    reopened = (loaded.data_version, loaded.top_k(self.queries, 5))
+                    self.assertIn(reopened, [old, new])
+                    if finished:
+                        self.assertEqual(reopened, new)
+                    if quantization is not None:
+                        self.assertIsNotNone(loaded.codes)
+                if finished:
+                    break
+                step += 1
+            self.assertGreater(step, 2)
+
+    def test_drop_and_add_sections(self) -> None:
+        store = self.store("index", "int8")
+        store.add_sections(self.sections[:10])
+        getattr(store, "_NumpyVectorStore__drop_titles")(["Section 0", "Section 3"])
+        self.assertEqual(len(store), 8 * 50)
+        self.assertNotIn("Section 0", store.titles)
+        store.add_sections(self.sections[:1])
+        loaded = self.store("index", "int8")
+        self.assertEqual(loaded.titles, store.titles)
+        self.assertEqual(loaded.ids, store.ids)
+        self.assertEqual(loaded.top_k(self.queries, 5), store.top_k(self.queries, 5))
+        # Only the current matrix is left on disk
+        matrices = [
+            p.name for p in self.folder.glob("index.*.npy") if p.name[6].isdigit()
+        ]
+        self.assertEqual(len(matrices), 1)
+
+
+class StandInHandler:
+    """
+    DataHandler without a manifest, yielding the given sections.
+    """
+
+    manifest = None
+
+    def __init__(self, sections: list) -> None:
+        self.sections = sections
+
+    def load_vectorized_data(self, pending_only: bool = False, num_workers: int = 1):
+        yield from self.sections
+
+
+class SearchManyDistanceTest(unittest.TestCase):
+    """
+    Every backend reports the cosine distance of the unit length embeddings in search_many.
+    """
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.folder = Path(tmp.name)
+        self.sections = clustered_sections(10, 20, 32, seed=2)
+        for _, section in self.sections:
+            section["embeddings"] /= np.linalg.norm(
+                section["embeddings"], axis=1, keepdims=True
+            )
+        self.embeddings = {
+            f"chunk {i} of {title.lower()}": embedding
+            for title, section in self.sections
+            for i, embedding in enumerate(section["embeddings"])
+        }
+
+        # Queries are cached, so searching never runs the model
+        rng = np.random.default_rng(3)
+        self.query_cache = QueryEmbeddingCache()
+        self.queries = {}
+        for query in ["chunk 3 of section 7", "chunk 11 of section 2", "adrenal"]:
+            embedding = rng.standard_normal(32).astype(np.float32)
+            embedding /= np.linalg.norm(embedding)
+            self.queries[query] = self.query_cache.put(query, embedding)
+
+    def assertCosineDistances(self, store) -> None:
+        results = store.search_many(list(self.queries), 8)
+        for (query, embedding), found in zip(self.queries.items(), results):
+            self.assertTrue(found)
+            for text, distance in found.values():
+                expected = 1.0 - float(self.embeddings[text.lower()] @ embedding)
+                self.assertAlmostEqual(distance, expected, places=4)
+
+    def test_numpy_store(self) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store = NumpyVectorStore(self.folder / "index", self.query_cache)
+        store.add_sections(self.sections)
+        self.assertCosineDistances(store)
+
+    def test_chroma(self) -> None:
+        for hybrid in [False, True]:
+            with self.subTest(hybrid=hybrid), contextlib.redirect_stdout(
+                io.StringIO()
+            ), contextlib.redirect_stderr(io.StringIO()):
+                store = ChromaDB(
+                    persist_directory=str(self.folder / f"chroma_{hybrid}"),
+                    query_cache=self.query_cache,
+                    hybrid=hybrid,
+                )
+                store.add_data(StandInHandler(self.sections))
+                self.assertCosineDistances(store)
+
+    def test_base_class_is_abstract(self) -> None:
+        with self.assertRaises(TypeError):
+            VectorStore(self.query_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+"""
+File that contains an append-only store for the text of the embedded chunks.
+
+The vector DB only keeps where a chunk's text is in the store, as an (offset, length) pair, instead of
+the (compressed) text itself, so the database stays small and a search hit is read with a slice of a
+memory-mapped file instead of being decoded and decompressed.
+
+The store is made of:
+- <path>.bin: the texts, either as raw UTF-8 or as zlib-compressed blocks each preceded by a small header
+- <path>.meta.json: the compression used and how many bytes are valid
+- <path>.zdict: the shared compression dictionary, when compressed
+
+With compression, texts are packed into blocks of about block_size bytes that are compressed on their
+own, so reading a chunk only decompresses its block. Every block is compressed with the same zlib
+dictionary (built from the first texts added), which makes small blocks compress almost as well as
+the whole file would. Offsets and lengths always refer to the uncompressed texts.
+"""
+
+# Standard imports
+import os
+import json
+import mmap
+import zlib
+import bisect
+import struct
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# Internal imports
+from const import PATH_TO_TEXT_STORE
+from config import TEXT_STORE_COMPRESSION, TEXT_STORE_BLOCK_SIZE
+
+ZDICT_SIZE = 32 * 1024  # zlib only uses the last 32KB of a dictionary
+BLOCK_CACHE_SIZE = 64  # Decompressed blocks kept for reads that hit the same block
+# Written before every compressed block: its uncompressed start and its compressed length
+BLOCK_HEADER = struct.Struct("<QQ")
+
+
+class TextStore:
+    """
+    Class for an append-only, memory-mapped store of chunk texts.
+
+    Texts are buffered by append and written to disk by flush, which must be called before the
+    offsets are stored anywhere else (e.g. in the vector DB).
+
+    Attributes:
+    - path: Path, path of the store files without extension
+    - compression: str, None for raw UTF-8 or "zlib" for compressed blocks
+    - block_size: int, uncompressed size a block is filled to before it is compressed
+    - size: int, number of uncompressed bytes appended so far
+    """
+
+    def __init__(
+        self,
+        path: Path = Path(PATH_TO_TEXT_STORE),
+        compression: Optional[str] = TEXT_STORE_COMPRESSION,
+        block_size: int = TEXT_STORE_BLOCK_SIZE,
+    ) -> None:
+        if not isinstance(path, Path):
+            raise ValueError("Text store path must be a Path object.")
+        if compression not in [None, "zlib"]:
+            raise ValueError(f"Unknown text store compression {compression}.")
+        self.path = path
+        self.compression = compression
+        self.block_size = block_size
+        self.size = 0
+
+        self.__zdict = None
+        # Every block as (uncompressed start, offset in the file, compressed length)
+        self.__blocks = []
+        self.__block_starts = []
+        self.__file_size = 0  # Bytes of the .bin file that are valid
+        self.__pending = bytearray()  # Appended but not written yet
+        self.__pending_start = 0  # Uncompressed offset of the first pending byte
+        self.__map = None
+        self.__block_cache = OrderedDict()
+        self.__lock = threading.Lock()
+
+        if self.__meta_path.exists():
+            self.__load()
+
+    @property
+    def __bin_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".bin")
+
+    @property
+    def __meta_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".meta.json")
+
+    @property
+    def __zdict_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".zdict")
+
+    def append(self, text: str) -> Tuple[int, int]:
+        """
+        Function that appends a text to the store.
+
+        Parameters:
+        - text: str, the text to append
+
+        Returns:
+        - tuple in the format (offset, length), where the text can be read from once flushed
+        """
+        data = text.encode("utf-8")
+        with self.__lock:
+            offset = self.size
+            self.__pending += data
+            self.size += len(data)
+            if self.compression == "zlib" and len(self.__pending) >= self.block_size:
+                self.__write_pending()
+        return offset, len(data)
+
+    def append_many(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """
+        Function that appends many texts to the store.
+
+        Parameters:
+        - texts: list[str], the texts to append
+
+        Returns:
+        - list of tuples in the format (offset, length)
+        """
+        return [self.append(text) for text in texts]
+
+    def flush(self) -> None:
+        """
+        Function that writes the buffered texts to disk, so the offsets handed out can be stored.
+        """
+        with self.__lock:
+            self.__write_pending()
+            self.__save_meta()
+
+    def get(self, offset: int, length: int) -> str:
+        """
+        Function that reads a text from the store.
+
+        Parameters:
+        - offset: int, offset returned by append
+        - length: int, length returned by append
+
+        Returns:
+        - str, the text
+        """
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise ValueError(f"Text at {offset}:{offset + length} is not in the store.")
+        with self.__lock:
+            if offset >= self.__pending_start:
+                # Not written yet, so read it from the buffer
+                start = offset - self.__pending_start
+                return self.__pending[start : start + length].decode("utf-8")
+            if self.compression is None:
+                # Decoded straight from the mapped pages, without copying the bytes first
+                view = memoryview(self.__mapped())[offset : offset + length]
+                try:
+                    return str(view, "utf-8")
+                finally:
+                    view.release()
+
+            # Blocks are only cut between texts, so a text is always in one block
+            i = bisect.bisect_right(self.__block_starts, offset) - 1
+            start = offset - self.__block_starts[i]
+            block = self.__decompressed_block(i)
+            return block[start : start + length].decode("utf-8")
+
+    def __decompressed_block(self, i: int) -> bytes:
+        """
+        Helper function that decompresses a block, keeping the most recently used ones.
+        """
+        block = self.__block_cache.get(i)
+        if block is None:
+            _, file_offset, compressed_length = self.__blocks[i]
+            decompressor = zlib.decompressobj(zdict=self.__zdict)
+            block = decompressor.decompress(
+                self.__mapped()[file_offset : file_offset + compressed_length]
+            )
+            self.__block_cache[i] = block
+            while len(self.__block_cache) > BLOCK_CACHE_SIZE:
+                self.__block_cache.popitem(last=False)
+        self.__block_cache.move_to_end(i)
+        return block
+
+    def __mapped(self) -> mmap.mmap:
+        """
+        Helper function that memory-maps the .bin file, mapping it again if it grew.
+        """
+        if self.__map is None or len(self.__map) < self.__file_size:
+            if self.__map is not None:
+                self.__map.close()
+            with open(self.__bin_path, "rb") as f:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.__map
+
+    def __write_pending(self) -> None:
+        """
+        Helper function that appends the buffered texts to the .bin file (as one block if compressed).
+        """
+        if not self.__pending:
+            return
+        data = bytes(self.__pending)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.compression == "zlib":
+            if self.__zdict is None:
+                # The first texts are a sample of what the rest will look like
+                self.__zdict = data[:ZDICT_SIZE]
+                with open(self.__zdict_path, "wb") as f:
+                    f.write(self.__zdict)
+            compressor = zlib.compressobj(level=9, zdict=self.__zdict)
+            compressed = compressor.compress(data) + compressor.flush()
+            header = BLOCK_HEADER.pack(self.__pending_start, len(compressed))
+            self.__blocks.append(
+                (self.__pending_start, self.__file_size + len(header), len(compressed))
+            )
+            self.__block_starts.append(self.__pending_start)
+            data = header + compressed
+
+        with open(self.__bin_path, "r+b" if self.__bin_path.exists() else "wb") as f:
+            # Drop anything a crashed run wrote after the last flush
+            f.truncate(self.__file_size)
+            f.seek(self.__file_size)
+            f.write(data)
+        self.__file_size += len(data)
+        self.__pending = bytearray()
+        self.__pending_start = self.size
+
+    def __save_meta(self) -> None:
+        """
+        Helper function that saves the metadata atomically.
+        """
+        tmp_path = self.path.with_name(self.path.name + ".meta.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "compression": self.compression,
+                    "block_size": self.block_size,
+                    "size": self.size,
+                    "file_size": self.__file_size,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.__meta_path)
+
+    def __load(self) -> None:
+        """
+        Helper function that loads an existing store.
+        The compression it was written with wins over the one asked for.
+        """
+        with open(self.__meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.compression = meta["compression"]
+        self.block_size = meta["block_size"]
+        self.size = meta["size"]
+        self.__file_size = meta["file_size"]
+        self.__pending_start = self.size
+
+        if self.compression == "zlib" and self.__file_size > 0:
+            with open(self.__zdict_path, "rb") as f:
+                self.__zdict = f.read()
+            # Walk the block headers to find where every block is
+            mapped = self.__mapped()
+            position = 0
+            while position < self.__file_size:
+                start, length = BLOCK_HEADER.unpack_from(mapped, position)
+                position += BLOCK_HEADER.size
+                self.__blocks.append((start, position, length))
+                self.__block_starts.append(start)
+                position += length
+
+    def close(self) -> None:
+        """
+        Function that flushes the store and unmaps the file.
+        """
+        self.flush()
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
@@ -4,22 +4,107 @@ These are not specific to a certain operation and used in multiple places.
 
 Namely:
 - embedding text: used to embed text from queries as well as data
+- chunking text: used to split documents into pieces the embedding model can read whole
 - decoding text: used to decode embeddings to text
 """
 
 # Standard imports
 import re
-from typing import Tuple
+import warnings
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 
 # Internal imports
-from config import EMBEDDING_MODEL
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    CHUNKER,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+)
 
 # External imports
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-# Set up the embedding model
-embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+# The embedding model is only loaded the first time something is embedded,
+# importing sentence_transformers pulls in torch which takes seconds
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+# The tokenizer alone only needs transformers, so chunking doesn't have to load the model
+_tokenizer = None
+
+
+def get_embedding_model(threads: Optional[int] = None):
+    """
+    Function that returns the embedding model, loading it on first use.
+
+    The model is resolved from the local Hugging Face cache first so loading it does not make
+    any network requests. It is only downloaded if it has never been cached.
+    With EMBEDDING_BACKEND = "onnx" the model is run by onnxruntime instead of PyTorch.
+
+    Parameters:
+    - threads: int, threads the model runs on, only used when it is loaded (default: the library's)
+
+    Returns:
+    - SentenceTransformer or OnnxEmbeddingModel, the embedding model
+    """
+    global _embedding_model
+    with _embedding_model_lock:
+        if _embedding_model is None and EMBEDDING_BACKEND == "onnx":
+            from onnx_embedding import OnnxEmbeddingModel
+
+            if threads is None:
+                _embedding_model = OnnxEmbeddingModel()
+            else:
+                _embedding_model = OnnxEmbeddingModel(threads=threads)
+        elif _embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+
+            try:
+                _embedding_model = SentenceTransformer(
+                    EMBEDDING_MODEL, local_files_only=True
+                )
+            except (OSError, ValueError):
+                print(f"{EMBEDDING_MODEL} is not cached yet. Downloading...")
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+            if threads is not None:
+                import torch
+
+                torch.set_num_threads(threads)
+    return _embedding_model
+
+
+def get_tokenizer():
+    """
+    Function that returns the embedding model's tokenizer, loading it on first use.
+
+    If the PyTorch embedding model is already loaded its tokenizer is used, otherwise only the
+    tokenizer is loaded (from the local Hugging Face cache first, like the model). The ONNX model's
+    tokenizer is a tokenizers.Tokenizer, which doesn't take the arguments chunking passes.
+
+    Returns:
+    - the Hugging Face tokenizer of the embedding model
+    """
+    global _tokenizer
+    with _embedding_model_lock:
+        if _tokenizer is None:
+            if _embedding_model is not None and EMBEDDING_BACKEND != "onnx":
+                _tokenizer = _embedding_model.tokenizer
+            else:
+                from transformers import AutoTokenizer
+
+                try:
+                    _tokenizer = AutoTokenizer.from_pretrained(
+                        EMBEDDING_MODEL, local_files_only=True
+                    )
+                except (OSError, ValueError):
+                    print(
+                        f"{EMBEDDING_MODEL} tokenizer is not cached yet. Downloading..."
+                    )
+                    _tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    return _tokenizer
 
 
 # Using this and word length for speed's sake
@@ -38,43 +123,294 @@ def embed_text_no_chunk(text: str) -> np.array:
     - np.array, embedding of the text
     """
     # We can use the embedding model to encode the text
-    return embedding_model.encode(text)
+    return get_embedding_model().encode(text)
 
 
-def embed_text(text: str, max_chunk_size: int = 256) -> Tuple[np.ndarray, list[str]]:
+def chunk_text(text: str, max_chunk_size: int = 256) -> List[str]:
     """
-    Function that embeds text by chunking if necessary.
+    Function that splits text into chunks of whole sentences, measured in whitespace separated words.
+    This is how the original vectorized data was chunked, chunk_text_tokens matches the model better.
 
     Parameters:
-    - text: str, text to embed
-    - max_chunk_size: int, maximum number of tokens per chunk
+    - text: str, text to chunk
+    - max_chunk_size: int, maximum number of words per chunk
 
     Returns:
-    - Tuple: (np.array of embeddings, list of corresponding chunks)
+    - list[str], the chunks in document order
     """
     sentences = sentence_splitter(text)
     chunks = []  # A list of all chunks
     current_chunk = []  # A list of sentences in the current chunk
+    current_words = 0  # Number of words in the current chunk, kept as we go
 
     # Go through the sentences and add them to the current chunk
     for sentence in sentences:
-        current_chunk.append(sentence)
-        # Until the current chunk is too big, then we remove the last sentence and append the current chunk to the list of chunks
-        if len(" ".join(current_chunk).split()) > max_chunk_size:
-            # Remove last sentence if it exceeds limit
-            current_chunk.pop()
+        words = len(sentence.split())
+        # Until the current chunk would be too big, then we append the current chunk to the list of chunks
+        if current_chunk and current_words + words > max_chunk_size:
             chunks.append(" ".join(current_chunk))
-            current_chunk = [sentence]  # Now start a new chunk with the last sentence
+            current_chunk = []  # Now start a new chunk with this sentence
+            current_words = 0
+        current_chunk.append(sentence)
+        current_words += words
 
     # Add the last chunk if it exists
     # If the last chunk is empty, then we don't need to add it to the list of chunks
     if current_chunk:
         chunks.append(" ".join(current_chunk))
 
-    # Now we have a list of chunks, let's embed them
-    # We can use the embedding model to encode the chunks
-    embeddings = [embedding_model.encode(chunk) for chunk in chunks]
+    return chunks
+
+
+def chunk_text_tokens(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    tokenizer=None,
+) -> List[str]:
+    """
+    Function that splits text into chunks of whole sentences, measured in the embedding model's tokens
+    so no chunk is cut off when it is embedded.
+
+    Every sentence is tokenized once and the size of the current chunk is kept as a running total,
+    so the time taken is linear in the length of the text. Sentences longer than a chunk are split
+    at token boundaries. Consecutive chunks can share their last/first sentences for context.
+
+    Parameters:
+    - text: str, text to chunk
+    - max_tokens: int, maximum number of tokens per chunk, including the model's special tokens
+    - overlap_tokens: int, maximum number of tokens of whole sentences repeated from the previous chunk
+    - tokenizer: Hugging Face tokenizer to count with (defaults to the embedding model's)
+
+    Returns:
+    - list[str], the chunks in document order
+    """
+    if tokenizer is None:
+        tokenizer = get_tokenizer()
+    # The model adds [CLS] and [SEP] to every chunk
+    budget = max_tokens - (
+        tokenizer.num_special_tokens_to_add()
+        if hasattr(tokenizer, "num_special_tokens_to_add")
+        else 2
+    )
+    if budget < 1:
+        raise ValueError("max_tokens is too small to hold any text.")
+
+    sentences = [s for s in sentence_splitter(text) if s]
+    if not sentences:
+        return []
+
+    # Tokenize every sentence in one batch, then split the ones that don't fit in a chunk
+    pieces = []  # (text, number of tokens)
+    counts = tokenizer(sentences, add_special_tokens=False)["input_ids"]
+    for sentence, ids in zip(sentences, counts):
+        if len(ids) <= budget:
+            pieces.append((sentence, len(ids)))
+        else:
+            pieces.extend(_split_long_sentence(sentence, budget, tokenizer))
+
+    chunks = []
+    current = deque()  # Pieces in the current chunk
+    current_tokens = 0
+    for piece, tokens in pieces:
+        if current and current_tokens + tokens > budget:
+            chunks.append(" ".join(p for p, _ in current))
+            # Start the next chunk with the last sentences of this one, as long as they fit
+            carried = deque()
+            carried_tokens = 0
+            while (
+                current
+                and carried_tokens + current[-1][1] <= overlap_tokens
+                and carried_tokens + current[-1][1] + tokens <= budget
+            ):
+                carried_tokens += current[-1][1]
+                carried.appendleft(current.pop())
+            current, current_tokens = carried, carried_tokens
+        current.append((piece, tokens))
+        current_tokens += tokens
+
+    if current:
+        chunks.append(" ".join(p for p, _ in current))
+    return chunks
+
+
+def _split_long_sentence(
+    sentence: str, budget: int, tokenizer
+) -> List[Tuple[str, int]]:
+    """
+    Helper function that splits a sentence longer than a chunk into pieces of at most budget tokens,
+    cutting before tokens that start a word using the tokenizer's character offsets. A piece cut
+    inside a word can tokenize to more tokens than it was cut from, so every piece is counted again
+    and cut shorter if it doesn't fit (e.g. a single word longer than a chunk).
+    """
+    offsets = tokenizer(
+        sentence, add_special_tokens=False, return_offsets_mapping=True
+    )["offset_mapping"]
+    pieces = []
+    start = 0
+    while start < len(offsets):
+        end = min(start + budget, len(offsets))
+        if end < len(offsets):
+            # Back off to the last token of the window with whitespace before it
+            end = next(
+                (i for i in range(end, start, -1) if offsets[i][0] > offsets[i - 1][1]),
+                end,
+            )
+        while True:
+            piece = sentence[offsets[start][0] : offsets[end - 1][1]].strip()
+            tokens = len(tokenizer(piece, add_special_tokens=False)["input_ids"])
+            if tokens <= budget or end - start == 1:
+                break
+            end = start + max(1, min(end - start - 1, (end - start) * budget // tokens))
+        if tokens > budget:
+            # A single token cut out of a word can be more on its own ("##plasia" as "plasia")
+            pieces.extend(_split_by_characters(piece, budget, tokenizer))
+        elif piece:
+            pieces.append((piece, tokens))
+        start = end
+    return pieces
+
+
+def _split_by_characters(text: str, budget: int, tokenizer) -> List[Tuple[str, int]]:
+    """
+    Helper function that splits text without whitespace into pieces of at most budget tokens,
+    cutting between characters.
+    """
+    pieces = []
+    start = 0
+    while start < len(text):
+        end = len(text)
+        while True:
+            tokens = len(
+                tokenizer(text[start:end], add_special_tokens=False)["input_ids"]
+            )
+            if tokens <= budget or end - start == 1:
+                break
+            end = start + max(1, min(end - start - 1, (end - start) * budget // tokens))
+        pieces.append((text[start:end], tokens))
+        start = end
+    return pieces
+
+
+def chunk(text: str) -> List[str]:
+    """
+    Function that chunks text with the chunker chosen by CHUNKER in config.py.
+
+    Parameters:
+    - text: str, text to chunk
+
+    Returns:
+    - list[str], the chunks in document order
+    """
+    if CHUNKER == "tokens":
+        return chunk_text_tokens(text)
+    if CHUNKER == "words":
+        return chunk_text(text)
+    raise ValueError(f"Unknown chunker {CHUNKER}.")
+
+
+def embed_chunks(
+    chunks: List[str], batch_size: int = EMBEDDING_BATCH_SIZE
+) -> np.ndarray:
+    """
+    Function that embeds a list of chunks in batches.
+
+    The chunks are sorted by length before encoding so that every batch holds chunks of
+    similar length and wastes as little padding as possible. The embeddings are returned
+    in the original order of the chunks.
+
+    Parameters:
+    - chunks: list[str], chunks to embed
+    - batch_size: int, number of chunks per forward pass of the model
+
+    Returns:
+    - np.array of shape (len(chunks), embedding_dim)
+    """
+    model = get_embedding_model()
+    if not chunks:
+        # encode gives a flat empty array, callers stack and concatenate the result
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    # Longest first so the first batch tells us early if we run out of memory
+    order = sorted(range(len(chunks)), key=lambda i: len(chunks[i]), reverse=True)
+    sorted_embeddings = model.encode(
+        [chunks[i] for i in order],
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+
+    # Put the embeddings back in the order of the chunks
+    embeddings = np.empty_like(sorted_embeddings)
+    embeddings[order] = sorted_embeddings
+    return embeddings
+
+
+def embed_text(
+    text: str, max_chunk_size: Optional[int] = None
+) -> Tuple[np.ndarray, list[str]]:
+    """
+    Function that embeds text by chunking if necessary.
+
+    Parameters:
+    - text: str, text to embed
+    - max_chunk_size: int, deprecated, chunks with chunk_text and this many words per chunk like before
+      the token chunker existed (default: the chunker chosen by CHUNKER in config.py)
+
+    Returns:
+    - Tuple: (np.array of embeddings, list of corresponding chunks)
+    """
+    if max_chunk_size is not None:
+        warnings.warn(
+            "embed_text's max_chunk_size is deprecated, set CHUNKER and CHUNK_MAX_TOKENS in config.py instead.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        chunks = chunk_text(text, max_chunk_size)
+    else:
+        chunks = chunk(text)
+    return embed_chunks(chunks), chunks  # Return the embeddings and the chunks
+
+
+def embed_texts(
+    texts: Dict[str, str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    pool=None,
+) -> Dict[str, Tuple[np.ndarray, list[str]]]:
+    """
+    Function that embeds many documents at once.
+
+    The chunks of every document are pooled together so the model sees large batches
+    regardless of how short the individual documents are, then the embeddings are mapped
+    back to the title they came from.
+
+    Parameters:
+    - texts: dict, titles mapped to the text to embed
+    - batch_size: int, number of chunks per forward pass of the model
+    - pool: EmbeddingPool, if given the chunks are embedded by its worker processes
+
+    Returns:
+    - dict: titles mapped to (np.array of embeddings, list of corresponding chunks)
+    """
+    titles = []  # Title of every document in the order they were chunked
+    all_chunks = []  # Chunks of every document one after the other
+    bounds = [0]  # Where each document's chunks start and end in all_chunks
+    for title, text in texts.items():
+        chunks = chunk(text)
+        titles.append(title)
+        all_chunks.extend(chunks)
+        bounds.append(len(all_chunks))
+
+    if pool is not None:
+        embeddings = pool.embed_chunks(all_chunks)
+    else:
+        embeddings = embed_chunks(all_chunks, batch_size=batch_size)
 
-    # Now we have a list of embeddings, let's stack them
-    # We can use np.vstack to stack the embeddings
-    return np.vstack(embeddings), chunks  # Return the embeddings and the chunks
+    # Slice the embeddings back out per document
+    return {
+        title: (
+            embeddings[bounds[i] : bounds[i + 1]],
+            all_chunks[bounds[i] : bounds[i + 1]],
+        )
+        for i, title in enumerate(titles)
+    }
@@ -0,0 +1,606 @@
+"""
+File that contains the vector stores the pipeline can retrieve context from.
+
+Namely:
+- VectorStore: base class with the add_data/search surface the pipeline and the server use
+- NumpyVectorStore: exact search over one contiguous float32 matrix held in memory
+- get_vector_store: creates the store chosen by VECTOR_STORE_BACKEND in config.py
+- chunk_id: the deterministic id of a chunk
+
+ChromaDB (chroma.py) and IVFPQVectorStore (ivf_pq.py) are the other backends.
+"""
+
+# Standard imports
+import os
+import json
+import hashlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Internal imports
+from utils import embed_chunks, embed_text_no_chunk
+from cache import QueryEmbeddingCache, normalize_query
+from const import PATH_TO_NUMPY_INDEX, PATH_TO_QUERY_CACHE
+from config import (
+    DEFAULT_RESULTS_PER_SEARCH,
+    QUERY_CACHE_PERSIST,
+    VECTOR_STORE_BACKEND,
+    NUMPY_INDEX_QUANTIZATION,
+    NUMPY_INDEX_RESCORE,
+)
+
+# External imports
+import numpy as np
+
+# Rows of quantized codes widened to float32 at a time when scoring, bounds the extra memory a search needs
+QUANTIZED_BLOCK_ROWS = 16384
+
+
+def chunk_id(title: str, ordinal: int, text: str) -> str:
+    """
+    Function that derives the id of a chunk from where it is and what it says, so loading the
+    same data again gives the same ids and a changed chunk gets a new one.
+
+    Parameters:
+    - title: str, title of the section the chunk comes from
+    - ordinal: int, position of the chunk in its section
+    - text: str, text of the chunk
+
+    Returns:
+    - str, hex id (never contains "_", which separates the id from the title in search results)
+    """
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    key = json.dumps([title, ordinal, text_hash])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class VectorStore(ABC):
+    """
+    Base class for a vector store holding the embedded chunks of the cleaned sections.
+
+    The embeddings are unit length, so every backend ranks chunks by cosine similarity and
+    search_many reports the cosine distance (1 - cosine similarity, 0 for the same direction,
+    at most 2) whatever the backend measures internally.
+
+    Attributes:
+    - query_cache: QueryEmbeddingCache, cache of query embeddings
+
+    Methods:
+    - embed_query: embeds a query, reusing the cached embedding if it was seen before
+    - embed_queries: embeds many queries, running the model once for all that are not cached
+    - add_data: adds the vectorized data of a DataHandler
+    - search: returns the chunks closest to a query as {"<chunk id>_<title>": text}
+    - search_many: searches for many queries at once, with the cosine distance of every chunk
+    - data_version: changes whenever the contents of the store change
+    - warm_up: reads the index into memory ahead of the first search
+    """
+
+    def __init__(self, query_cache: Optional[QueryEmbeddingCache] = None) -> None:
+        if query_cache is None:
+            query_cache = QueryEmbeddingCache(
+                persist_path=Path(PATH_TO_QUERY_CACHE) if QUERY_CACHE_PERSIST else None
+            )
+        self.query_cache = query_cache
+
+    def embed_query(self, search_str: str) -> np.ndarray:
+        """
+        Function that embeds a search string, reusing the cached embedding if the query was seen before.
+
+        Parameters:
+        - search_str: str, the string to embed
+
+        Returns:
+        - np.array, the (read-only) embedding of the string
+        """
+        return self.query_cache.get_or_embed(search_str, embed_text_no_chunk)
+
+    def embed_queries(self, search_strs: List[str]) -> np.ndarray:
+        """
+        Function that embeds many search strings, running the model in one batch for the ones not cached.
+
+        Parameters:
+        - search_strs: list[str], the strings to embed
+
+        Returns:
+        - np.array of shape (len(search_strs), embedding_dim)
+        """
+        embeddings = [self.query_cache.get(s) for s in search_strs]
+
+        # Queries that normalize to the same text are only embedded once
+        missing = {}
+        for s, embedding in zip(search_strs, embeddings):
+            if embedding is None:
+                missing.setdefault(normalize_query(s), s)
+        if missing:
+            texts = list(missing.values())
+            for s, embedding in zip(texts, embed_chunks(texts)):
+                missing[normalize_query(s)] = self.query_cache.put(s, embedding)
+
+        return np.stack(
+            [
+                embedding if embedding is not None else missing[normalize_query(s)]
+                for s, embedding in zip(search_strs, embeddings)
+            ]
+        )
+
+    @abstractmethod
+    def add_data(self, handler) -> None:
+        """
+        Function that adds the vectorized data of a DataHandler to the store.
+
+        Parameters:
+        - handler: DataHandler, handler to load the vectorized data from
+        """
+
+    @abstractmethod
+    def search(
+        self, search_str: str, n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> Dict[str, str]:
+        """
+        Function that searches the store for the chunks closest to a string.
+
+        Parameters:
+        - search_str: str, the string to search for
+        - n_results: int, the number of results to return
+
+        Returns:
+        - dict, "<chunk id>_<title>" mapped to the chunk's text, best match first
+        """
+
+    @abstractmethod
+    def search_many(
+        self, search_strs: List[str], n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> List[Dict[str, Tuple[str, float]]]:
+        """
+        Function that searches the store for many strings at once.
+
+        Parameters:
+        - search_strs: list[str], the strings to search for
+        - n_results: int, the number of results to return per string
+
+        Returns:
+        - list with, for every string, "<chunk id>_<title>" mapped to (text, cosine distance), best match first
+        """
+
+    @property
+    @abstractmethod
+    def data_version(self) -> str:
+        """
+        String that changes whenever the contents of the store change.
+        """
+
+    def warm_up(self) -> None:
+        """
+        Function that runs a search for a stored embedding, so the first real search doesn't pay for
+        reading the index from disk. Nothing is embedded, so the embedding model isn't needed.
+        """
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Class for an exact (flat) vector index kept in memory as one normalized float32 matrix.
+
+    A search is a single matrix-vector product (run by BLAS) followed by an argpartition
+    for the top k, so there is no graph to traverse and no metadata database to query.
+    The index is saved next to the Chroma DB as <path>.<version>.npy (the matrix) and
+    <path>.meta.json (chunk ids, titles, texts, the data version and the name of the matrix).
+    A save writes a new matrix and then replaces the metadata, so the files on disk always
+    hold either the old index or the new one.
+
+    With quantization, only compact codes of the embeddings are held in memory: int8 with a
+    scale per dimension (4x smaller) or float16 (2x smaller). The first pass scores every
+    chunk on the codes, then the best rescore * n_results candidates are scored again with
+    the full precision embeddings, which stay on disk (memory-mapped) for that. The codes
+    are saved as <path>.codes.npy and <path>.scale.npy.
+
+    Attributes:
+    - path: Path, path of the index files without extension
+    - quantization: str, None (float32 in memory), "int8" or "float16"
+    - rescore: int, candidates rescored with full precision per result asked for, when quantized
+    - embeddings: np.array, (number of chunks, dimensions) normalized embeddings (memory-mapped when quantized)
+    - codes: np.array, quantized embeddings (None without quantization)
+    - scale: np.array, per dimension scale of int8 codes
+    - ids: list[str], id of every chunk
+    - titles: list[str], title of the section every chunk comes from
+    - texts: list[str], text of every chunk
+    """
+
+    def __init__(
+        self,
+        path: Path = Path(PATH_TO_NUMPY_INDEX),
+        query_cache: Optional[QueryEmbeddingCache] = None,
+        quantization: Optional[str] = NUMPY_INDEX_QUANTIZATION,
+        rescore: int = NUMPY_INDEX_RESCORE,
+    ) -> None:
+        super().__init__(query_cache)
+        if not isinstance(path, Path):
+            raise ValueError("Index path must be a Path object.")
+        if quantization not in [None, "int8", "float16"]:
+            raise ValueError(f"Unknown quantization {quantization}.")
+        if rescore < 1:
+            raise ValueError("rescore must be at least 1.")
+        self.path = path
+        self.quantization = quantization
+        self.rescore = rescore
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.codes = None
+        self.scale = None
+        self.ids = []
+        self.titles = []
+        self.texts = []
+        self.__version = 0
+        self.__matrix_name = self.path.name + ".npy"
+
+        if self.__meta_path.exists():
+            self.__load()
+            print(f"Numpy index '{self.path}' loaded with {len(self)} chunks.")
+        else:
+            print(f"Numpy index '{self.path}' created.")
+
+    @property
+    def __matrix_path(self) -> Path:
+        return self.path.with_name(self.__matrix_name)
+
+    @property
+    def __meta_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".meta.json")
+
+    @property
+    def __codes_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".codes.npy")
+
+    @property
+    def __scale_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".scale.npy")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Bytes of embeddings held in memory for the first search pass (texts and ids not included).
+        """
+        if self.codes is not None:
+            return self.codes.nbytes + self.scale.nbytes
+        return self.embeddings.nbytes
+
+    @property
+    def data_version(self) -> str:
+        """
+        Version of the index's contents, changes whenever data is added or removed.
+        """
+        return f"{self.__version}:{len(self)}"
+
+    def add_data(self, handler) -> None:
+        """
+        Function that adds the vectorized data of a DataHandler to the index and saves it.
+
+        Without a manifest the data is only added if the index is empty. With one, only
+        sections that were not loaded yet are added and removed or modified sections are
+        dropped first (everything is loaded if the index is empty, e.g. it was deleted).
+
+        Parameters:
+        - handler: DataHandler, handler to load the vectorized data from
+        """
+        manifest = handler.manifest
+        if manifest is None:
+            if len(self) > 0:
+                print("Index already populated. Skipping data addition.")
+                return
+        elif len(self) > 0:
+            stale_titles = manifest.removed_titles | manifest.pending_index()
+            if not stale_titles:
+                print("Index is up to date. Skipping data addition.")
+                return
+            self.__drop_titles(stale_titles)
+
+        pending_only = manifest is not None and len(self) > 0
+        added_titles = self.add_sections(
+            handler.load_vectorized_data(pending_only=pending_only)
+        )
+
+        if manifest is not None:
+            manifest.mark_indexed(added_titles)
+            manifest.clear_removed()
+            manifest.save()
+
+    def add_sections(self, sections: Iterable[Tuple[str, dict]]) -> list:
+        """
+        Function that appends sections to the index and saves it.
+
+        Parameters:
+        - sections: iterable of (title, {"embeddings": np.array, "texts": list of chunks})
+
+        Returns:
+        - list[str], the titles that were added
+        """
+        blocks = [self.embeddings] if len(self) > 0 else []
+        added_titles = []
+        for title, emb_and_text in sections:
+            embeddings = np.asarray(emb_and_text["embeddings"], dtype=np.float32)
+            if len(embeddings) == 0:
+                continue
+            blocks.append(self.__normalize(embeddings))
+            self.ids.extend(
+                chunk_id(title, i, text) for i, text in enumerate(emb_and_text["texts"])
+            )
+            self.titles.extend([title] * len(embeddings))
+            self.texts.extend(emb_and_text["texts"])
+            added_titles.append(title)
+
+        if added_titles:
+            # Grown once so adding many sections doesn't copy the matrix every time
+            self.embeddings = np.ascontiguousarray(np.concatenate(blocks))
+            self.__version += 1
+            self.save()
+        return added_titles
+
+    def __normalize(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Helper function that scales rows to unit length so a dot product is the cosine similarity.
+        """
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def __drop_titles(self, titles: Iterable[str]) -> None:
+        """
+        Helper function that removes every chunk of the given sections.
+        """
+        titles = set(titles)
+        keep = np.array([title not in titles for title in self.titles], dtype=bool)
+        if keep.all():
+            return
+        self.embeddings = np.ascontiguousarray(self.embeddings[keep])
+        self.ids = [v for v, k in zip(self.ids, keep) if k]
+        self.titles = [v for v, k in zip(self.titles, keep) if k]
+        self.texts = [v for v, k in zip(self.texts, keep) if k]
+        self.__version += 1
+        self.save()
+
+    def top_k(
+        self, queries: np.ndarray, n_results: int
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Function that finds the rows closest to each of a batch of query embeddings.
+
+        Parameters:
+        - queries: np.array of shape (number of queries, dimensions)
+        - n_results: int, number of rows to return per query
+
+        Returns:
+        - list with, for every query, tuples in the format (row, cosine similarity), best first
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if len(self) == 0:
+            return [[] for _ in queries]
+        queries = self.__normalize(queries)
+        if self.codes is not None:
+            return self.__top_k_quantized(queries, n_results)
+
+        # One matrix-matrix product scores every query, BLAS is much faster on those
+        scores = queries @ self.embeddings.T
+        k = min(n_results, scores.shape[1])
+        # argpartition finds the top k in linear time, only those k get sorted
+        rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, rows, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(q_rows, q_scores)]
+            for q_rows, q_scores in zip(rows, top_scores)
+        ]
+
+    def __top_k_quantized(
+        self, queries: np.ndarray, n_results: int
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Helper function that finds candidates on the quantized codes and rescores them with full precision.
+        """
+        # Folding the int8 scale into the query makes code @ query the approximate dot product
+        scaled = queries * self.scale if self.quantization == "int8" else queries
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), QUANTIZED_BLOCK_ROWS):
+            block = self.codes[start : start + QUANTIZED_BLOCK_ROWS].astype(np.float32)
+            scores[:, start : start + len(block)] = scaled @ block.T
+
+        n_candidates = min(n_results * self.rescore, len(self))
+        candidates = np.argpartition(-scores, n_candidates - 1, axis=1)[
+            :, :n_candidates
+        ]
+
+        results = []
+        for query, rows in zip(queries, candidates):
+            # Sorted so the rows are read from disk in order
+            rows = np.sort(rows)
+            exact = self.embeddings[rows] @ query
+            best = np.argsort(-exact)[:n_results]
+            results.append([(int(rows[i]), float(exact[i])) for i in best])
+        return results
+
+    def warm_up(self) -> None:
+        """
+        Function that runs a search for a stored embedding, so the first real search doesn't pay for
+        reading the index from disk.
+        """
+        if len(self) > 0:
+            self.top_k(self.embeddings[0], 1)
+
+    def search(
+        self, search_str: str, n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> Dict[str, str]:
+        """
+        Function that searches the index for the chunks closest to a string.
+
+        Parameters:
+        - search_str: str, the string to search for
+        - n_results: int, the number of results to return
+
+        Returns:
+        - dict, "<chunk id>_<title>" mapped to the chunk's text, best match first
+        """
+        if not search_str or not isinstance(search_str, str):
+            raise ValueError("Search string must be a non-empty string.")
+
+        return {
+            f"{self.ids[row]}_{self.titles[row]}": self.texts[row]
+            for row, _ in self.top_k(self.embed_query(search_str), n_results)[0]
+        }
+
+    def search_many(
+        self, search_strs: List[str], n_results: int = DEFAULT_RESULTS_PER_SEARCH
+    ) -> List[Dict[str, Tuple[str, float]]]:
+        """
+        Function that searches the index for many strings with one batched embedding and one matrix product.
+
+        Parameters:
+        - search_strs: list[str], the strings to search for
+        - n_results: int, the number of results to return per string
+
+        Returns:
+        - list with, for every string, "<chunk id>_<title>" mapped to (text, cosine distance), best match first
+        """
+        if not search_strs or not all(s and isinstance(s, str) for s in search_strs):
+            raise ValueError("Search strings must be non-empty strings.")
+
+        return [
+            {
+                f"{self.ids[row]}_{self.titles[row]}": (self.texts[row], 1.0 - score)
+                for row, score in rows
+            }
+            for rows in self.top_k(self.embed_queries(search_strs), n_results)
+        ]
+
+    def save(self) -> None:
+        """
+        Function that saves the index.
+        Writes to temporary files first so an interrupted run never leaves a corrupt index.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        old_matrix_path = self.__matrix_path
+        self.__matrix_name = f"{self.path.name}.{self.__version}.npy"
+        # np.save adds .npy to names that don't end with it
+        tmp_matrix = self.path.with_name(self.path.name + ".tmp.npy")
+        tmp_meta = self.path.with_name(self.path.name + ".meta.tmp")
+        np.save(tmp_matrix, self.embeddings)
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self.__version,
+                    "matrix": self.__matrix_name,
+                    "ids": self.ids,
+                    "titles": self.titles,
+                    "texts": self.texts,
+                },
+                f,
+            )
+        # Codes of the old embeddings must not outlive them if the run stops before they are rebuilt
+        self.__codes_path.unlink(missing_ok=True)
+        # The metadata still names the old matrix until it is replaced
+        os.replace(tmp_matrix, self.__matrix_path)
+        os.replace(tmp_meta, self.__meta_path)
+        if old_matrix_path != self.__matrix_path:
+            try:
+                old_matrix_path.unlink(missing_ok=True)
+            except OSError:
+                pass  # Still mapped on Windows, left behind
+
+        if self.quantization is not None:
+            self.__quantize()
+
+    def __quantize(self) -> None:
+        """
+        Helper function that quantizes the saved embeddings, saves the codes and swaps the
+        full precision embeddings for a memory map of them.
+        """
+        self.__codes_path.unlink(missing_ok=True)
+        self.embeddings = np.load(self.__matrix_path, mmap_mode="r")
+        rows, dimensions = self.embeddings.shape
+        if self.quantization == "int8":
+            # Symmetric per dimension scale, so the largest value of each dimension maps to 127
+            peak = np.zeros(dimensions, dtype=np.float32)
+            for start in range(0, rows, QUANTIZED_BLOCK_ROWS):
+                block = self.embeddings[start : start + QUANTIZED_BLOCK_ROWS]
+                peak = np.maximum(peak, np.abs(block).max(axis=0))
+            self.scale = np.maximum(peak, 1e-12) / 127
+            self.codes = np.empty((rows, dimensions), dtype=np.int8)
+            for start in range(0, rows, QUANTIZED_BLOCK_ROWS):
+                block = self.embeddings[start : start + QUANTIZED_BLOCK_ROWS]
+                self.codes[start : start + len(block)] = np.clip(
+                    np.rint(block / self.scale), -127, 127
+                )
+        else:
+            self.scale = np.ones(dimensions, dtype=np.float32)
+            self.codes = np.empty((rows, dimensions), dtype=np.float16)
+            for start in range(0, rows, QUANTIZED_BLOCK_ROWS):
+                block = self.embeddings[start : start + QUANTIZED_BLOCK_ROWS]
+                self.codes[start : start + len(block)] = block
+
+        # The scale first, codes are only used once both are written
+        np.save(self.__scale_path, self.scale)
+        tmp_codes = self.path.with_name(self.path.name + ".codes.tmp.npy")
+        np.save(tmp_codes, self.codes)
+        os.replace(tmp_codes, self.__codes_path)
+
+    def __load(self) -> None:
+        """
+        Helper function that loads the index from disk.
+        """
+        with open(self.__meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.__version = meta["version"]
+        # Indexes saved before the matrix was named by version
+        self.__matrix_name = meta.get("matrix", self.path.name + ".npy")
+        self.ids = meta["ids"]
+        self.titles = meta["titles"]
+        self.texts = meta["texts"]
+        if self.quantization is None:
+            self.embeddings = np.load(self.__matrix_path)
+        else:
+            self.embeddings = np.load(self.__matrix_path, mmap_mode="r")
+        if len(self.embeddings) != len(self.ids):
+            raise ValueError(
+                f"Numpy index '{self.path}' is corrupt, delete it to rebuild it."
+            )
+
+        if self.quantization is not None:
+            codes_dtype = np.int8 if self.quantization == "int8" else np.float16
+            if self.__codes_path.exists() and self.__scale_path.exists():
+                self.codes = np.load(self.__codes_path)
+                self.scale = np.load(self.__scale_path)
+            # Codes from another quantization or an older version of the index are rebuilt
+            if self.codes is None or (
+                self.codes.dtype != codes_dtype
+                or self.codes.shape != self.embeddings.shape
+            ):
+                self.__quantize()
+
+
+def get_vector_store(
+    backend: str = VECTOR_STORE_BACKEND,
+    query_cache: Optional[QueryEmbeddingCache] = None,
+) -> VectorStore:
+    """
+    Function that creates the vector store for a backend.
+
+    Parameters:
+    - backend: str, "chroma", "numpy" or "ivf_pq"
+    - query_cache: QueryEmbeddingCache, cache of query embeddings, one is created if not given
+
+    Returns:
+    - VectorStore, the vector store
+    """
+    if backend == "chroma":
+        # Imported here since chroma.py imports this module
+        from chroma import ChromaDB
+
+        return ChromaDB(query_cache=query_cache)
+    if backend == "numpy":
+        return NumpyVectorStore(query_cache=query_cache)
+    if backend == "ivf_pq":
+        from ivf_pq import IVFPQVectorStore
+
+        return IVFPQVectorStore(query_cache=query_cache)
+    raise ValueError(f"Unknown vector store backend {backend}.")
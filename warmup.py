@@ -0,0 +1,82 @@
+"""
+File that contains the warm-up run at startup, so the first question is answered as fast as the ones after it.
+
+Without it the first question pays for loading the embedding model, for reading the vector DB's
+index from disk and for Ollama loading the LLM's weights, one after the other. Instead each of
+these jobs runs in its own thread as soon as what it needs is ready, alongside the others and
+alongside loading the data, and how long each took is reported once they are all done.
+"""
+
+# Standard imports
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+WARMUP_TEXT = "What causes atrial fibrillation?"
+
+
+def warm_up_embedding_model() -> None:
+    """
+    Function that loads the embedding model and embeds a made-up query with it.
+    The query cache is not touched, so the query isn't cached.
+    """
+    # Imported here so only the warm-up thread waits for the model's libraries to load
+    from utils import get_embedding_model
+
+    get_embedding_model().encode(WARMUP_TEXT)
+
+
+class Warmup:
+    """
+    Class that runs the startup jobs in threads and reports how long each took.
+
+    Attributes:
+    - started: float, time.perf_counter() when the warm-up was created
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        # One thread per job, there are only a few and they mostly wait on I/O or native code
+        self.__executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            thread_name_prefix="warm-up"
+        )
+        self.__jobs: Dict[str, Future] = {}
+
+    def start(self, name: str, job: Callable, *args, **kwargs) -> None:
+        """
+        Function that starts a job in its own thread.
+
+        Parameters:
+        - name: str, name of the job in the report
+        - job: function to run, with args and kwargs
+        """
+        if self.__executor is None:
+            raise RuntimeError("The warm-up is already finished.")
+
+        def timed() -> float:
+            start = time.perf_counter()
+            job(*args, **kwargs)
+            return time.perf_counter() - start
+
+        self.__jobs[name] = self.__executor.submit(timed)
+
+    def wait(self) -> Dict[str, Optional[float]]:
+        """
+        Function that waits for every job and prints how long each took.
+        A job that failed is reported and otherwise ignored, since it only costs time later.
+
+        Returns:
+        - dict, name of every job mapped to its seconds (None if it failed)
+        """
+        timings = {}
+        for name, future in self.__jobs.items():
+            try:
+                timings[name] = future.result()
+                print(f"Warm-up: {name} ready in {timings[name]:.2f} s")
+            except Exception as e:
+                timings[name] = None
+                print(f"Warm-up: {name} failed: {e}")
+        self.__executor.shutdown()
+        self.__executor = None
+        print(f"Warm-up: done {time.perf_counter() - self.started:.2f} s after startup")
+        return timings